@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Benchmark of how cut set results are assembled, against writing into the DataFrame
+
+Processes synthetic minitrees with a cut set in two ways:
+
+    engine:   ManyLichen.process, which evaluates every lichen on views of the
+              columns it reads, assembles the cut columns in one boolean array
+              and adds them to the DataFrame column by column
+    in_place: the way lax processed cut sets before, where every lichen writes
+              its columns into the DataFrame with df.loc and the set column is
+              updated after each lichen
+
+and writes one JSON record per measurement, e.g.:
+
+    python benchmarks/benchmark_assembly.py --sizes 1e7 --output assembly.json
+
+Each record has the wall time, and the peak and remaining memory traced with
+tracemalloc while processing (in a second pass, as tracing slows down
+processing).  The DataFrame itself is made before tracing starts.  Both ways
+must give the same cut columns, which is checked on 1000 events first.
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from lax import __version__ as lax_version
+from lax import runs
+from lax.lichen import ManyLichen
+from lax.lichens import sciencerun0, sciencerun1
+from lax.synthetic import make_minitree
+
+from benchmark_lichens import END_OF_TIME, exclude
+
+SCIENCE_RUNS = {0: sciencerun0, 1: sciencerun1}
+
+
+def process_in_place(cuts, df):
+    """Process df with every lichen writing into it, without the result array
+
+    Derived variables are added as columns first, like lichens used to do in pre.
+    """
+    df.loc[:, cuts.name()] = True
+    for lichen in cuts.lichen_list:
+        for variable in lichen.derived_variables():
+            if variable.name not in df.columns:
+                df.loc[:, variable.name] = variable(df)
+        if isinstance(lichen, ManyLichen):
+            df = process_in_place(lichen, df)
+        else:
+            df = lichen._process_all(df)
+        df.loc[:, cuts.name()] = df[cuts.name()] & df[lichen.name()]
+    return df
+
+
+METHODS = {'engine': lambda cuts, df: cuts.process(df),
+           'in_place': process_in_place}
+
+
+def measure(method, cuts, n_events, memory=False, seed=0):
+    """Process synthetic events with one of METHODS
+
+    :return: (processed DataFrame, wall time in seconds, peak traced memory in
+              bytes or None, traced memory left after processing or None)
+    """
+    df = make_minitree(n_events, seed=seed)
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    try:
+        start = time.time()
+        df = METHODS[method](cuts, df)
+        seconds = time.time() - start
+        if memory:
+            remaining, peak = tracemalloc.get_traced_memory()
+        else:
+            remaining, peak = None, None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return df, seconds, peak, remaining
+
+
+def run(science_run, cut_set, method, cuts, n_events, memory=True):
+    """Time a way of processing, and measure its memory use in a second pass
+
+    :return: Dictionary describing the measurement
+    """
+    record = dict(lax_version=lax_version, science_run=science_run, cut_set=cut_set,
+                  method=method, n_events=n_events)
+    try:
+        _, seconds, _, _ = measure(method, cuts, n_events)
+        peak, remaining = None, None
+        if memory:
+            _, _, peak, remaining = measure(method, cuts, n_events, memory=True)
+        record.update(wall_time=seconds, events_per_second=n_events / max(seconds, 1e-9),
+                      peak_memory=peak, remaining_memory=remaining, error=None)
+    except Exception as error:
+        record.update(wall_time=None, events_per_second=None, peak_memory=None,
+                      remaining_memory=None, error='%s: %s' % (type(error).__name__, error))
+    print(json.dumps(record))
+    return record
+
+
+def check(cuts, n_events):
+    """Raise if both ways do not give the same cut columns"""
+    expected = measure('in_place', cuts, n_events)[0]
+    result = measure('engine', cuts, n_events)[0]
+    for cut_name in cuts.get_result_names():
+        if not np.array_equal(result[cut_name].values, expected[cut_name].values):
+            raise ValueError('%s differs between the ways of processing' % cut_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark assembling lax cut results")
+    parser.add_argument('--science_run', type=int, default=1, choices=sorted(SCIENCE_RUNS))
+    parser.add_argument('--cut_sets', nargs='+', default=['AllEnergy', 'LowEnergyBackground'],
+                        help='Cut sets to benchmark')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e7],
+                        help='Numbers of events')
+    parser.add_argument('--methods', nargs='+', default=sorted(METHODS),
+                        choices=sorted(METHODS))
+    parser.add_argument('--no_memory', action='store_true',
+                        help='Do not measure memory, which takes a second pass')
+    parser.add_argument('--exclude', nargs='*', default=[],
+                        help='Cut names to leave out, e.g. CutSingleElectronS2s')
+    parser.add_argument('--output', default=None,
+                        help='JSON file to write the records to')
+    args = parser.parse_args(sys.argv[1:])
+
+    runs.configure(source=lambda run_numbers: dict.fromkeys(run_numbers, END_OF_TIME))
+
+    records = []
+    module = SCIENCE_RUNS[args.science_run]
+    for cut_set in args.cut_sets:
+        check(exclude(getattr(module, cut_set)(), args.exclude), 1000)
+        for n_events in [int(size) for size in args.sizes]:
+            for method in args.methods:
+                cuts = exclude(getattr(module, cut_set)(), args.exclude)
+                records.append(run(args.science_run, cut_set, method, cuts,
+                                   n_events, not args.no_memory))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(records, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
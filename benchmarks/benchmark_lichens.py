@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""Benchmark of the SR0/SR1 cut sets and their lichens on synthetic minitrees
+
+Times every cut set and every lichen in it for a range of event counts and
+thread counts, and writes one JSON record per measurement, e.g.:
+
+    python benchmarks/benchmark_lichens.py --sizes 1e3 1e5 1e7 --threads 1 4 \
+        --output benchmark_lax1.5.2.json
+
+Each record has the lax version, science run, cut set, lichen (empty for the
+whole set), number of events and threads, wall time, events per second and
+peak memory traced while processing, so results of different lax versions can
+be compared.  Sizes above --max_frame events are processed in chunks.
+
+Run end times are not taken from the runs DB but set far after the synthetic
+events.  Lichens needing data files that are not available fail; their error
+is recorded and, with --exclude, they can be left out of the cut sets.
+
+The binomial test of S1AreaFractionTop, which dominates LowEnergyBackground,
+is also timed on its own (lichen 'binom_test', science run 0).
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from lax import __version__ as lax_version
+from lax import runs
+from lax.lichen import ManyLichen
+from lax.lichens import sciencerun0, sciencerun1
+from lax.synthetic import iter_minitree, make_minitree
+
+SCIENCE_RUNS = {0: sciencerun0, 1: sciencerun1}
+END_OF_TIME = 2**62  # ns, end time of every synthetic run
+CUT_SETS = ['AllEnergy', 'LowEnergyRn220', 'LowEnergyAmBe', 'LowEnergyBackground']
+
+
+def exclude(cuts, cut_names):
+    """Remove lichens by cut name from a cut set and its nested sets"""
+    cuts.lichen_list = [lichen for lichen in cuts.lichen_list
+                        if lichen.name() not in cut_names]
+    for lichen in cuts.lichen_list:
+        if isinstance(lichen, ManyLichen):
+            exclude(lichen, cut_names)
+    return cuts
+
+
+class Single(ManyLichen):
+    """Cut set of one lichen, to time lichens through the same engine"""
+
+    def __init__(self, lichen):
+        self.lichen_list = [lichen]
+
+    def name(self):
+        return self.lichen_list[0].name()
+
+
+def measure(cuts, n_events, chunk_size, memory=False, seed=0):
+    """Process synthetic events
+
+    :param memory: True or False on whether to trace memory, which slows
+                   down processing a lot
+    :return: (wall time in seconds, peak traced memory in bytes or None)
+    """
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    try:
+        if n_events <= chunk_size:
+            df = make_minitree(n_events, seed=seed)
+            if memory:
+                tracemalloc.reset_peak()
+            start = time.time()
+            cuts.process(df)
+            seconds = time.time() - start
+        else:
+            # Only count the time spent processing, not making chunks
+            seconds = 0.
+            for chunk in iter_minitree(n_events, chunk_size, seed=seed):
+                start = time.time()
+                cuts.process(chunk)
+                seconds += time.time() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def run(science_run, cut_set, lichen, cuts, n_events, n_threads, chunk_size, memory=True):
+    """Time a cut set, and measure its memory use in a second pass
+
+    :return: Dictionary describing the measurement
+    """
+    record = dict(lax_version=lax_version, science_run=science_run, cut_set=cut_set,
+                  lichen=lichen, n_events=n_events, n_threads=n_threads)
+    try:
+        cuts.parallel(n_threads)
+        seconds, _ = measure(cuts, n_events, chunk_size)
+        peak = measure(cuts, n_events, chunk_size, memory=True)[1] if memory else None
+        record.update(wall_time=seconds, events_per_second=n_events / max(seconds, 1e-9),
+                      peak_memory=peak, error=None)
+    except Exception as error:
+        record.update(wall_time=None, events_per_second=None, peak_memory=None,
+                      error='%s: %s' % (type(error).__name__, error))
+    print(json.dumps(record))
+    return record
+
+
+def run_binom_test(n_events, seed=0):
+    """Time sciencerun0.binom_test on the S1 area fraction top of synthetic events
+
+    :return: Dictionary describing the measurement, see run
+    """
+    df = make_minitree(n_events, seed=seed)
+    r = np.sqrt(df['x'].values ** 2 + df['y'].values ** 2)
+    aft = sciencerun0.get_s1_aft_map().ev(r, df['z'].values)
+    s1 = df['s1'].values
+    gc.collect()
+    start = time.time()
+    sciencerun0.binom_test(s1 * df['s1_area_fraction_top'].values, s1, aft)
+    seconds = time.time() - start
+    record = dict(lax_version=lax_version, science_run=0, cut_set='', lichen='binom_test',
+                  n_events=n_events, n_threads=1, wall_time=seconds,
+                  events_per_second=n_events / max(seconds, 1e-9), peak_memory=None, error=None)
+    print(json.dumps(record))
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lax cuts on synthetic minitrees")
+    parser.add_argument('--science_runs', type=int, nargs='+', default=[0, 1],
+                        choices=sorted(SCIENCE_RUNS))
+    parser.add_argument('--cut_sets', nargs='+', default=CUT_SETS,
+                        help='Cut sets to benchmark')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e3, 1e4, 1e5, 1e6],
+                        help='Numbers of events (up to 1e8)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1],
+                        help='Numbers of threads to process lichens with')
+    parser.add_argument('--max_frame', type=float, default=1e7,
+                        help='Process more events than this in chunks of this size')
+    parser.add_argument('--no_lichens', action='store_true',
+                        help='Only time whole cut sets')
+    parser.add_argument('--no_memory', action='store_true',
+                        help='Do not measure memory, which takes a second pass')
+    parser.add_argument('--exclude', nargs='*', default=[],
+                        help='Cut names to leave out, e.g. CutSingleElectronS2s')
+    parser.add_argument('--output', default=None,
+                        help='JSON file to write the records to')
+    args = parser.parse_args(sys.argv[1:])
+
+    runs.configure(source=lambda run_numbers: dict.fromkeys(run_numbers, END_OF_TIME))
+
+    records = []
+    chunk_size = int(args.max_frame)
+    if 0 in args.science_runs and not args.no_lichens:
+        records.extend(run_binom_test(int(size)) for size in args.sizes
+                       if size <= args.max_frame)
+    for science_run in args.science_runs:
+        module = SCIENCE_RUNS[science_run]
+        for cut_set in args.cut_sets:
+            for n_events in [int(size) for size in args.sizes]:
+                for n_threads in args.threads:
+                    cuts = exclude(getattr(module, cut_set)(), args.exclude)
+                    records.append(run(science_run, cut_set, '', cuts,
+                                       n_events, n_threads, chunk_size, not args.no_memory))
+                    if args.no_lichens or n_threads != args.threads[0]:
+                        continue
+                    for lichen in cuts.lichen_list:
+                        records.append(run(science_run, cut_set, lichen.name(), Single(lichen),
+                                           n_events, 1, chunk_size, not args.no_memory))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(records, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
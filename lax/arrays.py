@@ -0,0 +1,104 @@
+"""Lichens on numpy arrays instead of DataFrames
+
+Cuts can be applied to a dictionary of column name to numpy array or to a
+structured (record) array, and return their results as arrays:
+
+    data = np.load('background.npz')
+    results = sciencerun1.LowEnergyBackground().evaluate_arrays(dict(data))
+    passed = results['CutLowEnergyBackground']
+
+The columns are wrapped in an ArrayFrame without copying them.  Cut sets, and
+string cuts that are fully described by their string, work on the ArrayFrame
+directly.  Every other lichen gets a DataFrame view on only the columns it
+reads, so no index alignment or copy of the whole input is needed.
+"""
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def get_columns(data):
+    """Columns of data as numpy arrays, without copying
+
+    :param data: Dictionary of column name to array, structured or record
+                 array, DataFrame or ArrayFrame
+    :return: OrderedDict of column name to 1-d numpy array
+    """
+    if isinstance(data, ArrayFrame):
+        return OrderedDict(data.arrays)
+    if isinstance(data, pd.DataFrame):
+        return OrderedDict((column, data[column].values) for column in data.columns)
+    if isinstance(data, np.ndarray):
+        if data.dtype.names is None:
+            raise TypeError('Array without fields, use a structured array')
+        return OrderedDict((name, data[name]) for name in data.dtype.names)
+    if isinstance(data, dict):
+        return OrderedDict((column, np.asarray(values)) for column, values in data.items())
+    raise TypeError('Cannot get columns from %s' % type(data).__name__)
+
+
+class _Rows(object):
+    """Row selection of an ArrayFrame, like DataFrame.iloc"""
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __getitem__(self, rows):
+        return ArrayFrame(OrderedDict((column, values[rows])
+                                      for column, values in self.frame.arrays.items()))
+
+
+class ArrayFrame(object):
+    """Columns of equal length, with the parts of the DataFrame interface lax uses
+
+    Selecting a column returns its numpy array, selecting a list of columns
+    returns another ArrayFrame.  Nothing is copied.
+
+    :param data: See get_columns
+    """
+
+    def __init__(self, data):
+        self.arrays = get_columns(data)
+        lengths = set(len(values) for values in self.arrays.values())
+        if len(lengths) > 1:
+            raise ValueError('Columns have different lengths %s' % sorted(lengths))
+        self.n_rows = lengths.pop() if lengths else 0
+        self.iloc = _Rows(self)
+
+    @property
+    def columns(self):
+        return list(self.arrays.keys())
+
+    @property
+    def index(self):
+        return pd.RangeIndex(self.n_rows)
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, column):
+        return column in self.arrays
+
+    def __getitem__(self, key):
+        if isinstance(key, (list, tuple)):
+            return ArrayFrame(OrderedDict((column, self.arrays[column]) for column in key))
+        return self.arrays[key]
+
+    def to_frame(self, columns=None):
+        """DataFrame on the same arrays
+
+        :param columns: Columns to include, all if None
+        """
+        columns = self.columns if columns is None else list(columns)
+        return pd.DataFrame(OrderedDict((column, self.arrays[column]) for column in columns),
+                            index=self.index, columns=columns, copy=False)
+
+
+def as_frame(df):
+    """DataFrame of df, which may be an ArrayFrame"""
+    if isinstance(df, ArrayFrame):
+        return df.to_frame()
+    return df
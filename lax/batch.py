@@ -0,0 +1,423 @@
+"""Processing many runs with laxer
+
+Used by laxer for single runs and for batches of runs.  A batch is a list of
+jobs (run numbers, or MC filenames) spread over a pool of worker processes.
+Every worker makes the cut sets and loads the classifiers once and keeps them
+for all its jobs:
+
+    laxer --run_numbers 6731-6800 7000 --sciencerun 1 --processes 8 \
+        --pax_version 6.8.0 --minitree_path /project/minitrees --output_path lax_sr1
+
+Input files are processed chunk_size events at a time, so only one chunk of
+a run is in memory.  With slim output only the event keys and the cut columns are written, which
+join_cuts adds back to the minitrees.
+
+Progress is logged with the logging module, which laxer sets up to print it.
+
+Finished jobs are recorded in a manifest (a JSON file, by default in the
+output directory), so a batch that is killed continues where it stopped when
+started again.  Failed jobs are recorded with their error and tried again.
+"""
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from lax import columnar, runs
+from lax.cache import ResultCache
+from lax.lichen import CutSets
+from lax.lichens import sciencerun0, sciencerun1
+from lax.minitrees import required_minitrees
+from lax.stream import rechunk
+
+log = logging.getLogger(__name__)
+
+# Columns identifying the events, always read from an input file
+KEY_COLUMNS = ['run_number', 'event_number']
+
+# Loaded if the minitrees the cuts read are unknown
+MINITREE_NAMES = ['Fundamentals', 'Corrections', 'Basics', 'TotalProperties',
+                  'Extended', 'TailCut', 'Proximity', 'PositionReconstruction',
+                  'LargestPeakProperties', 'FlashIdentification']
+
+# Minitrees and cuts that mean nothing for MC
+MC_MINITREES = ('TailCut', 'Proximity', 'FlashIdentification')
+MC_CUTS = ('DAQVeto', 'S2Tails', 'Flash', 'MuonVeto')
+
+
+def get_cut_sets(science_run, mc=False, verbose=False):
+    """Cut sets written by laxer
+
+    :param science_run: 0 or 1
+    :param mc: True to remove cuts that mean nothing for MC
+    """
+    # Harcode warning: This should be more flexible, allowing
+    # specification of SR and sample, or drawing from RunsDB
+    if science_run == 0:
+        cut_sets = [sciencerun0.AllEnergy(),
+                    sciencerun0.LowEnergyRn220(),
+                    sciencerun0.LowEnergyAmBe(),
+                    sciencerun0.LowEnergyBackground()]
+
+    elif science_run == 1:
+        cut_sets = [sciencerun1.AllEnergy(),
+                    sciencerun1.LowEnergyRn220(),
+                    sciencerun1.LowEnergyAmBe(),
+                    sciencerun1.LowEnergyNG(),
+                    sciencerun1.LowEnergyBackground()]
+
+    else:
+        raise ValueError('Unknown science run %s' % science_run)
+
+    if mc:
+        for cuts in cut_sets:
+            if verbose:
+                log.info("Pruning cuts for MC: %s", cuts)
+
+            cuts.lichen_list = [lichen for lichen in cuts.lichen_list
+                                if not any(name in lichen.name() for name in MC_CUTS)]
+
+            if verbose:
+                log.info("%s", cuts.lichen_list)
+
+    return cut_sets
+
+
+def get_minitree_names(cut_sets, mc=False):
+    """Minitrees the cut sets read, or all of them if that is unknown"""
+    try:
+        return required_minitrees(cut_sets)
+    except KeyError as error:
+        log.info("Loading all minitrees: %s", error)
+    return [name for name in MINITREE_NAMES if not (mc and name in MC_MINITREES)]
+
+
+def get_input_columns(cut_sets):
+    """Columns to read from an input file, or None for all"""
+    columns = set(KEY_COLUMNS)
+    for cuts in cut_sets:
+        required = cuts.required_columns()
+        if required is None:
+            return None
+        columns |= required
+    return columns
+
+
+def init_hax(settings):
+    """Initialize hax for the minitree path and pax version of the settings"""
+    import hax
+
+    hax_kwargs = {'experiment': 'XENON1T',
+                  'pax_version_policy': 'loose' if settings['mc'] else settings['pax_version'],
+                  'minitree_paths': ['.', settings['minitree_path']]
+                  }
+
+    hax.init(**hax_kwargs)
+    log.info("hax initialized with %s", hax_kwargs)
+    return hax
+
+
+def read_events(settings, cut_sets, job):
+    """DataFrames of the events of a job, from hax or an input file
+
+    Input files are read chunk_size events at a time (by default a row group
+    at a time), so a run never needs to fit in memory.  hax loads all events
+    of a run at once.
+
+    :param settings: Dictionary of laxer options, see get_settings
+    :param job: Run number, or MC filename
+    :return: Iterable of DataFrames, numbered by one running index
+    """
+    if settings['input'] is not None:
+        path = settings['input'].format(run=job)
+        log.info("Reading events from %s", path)
+        return number_rows(columnar.read(path, get_input_columns(cut_sets), settings['chunk_size']))
+
+    import hax
+    minitree_names = get_minitree_names(cut_sets, settings['mc'])
+    df = hax.minitrees.load(job, minitree_names)
+    log.info("RUN_NUMBER = %s, MINITREE_NAMES = %s", job, minitree_names)
+    return [df] if settings['chunk_size'] is None else rechunk([df], settings['chunk_size'])
+
+
+def number_rows(chunks):
+    """Index a stream of DataFrames by row number, like pd.concat with ignore_index"""
+    start = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+
+def process_run(settings, cut_sets, job, output_file, profiler=None):
+    """Apply the cut sets to the events of a job and write them, chunk by chunk
+
+    :param settings: Dictionary of laxer options, see get_settings
+    :param cut_sets: List of cut sets, see get_cut_sets
+    :param job: Run number, or MC filename
+    :param output_file: Filename, with the extension of the output format
+    :param profiler: lax.profiling.Profiler, or None
+    :return: Number of events written
+    """
+    events = read_events(settings, cut_sets, job)
+
+    # One cache for all sets, so each column is hashed once
+    result_cache = None
+    if settings['cache_path'] is not None:
+        result_cache = ResultCache(settings['cache_path'])
+    for cuts in cut_sets:
+        cuts.keep(settings['keep_columns']).cache(result_cache).profile(profiler)
+        cuts.pack(settings['packed'])
+
+    # Lichens in several cut sets are evaluated once
+    if settings['slim']:
+        chunks = (get_cut_columns(chunk, cut_sets) for chunk in events)
+    else:
+        chunks = (CutSets(cut_sets).process(chunk) for chunk in events)
+
+    n_events = write_output(chunks, output_file, settings)
+    log.info("Output file written to: %s", output_file)
+    return n_events
+
+
+def get_cut_columns(df, cut_sets):
+    """DataFrame of the event keys and the columns the cut sets add, without the minitree columns
+
+    Columns of a cut that is in several sets are included once.
+    """
+    columns = OrderedDict((column, df[column].values) for column in KEY_COLUMNS)
+    for results in CutSets(cut_sets).results(df):
+        for column in results.columns:
+            if column not in columns:
+                columns[column] = results[column].values
+    return pd.DataFrame(columns, index=df.index)
+
+
+def write_output(chunks, output_file, settings):
+    """Write a stream of processed events in the output format of the settings
+
+    :param chunks: Iterable of DataFrames, each written as it comes
+    :return: Number of events written
+    """
+    if settings['output_format'] == 'root':
+        import root_pandas  # noqa: adds DataFrame.to_root
+        tree_name = 'treemc' if settings['mc'] else 'tree'
+        n_events = 0
+        for i, chunk in enumerate(chunks):
+            chunk.to_root(output_file, tree_name, mode='a' if i else 'w')
+            n_events += len(chunk)
+        return n_events
+    return columnar.write(chunks, output_file, settings['compression'])
+
+
+def join_cuts(df, path, columns=None):
+    """Add cut columns written by laxer --slim to events, matching them by key
+
+    :param df: DataFrame with the KEY_COLUMNS, e.g. minitrees loaded by hax
+    :param path: Parquet or Arrow file written by laxer
+    :param columns: Cut columns to read, by default all
+    :return: DataFrame, with the rows of df
+    """
+    if columns is not None:
+        columns = KEY_COLUMNS + [column for column in columns if column not in KEY_COLUMNS]
+    cuts = pd.concat(list(columnar.read(path, columns)), ignore_index=True)
+    return df.merge(cuts, how='left', on=KEY_COLUMNS, validate='many_to_one')
+
+
+def get_settings(science_run, pax_version=None, minitree_path=None, input_path=None, mc=False,
+                 keep_columns=(), cache_path=None, output_format='root', compression=None,
+                 slim=False, packed=False, chunk_size=None,
+                 run_end_times=None, runs_file=None, verbose=False):
+    """Dictionary of laxer options, given to the workers of a batch
+
+    :param input_path: Parquet or Arrow file to read instead of hax minitrees.
+                       {run} is replaced by the run number (or MC filename).
+    :param mc: True if the jobs are MC filenames
+    :param slim: True to only write the event keys and the cut columns, see join_cuts
+    :param packed: True to write the cuts of each set as bits, see lax.bitmask
+    :param chunk_size: Number of events read, processed and written at once (the row
+                       group size of the output), or None for a row group or run at a time
+    """
+    return dict(science_run=science_run, pax_version=pax_version, minitree_path=minitree_path,
+                input=input_path, mc=mc, keep_columns=list(keep_columns), cache_path=cache_path,
+                output_format=output_format, compression=compression,
+                slim=slim, packed=packed, chunk_size=chunk_size,
+                run_end_times=run_end_times, runs_file=runs_file, verbose=verbose)
+
+
+def configure(settings):
+    """Set up this process for the settings: run end times, cut sets, classifiers
+
+    :return: List of cut sets
+    """
+    runs.configure(settings['run_end_times'],
+                   None if settings['runs_file'] is None else runs.FileSource(settings['runs_file']))
+
+    cut_sets = get_cut_sets(settings['science_run'], settings['mc'], settings['verbose'])
+
+    # Load the classifiers once, they are shared by all cut sets
+    for cuts in cut_sets:
+        cuts.preload()
+
+    return cut_sets
+
+
+# State of a worker process, kept between its jobs
+WORKER = {}
+
+
+def init_worker(settings, output_path):
+    """Make the cut sets of a worker, unless it already has them (e.g. after fork)"""
+    if WORKER.get('settings') != settings:
+        WORKER.clear()
+        WORKER.update(settings=settings, cut_sets=configure(settings), hax=False)
+    WORKER['output_path'] = output_path
+
+
+def process_job(job):
+    """Process one job in a worker, see init_worker
+
+    Errors are returned instead of raised, so one bad run does not stop a batch.
+
+    :return: (job name, manifest entry)
+    """
+    settings = WORKER['settings']
+    name = get_job_name(job)
+    output_file = os.path.join(WORKER['output_path'], get_output_name(settings, job))
+    start = time.time()
+    try:
+        if settings['input'] is None and not WORKER['hax']:
+            init_hax(settings)
+            WORKER['hax'] = True
+        n_events = process_run(settings, WORKER['cut_sets'], job, output_file)
+    except Exception as error:
+        log.exception("Job %s failed", name)
+        return name, dict(status='failed', error='%s: %s' % (type(error).__name__, error),
+                          seconds=time.time() - start)
+    return name, dict(status='done', output=output_file, events=n_events,
+                      seconds=time.time() - start)
+
+
+def get_job_name(job):
+    return str(job)
+
+
+def get_output_name(settings, job):
+    """Default output filename of a job, e.g. 6731_lax_SR1.root"""
+    return '%s_lax_SR%d.%s' % (job, settings['science_run'], settings['output_format'])
+
+
+def parse_run_numbers(items):
+    """List of run numbers from strings like '6731' or '6731-6800' (inclusive)"""
+    run_numbers = []
+    for item in items:
+        if '-' in item.lstrip('-'):
+            first, last = item.split('-', 1)
+            run_numbers += list(range(int(first), int(last) + 1))
+        else:
+            run_numbers.append(int(item))
+    return run_numbers
+
+
+def read_job_list(path):
+    """List of jobs in a text file, one per line, skipping empty lines and # comments
+
+    Lines that are run numbers give integers, others (e.g. MC filenames) strings.
+    """
+    jobs = []
+    with open(path) as infile:
+        for line in infile:
+            line = line.split('#')[0].strip()
+            if line:
+                jobs.append(int(line) if line.isdigit() else line)
+    return jobs
+
+
+class Manifest(object):
+    """Jobs of a batch and their results, kept in a JSON file
+
+    :param path: JSON file of job name to entry, a dictionary with the status
+                 ('done' or 'failed'), the time taken and the output file and
+                 number of events or the error
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = read_manifest(path)
+
+    def is_done(self, job):
+        return self.jobs.get(get_job_name(job), {}).get('status') == 'done'
+
+    def record(self, name, entry):
+        """Store the entry of a finished job, and write the file"""
+        self.jobs[name] = entry
+        self.save()
+
+    def save(self):
+        """Write the manifest, replacing the file at once so it is never half written"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        with os.fdopen(handle, 'w') as outfile:
+            json.dump(self.jobs, outfile, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+
+
+def read_manifest(path):
+    """Dictionary of job name to entry from a manifest file, empty if there is none"""
+    try:
+        with open(path) as infile:
+            return json.load(infile)
+    except (IOError, OSError):
+        return {}
+
+
+def run_batch(jobs, settings, output_path='.', manifest_path=None, n_processes=1):
+    """Process jobs on a pool of worker processes, skipping those done before
+
+    :param jobs: List of run numbers or MC filenames
+    :param settings: Dictionary of laxer options, see get_settings
+    :param output_path: Directory to write the output files to
+    :param manifest_path: Manifest file, by default lax_manifest_SR<science run>.json
+                          in output_path
+    :param n_processes: Number of worker processes, 1 to process in this process
+    :return: Manifest
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(output_path, 'lax_manifest_SR%d.json' % settings['science_run'])
+    manifest = Manifest(manifest_path)
+    pending = [job for job in jobs if not manifest.is_done(job)]
+    log.info("Processing %d of %d jobs, the others are in %s", len(pending), len(jobs), manifest_path)
+
+    # Classifiers loaded here are shared with forked workers
+    init_worker(settings, output_path)
+
+    if n_processes > 1 and len(pending) > 1:
+        pool = multiprocessing.Pool(n_processes, init_worker, (settings, output_path))
+        results = pool.imap_unordered(process_job, pending)
+    else:
+        pool = None
+        results = (process_job(job) for job in pending)
+
+    try:
+        for name, entry in results:
+            manifest.record(name, entry)
+            log.info("%s %s in %.1f s", name, entry['status'], entry['seconds'])
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    failed = [get_job_name(job) for job in jobs if not manifest.is_done(job)]
+    if failed:
+        log.warning("Failed jobs: %s", ", ".join(failed))
+    return manifest
@@ -0,0 +1,114 @@
+"""Bit-packed storage of cut results
+
+Instead of one boolean column per cut, all cuts of a cut set are stored as bits
+of unsigned 64-bit integer columns named <set name>_bits0, <set name>_bits1, ...
+Bit i of word i // 64 holds the i-th cut of ManyLichen.get_all_cut_names().
+CutMask reads single cuts, combinations or the set column back from these.
+"""
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+BITS_PER_WORD = 64
+
+
+def get_bit_names(cuts):
+    """Names of the cuts stored as bits, in bit order
+
+    :param cuts: ManyLichen
+    :return: List of cut names without duplicates
+    """
+    bit_names = []
+    for cut_name in cuts.get_all_cut_names():
+        if cut_name not in bit_names:
+            bit_names.append(cut_name)
+    return bit_names
+
+
+def get_word_names(name, n_bits):
+    return ['%s_bits%d' % (name, i)
+            for i in range((n_bits + BITS_PER_WORD - 1) // BITS_PER_WORD)]
+
+
+def pack(columns):
+    """Pack boolean arrays into unsigned 64-bit words
+
+    :param columns: List of boolean arrays of equal length
+    :return: List of numpy.uint64 arrays
+    """
+    words = []
+    for start in range(0, len(columns), BITS_PER_WORD):
+        word = np.zeros(len(columns[0]), dtype=np.uint64)
+        for bit, values in enumerate(columns[start:start + BITS_PER_WORD]):
+            word |= np.asarray(values, dtype=np.uint64) << np.uint64(bit)
+        words.append(word)
+    return words
+
+
+def pack_columns(df, cuts):
+    """Replace the boolean cut columns of a cut set by packed words
+
+    :param df: DataFrame processed by cuts
+    :param cuts: ManyLichen
+    :return: DataFrame
+    """
+    bit_names = get_bit_names(cuts)
+    words = pack([df[cut_name].values for cut_name in bit_names])
+    df = df.drop([cuts.name()] + bit_names, axis=1)
+    for word_name, word in zip(get_word_names(cuts.name(), len(bit_names)), words):
+        df.loc[:, word_name] = word
+    return df
+
+
+class CutMask(object):
+    """Read access to cut results packed with pack_columns
+
+    Example:
+        mask = CutMask(df, sciencerun1.LowEnergyBackground())
+        df[mask['CutS2Width'] & ~mask.passed(['CutFlash'])]
+    """
+
+    def __init__(self, df, cuts):
+        self.name = cuts.name()
+        self.bit_names = get_bit_names(cuts)
+        self.set_names = cuts.get_cut_names()
+        self.words = [df[word_name].values
+                      for word_name in get_word_names(self.name, len(self.bit_names))]
+
+    def __getitem__(self, cut_name):
+        """Boolean array of a single cut"""
+        return self.passed([cut_name])
+
+    def __len__(self):
+        return len(self.words[0]) if self.words else 0
+
+    def passed(self, cut_names=None):
+        """Boolean array of events passing all given cuts
+
+        :param cut_names: List of cut names, by default those of the set itself
+                          (i.e. the values of the set column)
+        """
+        if cut_names is None:
+            cut_names = self.set_names
+
+        masks = [0] * len(self.words)
+        for cut_name in cut_names:
+            bit = self.bit_names.index(cut_name)
+            masks[bit // BITS_PER_WORD] |= 1 << (bit % BITS_PER_WORD)
+
+        result = np.ones(len(self), dtype=bool)
+        for word, mask in zip(self.words, masks):
+            if mask:
+                mask = np.uint64(mask)
+                result &= (word & mask) == mask
+        return result
+
+    def to_dict(self):
+        """Unpack all cuts, including the set column
+
+        :return: Dictionary of cut name to boolean array
+        """
+        result = {self.name: self.passed()}
+        for cut_name in self.bit_names:
+            result[cut_name] = self[cut_name]
+        return result
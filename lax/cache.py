@@ -0,0 +1,352 @@
+"""On-disk cache of cut results
+
+Reprocessing after changing one cut only needs that cut to be recomputed.  The
+results of every lichen are stored under a key made of the run number, the
+lichen class, its version, its parameters and a fingerprint of the columns it
+reads.  A lichen whose code changes must get a new version to be recomputed.
+
+Example:
+    cuts = sciencerun1.LowEnergyBackground().cache('/scratch/lax_cache')
+    df = cuts.process(df)
+
+The least recently used results are removed when the cache grows beyond its
+maximum size.  The size is counted as results are stored, so the directory is
+only listed when results have to be removed.
+
+SharedResults keeps results in memory instead, so that cut sets processed
+together evaluate the lichens they have in common once.  As these results
+only live for one call, they are keyed by the identity of the input columns
+rather than by their contents.  For the same reason each column is only
+hashed once per call for the on-disk keys, also when many lichens read it.
+"""
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from lax.derived import Derived, get_identity
+
+# Types of class attributes that are part of the parameters of a lichen
+PARAMETER_TYPES = (bool, int, float, str, tuple, list, dict, np.number, type(None))
+
+# Attributes that change how a lichen is processed, not its results
+SETTING_NAMES = ('lichen_list', 'kept_columns', 'plots', 'variables', 'profiler', 'result_cache')
+
+
+def get_parameters(lichen):
+    """Description of everything that configures a lichen, as a string
+
+    This includes the plain class and instance attributes (string,
+    allowed_range, parameter_values, version, ...), the parameters of a
+    StringLichen and the class and parameters of the lichens it uses (e.g.
+    the S2Width of S1SingleScatter).  Methods are not included, a lichen
+    of which the code changes needs a new version.
+
+    :raises TypeError: if an attribute is neither of these
+    """
+    attributes = {}
+    for cls in reversed(type(lichen).__mro__):
+        attributes.update(vars(cls))
+    attributes.update(vars(lichen))
+
+    parameters = []
+    for key, value in sorted(attributes.items()):
+        if key.startswith('_') or key in SETTING_NAMES:
+            continue
+        if key == 'derived_columns':
+            value = [variable.key() if isinstance(variable, Derived) else variable
+                     for variable in value]
+        elif is_lichen(value):
+            if isinstance(value, type):
+                value = value()
+            value = (get_class_name(value), get_parameters(value))
+        elif isinstance(value, (staticmethod, classmethod, property)) or callable(value):
+            continue
+        elif not isinstance(value, PARAMETER_TYPES):
+            raise TypeError("Cannot describe %s of %s, of type %s, for the cache key" % (
+                key, lichen.name(), type(value).__name__))
+        parameters.append((key, value))
+    if hasattr(lichen, 'parameters'):
+        parameters.append(('parameters()', sorted(lichen.parameters().items())))
+    return repr(parameters)
+
+
+def is_lichen(value):
+    """Whether value is a lichen or a lichen class"""
+    return all(hasattr(value, name) for name in ('produced_columns', 'required_columns', 'version'))
+
+
+def get_class_name(lichen):
+    return '%s.%s' % (type(lichen).__module__, type(lichen).__name__)
+
+
+def get_key(lichen, df, run_number=None, digests=None):
+    """Key of the results of a lichen on df
+
+    :param lichen: Lichen
+    :param df: DataFrame with the columns the lichen reads
+    :param run_number: Run number, or None if not known
+    :param digests: Digests of the columns of df, or None to hash them
+    :return: String, or None if the results cannot be cached because the
+             columns the lichen reads are unknown
+    """
+    columns = lichen.required_columns()
+    if columns is None:
+        return None
+    if digests is None:
+        digests = Digests()
+
+    digest = hashlib.sha1()
+    digest.update(get_class_name(lichen).encode())
+    digest.update(get_parameters(lichen).encode())
+    digest.update(str(len(df)).encode())
+    for column in sorted(columns):
+        digest.update(column.encode())
+        digest.update(digests.get(df[column]))
+    return '%s_%s_%s' % (run_number, lichen.name(), digest.hexdigest())
+
+
+def hash_column(values):
+    """SHA-1 digest of the type and contents of an array"""
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha1()
+    digest.update(str(values.dtype).encode())
+    digest.update(values.view(np.uint8))
+    return digest.digest()
+
+
+class Digests(object):
+    """Digests of columns, each array is hashed once
+
+    Arrays are recognized by their identity, so their contents must not change
+    while the digests are used, e.g. during one call.  The arrays are kept
+    alive, so their identities are not reused.
+    """
+
+    def __init__(self):
+        self.digests = {}
+        self.lock = threading.Lock()
+
+    def get(self, values):
+        """Digest of an array, see hash_column"""
+        values = np.asarray(values)
+        key = get_identity(values) + (str(values.dtype),)
+        with self.lock:
+            entry = self.digests.get(key)
+        if entry is None:
+            entry = hash_column(values), values
+            with self.lock:
+                self.digests[key] = entry
+        return entry[0]
+
+
+class ResultCache(object):
+    """Cache of lichen results in a directory
+
+    :param path: Directory to store the results in, created if needed
+    :param max_bytes: Maximum total size of the stored results
+    """
+    evict_fraction = 0.8  # fraction of max_bytes left after removing results
+
+    def __init__(self, path, max_bytes=10 * 1024**3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = None  # total bytes stored, counted when first needed
+        self.lock = threading.Lock()
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def get_key(self, lichen, df, run_number=None, digests=None):
+        return get_key(lichen, df, run_number, digests)
+
+    def get_filename(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def load(self, key):
+        """Stored results, or None if there are none
+
+        :return: OrderedDict of column name to array
+        """
+        filename = self.get_filename(key)
+        try:
+            with np.load(filename, allow_pickle=False) as data:
+                names = [str(name) for name in data['_names']]
+                results = OrderedDict((name, data['column%d' % i])
+                                      for i, name in enumerate(names))
+            # The modification time tracks when results were last used
+            os.utime(filename, None)
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return results
+
+    def save(self, key, results):
+        """Store results
+
+        :param results: Dictionary of column name to array
+        """
+        arrays = dict(('column%d' % i, np.asarray(values))
+                      for i, values in enumerate(results.values()))
+        arrays['_names'] = np.array(list(results.keys()))
+
+        # Write to a temporary file first, so readers never see half a file
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        with os.fdopen(handle, 'wb') as file:
+            np.savez(file, **arrays)
+        filename = self.get_filename(key)
+        replaced = get_file_size(filename)
+        added = os.path.getsize(temporary)
+        os.replace(temporary, filename)
+
+        with self.lock:
+            if self.size is None:
+                self.size = self.get_size()
+            else:
+                self.size += added - replaced
+            full = self.size > self.max_bytes
+        if full:
+            self.evict()
+
+    def get_size(self):
+        return sum(os.path.getsize(filename) for filename, _ in self.list_files())
+
+    def list_files(self):
+        """List of (filename, last use) of all stored results, least recently used first"""
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                filename = os.path.join(self.path, name)
+                try:
+                    files.append((filename, os.path.getmtime(filename)))
+                except OSError:
+                    pass
+        return sorted(files, key=lambda item: item[1])
+
+    def evict(self):
+        """Remove least recently used results until the cache is below evict_fraction of max_bytes
+
+        The size is counted again, as other processes may share the directory.
+        """
+        with self.lock:
+            files = self.list_files()
+            sizes = [get_file_size(filename) for filename, _ in files]
+            total = sum(sizes)
+            for (filename, _), size in zip(files, sizes):
+                if total <= self.evict_fraction * self.max_bytes:
+                    break
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                total -= size
+            self.size = total
+
+    def clear(self):
+        with self.lock:
+            for filename, _ in self.list_files():
+                os.remove(filename)
+            self.size = 0
+
+    def evaluate(self, lichen, df, run_number=None, digests=None):
+        """Results of a lichen on df, from the cache if possible
+
+        :param lichen: Lichen
+        :param df: DataFrame with the columns the lichen reads
+        :param run_number: Run number, or None if not known
+        :param digests: Digests of the columns of df, or None to hash them
+        :return: OrderedDict of column name to array, see Lichen.evaluate
+        """
+        key = self.get_key(lichen, df, run_number, digests)
+        if key is None:
+            return lichen.evaluate(df)
+        results = self.load(key)
+        if results is None or any(len(values) != len(df) for values in results.values()):
+            results = lichen.evaluate(df)
+            self.save(key, results)
+        return results
+
+
+class SharedResults(object):
+    """Results of lichens kept in memory, shared by several cut sets
+
+    Lichens of the same class, version and parameters reading the same
+    column arrays are evaluated once, see lax.lichen.CutSets.  The columns
+    must not change in place while the results are shared.
+
+    :param result_cache: ResultCache to use for results not in memory, or None
+    :param results: Dictionary of key to (results, input arrays), shared with
+                    other SharedResults
+    :param digests: Digests of the columns for result_cache, shared with other
+                    SharedResults, or None for new ones
+    """
+
+    def __init__(self, result_cache=None, results=None, digests=None):
+        self.result_cache = result_cache
+        self.results = {} if results is None else results
+        self.digests = Digests() if digests is None else digests
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, lichen, df, run_number=None):
+        """Key of the results of a lichen on the columns of df, see get_key
+
+        :return: Tuple, or None if the columns the lichen reads are unknown
+        """
+        columns = lichen.required_columns()
+        if columns is None:
+            return None
+        return (get_class_name(lichen), get_parameters(lichen), run_number, len(df),
+                tuple((column, get_identity(np.asarray(df[column])))
+                      for column in sorted(columns)))
+
+    def evaluate(self, lichen, df, run_number=None, digests=None):
+        """Results of a lichen on df, evaluated once, see ResultCache.evaluate
+
+        The columns are hashed with the digests of this SharedResults.
+        """
+        key = self.get_key(lichen, df, run_number)
+        if key is None:
+            return lichen.evaluate(df)
+        with self.lock:
+            results = self.results.get(key)
+        if results is not None:
+            self.hits += 1
+            return results[0]
+
+        self.misses += 1
+        if self.result_cache is None:
+            results = lichen.evaluate(df)
+        else:
+            results = self.result_cache.evaluate(lichen, df, run_number, self.digests)
+        # The input columns are kept alive, so their identities are not reused
+        inputs = [np.asarray(df[column]) for column in lichen.required_columns()]
+        with self.lock:
+            self.results[key] = results, inputs
+        return results
+
+
+def get_file_size(filename):
+    """Size of a file in bytes, 0 if it does not exist"""
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def get_run_number(df):
+    """Run number of the events in df, or None if there is no single one"""
+    if 'run_number' not in df.columns or not len(df):
+        return None
+    run_numbers = np.unique(np.asarray(df['run_number']))
+    if len(run_numbers) != 1:
+        return None
+    return int(run_numbers[0])
@@ -0,0 +1,194 @@
+"""Parquet and Arrow IPC input and output
+
+These columnar formats skip the ROOT round trip, and later readers can load
+only the cut columns.
+
+Readers take a list of columns, so only the columns the cuts read are loaded:
+
+    cuts = sciencerun1.LowEnergyBackground()
+    chunks = columnar.read_parquet('6731.parquet', columns=cuts.required_columns(),
+                                   chunk_size=10**6)
+    columnar.to_parquet(cuts.process_chunks(chunks), '6731_lax.parquet')
+
+Uncompressed Arrow IPC files are memory mapped and their numeric columns
+are used without copying, e.g. with Lichen.evaluate_arrays:
+
+    results = cuts.evaluate_arrays(columnar.read_arrow_columns('6731.arrow'))
+
+pyarrow is only imported when one of these functions is called.
+"""
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+from lax.stream import rechunk, write_chunks
+
+FORMATS = ('parquet', 'arrow')
+
+
+def get_pyarrow():
+    """The pyarrow module, with a clear error if it is not installed"""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet and Arrow files need pyarrow, try pip install pyarrow')
+    return pyarrow
+
+
+def get_format(path):
+    """File format from the file name: 'parquet' or 'arrow' (also .feather, .ipc)"""
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension in ('parquet', 'pq'):
+        return 'parquet'
+    if extension in ('arrow', 'feather', 'ipc'):
+        return 'arrow'
+    raise ValueError('Unknown file format of %s, use one of %s' % (path, FORMATS))
+
+
+def to_dataframe(table):
+    """DataFrame of an Arrow table or record batch, without the pandas metadata index"""
+    return table.to_pandas(split_blocks=True)
+
+
+def read_parquet(path, columns=None, chunk_size=None, memory_map=True):
+    """Read a Parquet file chunk by chunk
+
+    :param path: Filename
+    :param columns: Columns to read (e.g. required_columns of the cuts), by
+                    default all
+    :param chunk_size: Number of rows per chunk.  By default one chunk per
+                       row group.
+    :param memory_map: True or False on whether to memory map the file
+    :return: Generator of DataFrames
+    """
+    pa = get_pyarrow()
+    columns = None if columns is None else sorted(columns)
+    parquet_file = pa.parquet.ParquetFile(path, memory_map=memory_map)
+    if chunk_size is None:
+        for i in range(parquet_file.num_row_groups):
+            yield to_dataframe(parquet_file.read_row_group(i, columns=columns))
+    else:
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield to_dataframe(batch)
+
+
+def open_arrow(path, memory_map=True):
+    """Reader of an Arrow IPC file, memory mapped by default"""
+    pa = get_pyarrow()
+    source = pa.memory_map(path, 'r') if memory_map else pa.OSFile(path, 'rb')
+    return pa.ipc.open_file(source)
+
+
+def read_arrow(path, columns=None, memory_map=True):
+    """Read an Arrow IPC file record batch by record batch
+
+    :param path: Filename
+    :param columns: Columns to read, by default all
+    :param memory_map: True or False on whether to memory map the file
+    :return: Generator of DataFrames
+    """
+    reader = open_arrow(path, memory_map)
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        if columns is not None:
+            batch = batch.select([name for name in batch.schema.names if name in columns])
+        yield to_dataframe(batch)
+
+
+def read_arrow_columns(path, columns=None, memory_map=True):
+    """Columns of an Arrow IPC file as numpy arrays
+
+    Columns in a single uncompressed record batch without nulls are views on
+    the memory mapped file, others are copied.
+
+    :param path: Filename
+    :param columns: Columns to read, by default all
+    :return: OrderedDict of column name to array, see lax.arrays
+    """
+    table = open_arrow(path, memory_map).read_all()
+    names = [name for name in table.column_names if columns is None or name in columns]
+    arrays = OrderedDict()
+    for name in names:
+        column = table.column(name)
+        if column.num_chunks == 1:
+            arrays[name] = column.chunk(0).to_numpy(zero_copy_only=False)
+        else:
+            arrays[name] = column.to_numpy()
+    return arrays
+
+
+def to_parquet(chunks, path, compression='zstd', row_group_size=None):
+    """Write a stream of DataFrames to one Parquet file
+
+    Every chunk is written as it comes, so the whole stream is never in memory.
+
+    :param chunks: Iterable of DataFrames with the same columns
+    :param path: Filename
+    :param compression: Codec, e.g. 'snappy', 'zstd', 'gzip' or 'none'
+    :param row_group_size: Maximum number of rows per row group, by default
+                           one row group per chunk
+    :return: Total number of rows written
+    """
+    pa = get_pyarrow()
+    writer = []
+
+    def write_chunk(chunk):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if not writer:
+            writer.append(pa.parquet.ParquetWriter(path, table.schema, compression=compression))
+        writer[0].write_table(table, row_group_size=row_group_size)
+
+    try:
+        return write_chunks(chunks, write_chunk)
+    finally:
+        if writer:
+            writer[0].close()
+
+
+def to_arrow(chunks, path, compression=None):
+    """Write a stream of DataFrames to one Arrow IPC file
+
+    :param chunks: Iterable of DataFrames with the same columns
+    :param path: Filename
+    :param compression: None (files can be read without copying), 'lz4' or 'zstd'
+    :return: Total number of rows written
+    """
+    pa = get_pyarrow()
+    writer = []
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+
+    def write_chunk(chunk):
+        batch = pa.RecordBatch.from_pandas(chunk, preserve_index=False)
+        if not writer:
+            writer.append(pa.ipc.new_file(path, batch.schema, options=options))
+        writer[0].write_batch(batch)
+
+    try:
+        return write_chunks(chunks, write_chunk)
+    finally:
+        if writer:
+            writer[0].close()
+
+
+def read(path, columns=None, chunk_size=None):
+    """Read a Parquet or Arrow IPC file, see read_parquet and read_arrow
+
+    :return: Generator of DataFrames
+    """
+    if get_format(path) == 'parquet':
+        return read_parquet(path, columns, chunk_size)
+    chunks = read_arrow(path, columns)
+    return chunks if chunk_size is None else rechunk(chunks, chunk_size)
+
+
+def write(chunks, path, compression=None):
+    """Write a Parquet or Arrow IPC file, see to_parquet and to_arrow
+
+    :param compression: Codec, by default zstd for Parquet and none for Arrow
+    :return: Total number of rows written
+    """
+    if get_format(path) == 'parquet':
+        return to_parquet(chunks, path, compression or 'zstd')
+    return to_arrow(chunks, path, compression)
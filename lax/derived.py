@@ -0,0 +1,234 @@
+"""Derived variables shared by all lichens
+
+Quantities like the radius are computed from minitree columns by many cuts.  A
+lichen lists the derived variables it reads in derived_columns, either by name
+or as a Derived instance (for variables with parameters, see
+distance_to_source).  They are then computed at most once per evaluation of a
+cut set (or of several, see lax.lichen.CutSets) and shared by all its lichens.
+
+Values are only cached while an evaluation runs, and are all dropped when it
+ends.  So changing the DataFrame between two calls, also in place, always
+gives new values.  Evaluations in different threads do not share values.
+"""
+# -*- coding: utf-8 -*-
+
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Derived(object):
+    """Named quantity computed from DataFrame columns
+
+    :param name: Name of the column the values are stored in
+    :param inputs: Tuple of names of the columns the values are computed from
+    :param function: Function taking the input arrays, in the order of inputs
+    :param parameters: Tuple of values the function depends on besides the inputs
+    """
+
+    def __init__(self, name, inputs, function, parameters=()):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.function = function
+        self.parameters = tuple(parameters)
+
+    def __call__(self, df):
+        """Compute the values, without caching
+
+        :param df: DataFrame or dictionary of column name to array
+        :return: numpy array
+        """
+        with np.errstate(all='ignore'):
+            return np.asarray(self.function(*[np.asarray(df[column])
+                                              for column in self.inputs]))
+
+    def key(self):
+        return (self.name, self.inputs, self.parameters)
+
+
+DERIVED = OrderedDict()
+
+
+def register(name, inputs, function):
+    """Add a derived variable to the registry
+
+    :return: Derived
+    """
+    DERIVED[name] = Derived(name, inputs, function)
+    return DERIVED[name]
+
+
+def get_variable(variable):
+    """Derived instance of a registered name (or of a Derived itself)
+
+    :raises KeyError: if no derived variable of this name is registered
+    """
+    if isinstance(variable, Derived):
+        return variable
+    if variable not in DERIVED:
+        raise KeyError('No derived variable %s, known are %s' % (variable, list(DERIVED.keys())))
+    return DERIVED[variable]
+
+
+register('r', ('x', 'y'),
+         lambda x, y: np.sqrt(x * x + y * y))
+register('phi', ('x', 'y'),
+         lambda x, y: np.arctan2(y, x))
+register('r_3d_nn', ('x_3d_nn', 'y_3d_nn'),
+         lambda x, y: np.sqrt(x**2 + y**2))
+register('cs2_aft', ('cs2_top', 'cs2'),
+         lambda cs2_top, cs2: cs2_top / cs2)
+register('s1t', ('s1', 's1_area_fraction_top'),
+         lambda s1, aft: s1 * aft)
+register('s1b', ('s1', 's1_area_fraction_top'),
+         lambda s1, aft: s1 * (1. - aft))
+
+
+def distance_to_source(source_position):
+    """Distance of the interaction to a calibration source
+
+    :param source_position: (x, y, z) in cm
+    :return: Derived named distance_to_source
+    """
+    def distance(x, y, z):
+        return ((source_position[0] - x) ** 2 +
+                (source_position[1] - y) ** 2 +
+                (source_position[2] - z) ** 2) ** 0.5
+    return Derived('distance_to_source', ('x', 'y', 'z'), distance,
+                   parameters=tuple(source_position))
+
+
+def get_owner(array):
+    """The array owning the memory of a (view of an) array"""
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def get_identity(array):
+    """Key identifying an array by its memory, the same for every view of a column
+
+    Only meaningful while get_owner(array) is alive.
+    """
+    return (id(get_owner(array)), array.__array_interface__['data'][0],
+            array.shape, array.strides)
+
+
+class DerivedCache(object):
+    """Values of derived variables, keyed by the identity of their input arrays
+
+    Values are only cached inside scope, the input columns must not change
+    there.  Every thread has its own scopes, and the values cached in them are
+    dropped when its outermost scope ends.  Threads working for another (e.g.
+    a thread pool) can share its values, see scope.
+
+    :param max_entries: Number of values to keep, the least recently used are dropped
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_entries(self):
+        """Values cached in the scope of this thread, or None outside scopes"""
+        return getattr(self.local, 'entries', None)
+
+    @contextmanager
+    def scope(self, entries=None):
+        """Cache values until the outermost scope of this thread ends, e.g. one evaluation of a cut set
+
+        :param entries: get_entries of another thread, to share its values.
+                        They are not dropped when this scope ends.
+        """
+        outermost = self.get_entries() is None
+        if outermost:
+            self.local.entries = OrderedDict() if entries is None else entries
+        try:
+            yield self
+        finally:
+            if outermost:
+                if entries is None:
+                    with self.lock:
+                        self.local.entries.clear()
+                self.local.entries = None
+
+    def get(self, variable, df):
+        """Values of a derived variable, computed if not cached
+
+        :param variable: Derived or name of a registered one
+        :param df: DataFrame or dictionary of column name to array
+        :return: numpy array
+        """
+        variable = get_variable(variable)
+        arrays = [np.asarray(df[column]) for column in variable.inputs]
+        entries = self.get_entries()
+        if entries is None:
+            with self.lock:
+                self.misses += 1
+            return variable(dict(zip(variable.inputs, arrays)))
+        key = (variable.key(),) + tuple(get_identity(array) for array in arrays)
+
+        with self.lock:
+            entry = entries.pop(key, None)
+            # The ids are only meaningful while the arrays are alive
+            if entry is not None and all(ref() is not None for ref in entry[0]):
+                entries[key] = entry
+                self.hits += 1
+                return entry[1]
+
+        values = variable(dict(zip(variable.inputs, arrays)))
+        values.flags.writeable = False  # Shared by all lichens
+        try:
+            # Drop the values as soon as an input array is gone
+            refs = [weakref.ref(get_owner(array),
+                                lambda ref, key=key, entries=entries: self.drop(key, entries))
+                    for array in arrays]
+        except TypeError:
+            return values
+
+        with self.lock:
+            self.misses += 1
+            entries[key] = (refs, values)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return values
+
+    def drop(self, key, entries):
+        with self.lock:
+            entries.pop(key, None)
+
+    def clear(self):
+        """Drop the values cached in the scope of this thread"""
+        entries = self.get_entries()
+        if entries is not None:
+            with self.lock:
+                entries.clear()
+
+
+CACHE = DerivedCache()
+
+
+def scope(entries=None):
+    """Share derived variables until the outermost scope ends, see DerivedCache.scope"""
+    return CACHE.scope(entries)
+
+
+def get_entries():
+    """Values cached in the scope of this thread, to share with other threads"""
+    return CACHE.get_entries()
+
+
+def compute(variable, df):
+    """Values of a derived variable, from the shared cache if in a scope
+
+    :param variable: Derived or name of a registered one
+    :param df: DataFrame or dictionary of column name to array
+    :return: numpy array
+    """
+    return CACHE.get(variable, df)
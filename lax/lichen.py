@@ -4,12 +4,27 @@ Extend the Minitree produced DataFrames with derivative values.
 """
 # -*- coding: utf-8 -*-
 
+import copy
+import json
+import multiprocessing
+import time
+import warnings
 from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import numpy as np
 import pandas as pd
 
+from lax import stream
+from lax.arrays import ArrayFrame, as_frame, get_columns
+from lax.bitmask import get_word_names, pack
+from lax.cache import Digests, ResultCache, SharedResults, get_run_number
+from lax import derived
+from lax.derived import compute, get_variable
+from lax.plan import CutPlan, names, parse, plannable
 from lax.plotting import plot
+from lax.profiling import Profiler
 from lax.variables import check_variable_list
 
 pd.set_option('display.expand_frame_repr', False)
@@ -17,14 +32,88 @@ pd.set_option('display.expand_frame_repr', False)
 
 class Lichen(object):
     version = np.NaN
+    input_columns = None  # columns read from the DataFrame (None if unknown)
+    output_columns = ()  # helper columns made besides the cut column
+    derived_columns = ()  # derived variables read, see lax.derived
+    kept_columns = ()  # True or list of helper columns to add to the DataFrame
+    profiler = None  # lax.profiling.Profiler
 
     def describe(self):
         print(self.__doc__)
 
+    def derived_variables(self):
+        """List of lax.derived.Derived this lichen reads"""
+        return [get_variable(variable) for variable in self.derived_columns]
+
+    def required_columns(self):
+        """Set of DataFrame columns this lichen reads, or None if unknown
+
+        Derived variables are not included, the columns they are computed from are.
+        """
+        if self.input_columns is None:
+            return None
+        return self.add_derived_inputs(set(self.input_columns))
+
+    def add_derived_inputs(self, columns):
+        """Replace derived variables in a set of columns by what they are computed from"""
+        for variable in self.derived_variables():
+            columns.discard(variable.name)
+            columns |= set(variable.inputs)
+        return columns
+
+    def select_columns(self, df):
+        """Reduce DataFrame to the columns this lichen reads
+
+        If the columns are unknown the DataFrame is returned as is.  Derived
+        variables of the lichen are kept if df has them.
+        """
+        columns = self.required_columns()
+        if columns is None:
+            return df
+        missing = columns - set(df.columns)
+        if missing:
+            raise KeyError('%s requires missing columns %s' % (self.name(), sorted(missing)))
+        columns = columns | set(self.get_derived_names())
+        return df[[column for column in df.columns if column in columns]]
+
+    def get_derived_names(self):
+        return [variable.name for variable in self.derived_variables()]
+
+    def produced_columns(self):
+        """List of columns this lichen adds to the DataFrame"""
+        return list(self.output_columns) + [self.name()]
+
+    def helper_columns(self):
+        """List of columns this lichen can keep: those it adds and its derived variables"""
+        return self.produced_columns() + self.get_derived_names()
+
     def pre(self, df):
         return df
 
+    def preload(self):
+        """Load data files (e.g. classifiers) now instead of on first use"""
+        return self
+
     def process(self, df):
+        """Add the cut column to df
+
+        Helper columns and derived variables are only added if kept, see keep.
+        """
+        measurement = None if self.profiler is None else self.profiler.start(self.name())
+        frame = get_input(self, df, OrderedDict())
+        results = self.evaluate(frame)
+        if measurement is not None:
+            self.profiler.add(self.profiler.stop(measurement), len(df), results[self.name()].sum())
+        for variable in self.derived_variables():
+            if variable.name not in results:
+                results[variable.name] = np.asarray(frame[variable.name])
+
+        columns = [column for column in results
+                   if column != self.name() and self.is_kept_column(column)]
+        columns.append(self.name())
+        return attach(df, OrderedDict((column, results[column]) for column in columns))
+
+    def _process_all(self, df):
         df = self.pre(df)
         df = self._process(df)
         df = self.post(df)
@@ -34,11 +123,101 @@ class Lichen(object):
     def _process(self, df):
         raise NotImplementedError()
 
+    def evaluate(self, df):
+        """Columns this lichen adds, without changing df
+
+        The lichen processes a DataFrame of only the columns it reads, see get_frame.
+
+        :param df: DataFrame or lax.arrays.ArrayFrame, including the derived
+                   variables of the lichen (see get_input)
+        :return: OrderedDict of column name to array
+        """
+        produced = self.produced_columns()
+        result = self._process_all(self.get_frame(df))
+        columns = set(df.columns)
+        return OrderedDict((column, result[column].values) for column in result.columns
+                           if column in produced or column not in columns)
+
+    def get_frame(self, df):
+        """DataFrame for _process, with the columns of df this lichen reads
+
+        The columns are views on those of df, not copies: lichens only add
+        columns, and never the ones they read.  If the columns are unknown the
+        lichen gets a copy of all of df instead.
+
+        :param df: DataFrame or lax.arrays.ArrayFrame
+        """
+        if self.required_columns() is None:
+            return as_frame(df).copy()
+        frame = self.select_columns(ArrayFrame(df))
+        return pd.DataFrame(frame.arrays, index=df.index, columns=frame.columns, copy=False)
+
+    def evaluate_arrays(self, data):
+        """Columns this lichen adds to numpy arrays, see lax.arrays
+
+        :param data: Dictionary of column name to array or structured array
+        :return: OrderedDict of column name to array
+        """
+        return self.evaluate(get_input(self, ArrayFrame(data), OrderedDict()))
+
+    def unrecorded(self):
+        """Copy that does not cache results or record statistics and profiles, e.g. to try a sample"""
+        lichen = copy.copy(self)
+        lichen.profiler = None
+        return lichen
+
+    def process_chunks(self, chunks, chunk_size=None, memory=None):
+        """Process an iterable of DataFrames, see lax.stream.process_chunks
+
+        :return: Generator of processed DataFrames
+        """
+        return stream.process_chunks(self, chunks, chunk_size, memory)
+
     def post(self, df):
-        if 'temp' in df.columns:
-            return df.drop('temp', 1)
         return df
 
+    def keep(self, kept_columns=True):
+        """Add helper columns to the DataFrame
+
+        Helper columns (e.g. the radius computed by a fiducial volume cut) are
+        only kept in a scratch space while processing, where later lichens can
+        read them.  They are not added to the DataFrame unless requested here.
+
+        :param kept_columns: True, False or list of helper columns to keep
+        :return: self
+        """
+        if not isinstance(kept_columns, (bool, list, tuple, set)):
+            raise TypeError()
+        self.kept_columns = kept_columns
+        return self
+
+    def profile(self, profiler=True, memory=False):
+        """Record time and memory used by process, see lax.profiling
+
+        The records are in self.profiler, e.g. self.profiler.to_dataframe().
+
+        :param profiler: True, False or Profiler to record in (e.g. to share
+                         one between lichens)
+        :param memory: True or False on whether to trace memory (slow)
+        :return: self
+        """
+        if profiler is True:
+            profiler = Profiler(memory=memory)
+        elif profiler is False:
+            profiler = None
+        elif profiler is None:
+            pass
+        elif not isinstance(profiler, Profiler):
+            raise TypeError()
+        self.profiler = profiler
+        return self
+
+    def is_kept_column(self, column):
+        """Whether a helper column is added to the DataFrame"""
+        if isinstance(self.kept_columns, bool):
+            return self.kept_columns
+        return column in self.kept_columns
+
     def name(self):
         return 'Cut%s' % self.__class__.__name__
 
@@ -48,10 +227,40 @@ class StringLichen(Lichen):
     """
     string = ""
 
+    def parameters(self):
+        """Values of the parameters referred to as @name in the cut string"""
+        return {}
+
+    def required_columns(self):
+        columns = names(parse(self.string)) | set(self.input_columns or ())
+        return self.add_derived_inputs(columns - set(self.output_columns))
+
     def _process(self, df):
-        df.loc[:, self.name()] = df.eval(self.string)
+        df.loc[:, self.name()] = df.eval(self.string,
+                                         global_dict=self.parameters())
         return df
 
+    def evaluate(self, df):
+        if not plannable(self):
+            return Lichen.evaluate(self, df)
+        if isinstance(df, ArrayFrame):
+            plan = self.get_plan()
+            if self.name() in plan:
+                # Same values as DataFrame.eval, without making a DataFrame
+                return OrderedDict(plan.evaluate(df))
+            df = df.to_frame()
+        # Nothing is written, so no copy is needed
+        values = df.eval(self.string, global_dict=self.parameters())
+        return OrderedDict([(self.name(), np.asarray(values))])
+
+    def get_plan(self):
+        """Compiled plan of the cut string, rebuilt if string or parameters changed"""
+        key = (self.string, repr(sorted(self.parameters().items())))
+        if getattr(self, '_plan_key', None) != key:
+            self._plan = CutPlan([self])
+            self._plan_key = key
+        return self._plan
+
     def describe(self):
         print(self.name())
         print(self.string)
@@ -76,36 +285,625 @@ class RangeLichen(Lichen):
             raise ValueError()
         return self.allowed_range[0]
 
+    def required_columns(self):
+        if self.variable is None:
+            raise ValueError()
+        return {self.variable}
+
     def _process(self, df):
         df.loc[:, self.name()] = (df[self.variable] > self.allowed_range[0]) & (
             df[self.variable] < self.allowed_range[1])
         return df
 
 
+def get_input(lichen, df, made):
+    """Columns a lichen reads, including its derived variables
+
+    No column is copied.
+
+    :param lichen: Lichen
+    :param df: DataFrame or lax.arrays.ArrayFrame
+    :param made: OrderedDict of column name to array, made by earlier lichens.
+                 These take precedence over the columns of df.
+    :return: df itself if the lichen reads none of the made columns and no
+             derived variables, otherwise an ArrayFrame
+    """
+    columns = lichen.required_columns()
+    variables = lichen.derived_variables()
+    if columns is None:
+        columns = list(df.columns) + [column for column in made if column not in df.columns]
+    elif not variables and not set(columns) & set(made):
+        return df
+
+    missing = set(columns) - set(df.columns) - set(made)
+    if missing:
+        raise KeyError('%s requires missing columns %s' % (lichen.name(), sorted(missing)))
+
+    def get(column):
+        return made[column] if column in made else np.asarray(df[column])
+
+    data = OrderedDict()
+    for column in df.columns:
+        if column in columns:
+            data[column] = get(column)
+    for column in made:
+        if column in columns and column not in data:
+            data[column] = made[column]
+    for variable in variables:
+        data[variable.name] = compute(variable, dict((column, get(column))
+                                                     for column in variable.inputs))
+    return ArrayFrame(data)
+
+
+def attach(df, results):
+    """Add columns to df
+
+    Existing columns are replaced.  The columns are set one by one, which only
+    copies the new columns: adding them at once with pd.concat would copy
+    every column of df.
+
+    :param df: DataFrame
+    :param results: DataFrame or dictionary of column name to array, with the rows of df
+    :return: df
+    """
+    with warnings.catch_warnings():
+        # Consolidating the new columns into blocks would copy all of df
+        warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+        for column, values in get_columns(results).items():
+            df[column] = values
+    return df
+
+
 class ManyLichen(Lichen):
     lichen_list = []
     plots = False
     variables = None
+    compiled = False
+    projected = False
+    short_circuited = False
+    full_columns = False  # True or list of cut names to evaluate on all rows
+    ordered = False
+    packed = False
+    n_threads = 1
+    result_cache = None  # lax.cache.ResultCache
+    input_columns = ()  # read by pre, on top of what the lichens read
 
     def get_cut_names(self):
         return [lichen.name() for lichen in self.lichen_list]
 
-    def _process(self, df):
-        df.loc[:, (self.name())] = True
+    def unrecorded(self):
+        cuts = Lichen.unrecorded(self)
+        cuts.lichen_list = [lichen.unrecorded() for lichen in self.lichen_list]
+        cuts.result_cache = None
+        cuts._statistics = {}
+        return cuts
 
+    def get_all_cut_names(self):
+        """Names of the cuts of this set, including those of nested sets"""
+        cut_names = []
         for lichen in self.lichen_list:
-            # Heavy lifting here
-            df = lichen.process(df)
+            cut_names.append(lichen.name())
+            if isinstance(lichen, ManyLichen):
+                cut_names += lichen.get_all_cut_names()
+        return cut_names
+
+    def required_columns(self):
+        """Columns read by this set and its lichens
+
+        Columns made by this set's pre or by an earlier lichen are not included.
+        """
+        required = self.add_derived_inputs(set(self.input_columns))
+        made = set(self.output_columns) | set(self.get_derived_names()) | {self.name()}
+        for lichen in self.lichen_list:
+            columns = lichen.required_columns()
+            if columns is None:
+                return None
+            required |= columns - made
+            made |= set(lichen.produced_columns())
+        return required
+
+    def produced_columns(self):
+        columns = Lichen.produced_columns(self)
+        for lichen in self.lichen_list:
+            columns += [column for column in lichen.produced_columns()
+                        if column not in columns]
+        return columns
+
+    def preload(self):
+        for lichen in self.lichen_list:
+            lichen.preload()
+        return self
+
+    def is_kept_column(self, column):
+        """Whether a helper column is added to the DataFrame
+
+        Columns are kept if this set keeps them, or if the lichen making them does.
+        """
+        if Lichen.is_kept_column(self, column):
+            return True
+        return any(lichen.is_kept_column(column) for lichen in self.lichen_list
+                   if column in lichen.helper_columns())
+
+    def helper_columns(self):
+        columns = Lichen.helper_columns(self)
+        for lichen in self.lichen_list:
+            columns += [column for column in lichen.helper_columns() if column not in columns]
+        return columns
+
+    def get_result_names(self):
+        """Names of the boolean columns of this set: its own, then all cuts"""
+        result_names = [self.name()]
+        for cut_name in self.get_all_cut_names():
+            if cut_name not in result_names:
+                result_names.append(cut_name)
+        return result_names
+
+    def process(self, df):
+        return self.add_results(df, self.results(df))
+
+    def add_results(self, df, results):
+        """Add the columns of results, see process"""
+        if self.projected:
+            # Leave existing columns alone, except for cut results
+            cut_names = self.get_result_names()
+            results = results[[column for column in results.columns
+                               if column not in df.columns or column in cut_names]]
+        return attach(df, results)
+
+    def _process(self, df):
+        return attach(df, self.results(df))
+
+    def evaluate(self, df):
+        # Helper columns are returned, as later lichens of a parent set may read them
+        buffer, result_names, helpers = self.evaluate_buffer(df)
+        columns = OrderedDict(helpers)
+        columns.update(zip(result_names, buffer))
+        return columns
+
+    def results(self, df):
+        """Columns this set adds to df, as a separate DataFrame
+
+        df is not changed.  Helper columns are only included if they are kept,
+        see keep.  Without them the DataFrame is a view on a single boolean
+        array, so no column is copied.
+
+        :param df: DataFrame
+        :return: DataFrame with the same index as df
+        """
+        buffer, result_names, helpers = self.evaluate_buffer(df)
+        if not self.packed and not any(self.is_kept_column(column) for column in helpers):
+            return pd.DataFrame(buffer.T, index=df.index, columns=result_names, copy=False)
+
+        columns = self.get_result_columns(buffer, result_names, helpers)
+        return pd.DataFrame(columns, index=df.index, columns=list(columns.keys()))
+
+    def evaluate_arrays(self, data):
+        """Columns this set adds to numpy arrays, see lax.arrays
+
+        The same columns as in results, without making any DataFrame for cut
+        sets and string cuts.
+
+        :param data: Dictionary of column name to array or structured array
+        :return: OrderedDict of column name to array
+        """
+        return self.get_result_columns(*self.evaluate_buffer(ArrayFrame(data)))
+
+    def get_result_columns(self, buffer, result_names, helpers):
+        """Kept helper columns and cut results (or packed words), in order
+
+        :param buffer: Boolean array, see evaluate_buffer
+        :param result_names: Names of the rows of buffer
+        :param helpers: OrderedDict of helper column name to array
+        :return: OrderedDict of column name to array
+        """
+        columns = OrderedDict((column, values) for column, values in helpers.items()
+                              if self.is_kept_column(column))
+
+        if self.packed:
+            words = pack(list(buffer[1:]))
+            columns.update(zip(get_word_names(self.name(), len(buffer) - 1), words))
+            return columns
+
+        columns.update(zip(result_names, buffer))
+        order = [column for column in self.produced_columns() if column in columns]
+        order += [column for column in columns if column not in order]
+        return OrderedDict((column, columns[column]) for column in order)
+
+    def evaluate_buffer(self, df):
+        """Evaluate all lichens into one preallocated boolean array
+
+        :param df: DataFrame
+        :return: (boolean array with one row per name in get_result_names,
+                  list of those names,
+                  OrderedDict of helper column name to array)
+        """
+        # Derived variables are computed once for all lichens of the set
+        with derived.scope():
+            if self.profiler is None:
+                return self._evaluate_buffer(df)
+
+            # Nested sets are measured by the set they are in
+            stack = self.profiler.get_stack()
+            measurement = None if stack else self.profiler.start(self.name())
+            stack.append(self.name())
+            try:
+                buffer, result_names, helpers = self._evaluate_buffer(df)
+            finally:
+                stack.pop()
+        if measurement is not None:
+            self.profiler.add(self.profiler.stop(measurement), len(df), buffer[0].sum())
+        return buffer, result_names, helpers
+
+    def _evaluate_buffer(self, df):
+        # One view on the columns of df for all lichens, see get_frame
+        frame = ArrayFrame(df)
+        helpers = OrderedDict()
+        if type(self).pre is not Lichen.pre:
+            frame = ArrayFrame(self.pre(self.get_frame(frame)))
+            helpers.update((column, frame[column]) for column in self.output_columns
+                           if column in frame.columns)
+
+        made = OrderedDict()  # Columns made by this set and its lichens so far
+        for variable in self.derived_variables():
+            made[variable.name] = compute(variable, frame)
+        # Derived variables can be kept like helper columns, see Lichen.process
+        helpers.update(made)
+
+        result_names = self.get_result_names()
+        index = dict((result_name, i) for i, result_name in enumerate(result_names))
+        buffer = np.zeros((len(result_names), len(df)), dtype=bool)
+        passed = buffer[0]
+        passed[:] = True
+
+        planned = {}
+        if self.compiled:
+            planned = self.evaluate_plan(frame, made)
+
+        def store(outputs):
+            for column, values in outputs.items():
+                if column in index:
+                    buffer[index[column]] = values
+                    values = buffer[index[column]]
+                else:
+                    helpers[column] = values
+                made[column] = values
+
+        def finish(lichen, seconds, rows=None, measurement=None):
+            for variable in lichen.derived_variables():
+                if variable.name not in helpers:
+                    # Already computed for the lichen, so taken from the derived cache
+                    helpers[variable.name] = compute(variable, dict(
+                        (column, made[column] if column in made else frame[column])
+                        for column in variable.inputs))
 
             cut_name = lichen.name()
+            values = buffer[index[cut_name]]
+            if rows is None:
+                n_rows, n_passed = len(values), values.sum()
+            else:
+                n_rows, n_passed = len(rows), values[rows].sum()
+            self.record(cut_name, seconds, n_rows, n_passed)
+            if measurement is not None:
+                self.profiler.add(measurement, n_rows, n_passed)
 
             if self.plots:
-                plot(df[df[self.name()]],
-                     cut_name, self.variables)
+                columns = dict((column, made_values[passed])
+                               for column, made_values in made.items())
+                plot(as_frame(frame)[passed].assign(**columns), cut_name, self.variables)
 
-            df.loc[:, self.name()] = df[self.name()] & df[cut_name]
+            np.logical_and(passed, values, out=passed)
 
-        return df
+        run_number = None
+        result_cache = self.result_cache
+        if result_cache is not None:
+            run_number = get_run_number(frame)
+            if isinstance(result_cache, ResultCache):
+                # Each column is hashed once for all lichens of this call
+                result_cache = SharedResults(result_cache)
+
+        if (self.n_threads > 1 and not self.short_circuited and
+                self.required_columns() is not None):
+            self._evaluate_parallel(frame, planned, made, store, finish, run_number, result_cache)
+            return buffer, result_names, helpers
+
+        lichens = self.lichen_list
+        if self.ordered and self.short_circuited:
+            lichens = self.get_order()
+
+        profiler = self.profiler
+        for lichen in lichens:
+            cut_name = lichen.name()
+            start = time.time()
+            measurement = None if profiler is None else profiler.start(cut_name)
+            rows = None
+
+            # Heavy lifting here
+            if cut_name in planned:
+                store({cut_name: planned[cut_name]})
+            elif (self.short_circuited and not self.is_full_column(cut_name) and
+                  not passed.all()):
+                rows = np.flatnonzero(passed)
+                store(self.evaluate_rows(lichen, get_input(lichen, frame, made), rows))
+            else:
+                store(self.evaluate_lichen(lichen, get_input(lichen, frame, made),
+                                           run_number, result_cache))
+
+            if measurement is not None:
+                profiler.stop(measurement)
+            finish(lichen, time.time() - start, rows, measurement)
+
+        if self.ordered and self.short_circuited:
+            # Which cut removed an event depends on the order, so the cut
+            # columns only say whether the event passed the whole set
+            anded = [result_name for result_name in result_names[1:]
+                     if not self.is_full_column(result_name)]
+            if anded:
+                warnings.warn('%s is ordered and short-circuited: the columns of %s are the same as %s, '
+                              'use full_columns to keep single cuts' % (self.name(), anded, self.name()))
+            for i, result_name in enumerate(result_names[1:], 1):
+                if result_name in anded:
+                    np.logical_and(buffer[i], passed, out=buffer[i])
+
+        return buffer, result_names, helpers
+
+    def evaluate_plan(self, df, made):
+        """Evaluate the compiled plan, including the derived variables it reads
+
+        :param df: DataFrame
+        :param made: Dictionary of column name to array, made by this set
+        :return: Dictionary of cut name to boolean array, empty if the plan
+                 reads columns that are not there yet
+        """
+        plan = self.get_plan()
+        values = dict(made)
+        keys = {}
+        for lichen in self.lichen_list:
+            if lichen.name() not in plan:
+                continue
+            for variable in lichen.derived_variables():
+                # Same name, different definition: cannot share a namespace
+                if keys.setdefault(variable.name, variable.key()) != variable.key():
+                    return {}
+                values[variable.name] = compute(variable, df)
+
+        # Columns made by earlier lichens do not exist yet: no shortcut then
+        if not plan.columns.issubset(set(df.columns) | set(values)):
+            return {}
+        return dict(plan.evaluate(df, values))
+
+    def get_plan(self):
+        """Compiled plan of the string cuts in lichen_list
+
+        The plan is rebuilt whenever lichen_list changed since the last call.
+        """
+        key = tuple(id(lichen) for lichen in self.lichen_list)
+        if getattr(self, '_plan_key', None) != key:
+            self._plan = CutPlan(self.lichen_list)
+            self._plan_key = key
+        return self._plan
+
+    def get_statistics(self):
+        """Evaluation time and pass rate of each cut, summed over all calls
+
+        :return: Dictionary of cut name to dictionary with number of 'calls',
+                 'rows' evaluated, 'passed' rows and 'time' in seconds
+        """
+        if getattr(self, '_statistics', None) is None:
+            self._statistics = {}
+        return self._statistics
+
+    def record(self, cut_name, seconds, rows, passed):
+        """Add one evaluation of a cut to the statistics"""
+        statistics = self.get_statistics().setdefault(cut_name, dict(calls=0, rows=0,
+                                                                     passed=0, time=0.))
+        statistics['calls'] += 1
+        statistics['rows'] += int(rows)
+        statistics['passed'] += int(passed)
+        statistics['time'] += seconds
+
+    def get_rank(self, cut_name):
+        """Time per removed event, lower is better to evaluate first
+
+        Cuts that never ran or never removed anything rank last.
+        """
+        statistics = self.get_statistics().get(cut_name)
+        if statistics is None or statistics['rows'] == 0:
+            return np.inf
+        removed = statistics['rows'] - statistics['passed']
+        if removed == 0:
+            return np.inf
+        return statistics['time'] / removed
+
+    def get_dependencies(self):
+        """For each lichen, the set of indices of earlier lichens it must follow
+
+        A lichen must follow an earlier one if it reads or writes columns the
+        other writes, or writes columns the other reads.  Lichens of which the
+        columns are unknown stay in place.
+        """
+        required = [lichen.required_columns() for lichen in self.lichen_list]
+        produced = [set(lichen.produced_columns()) for lichen in self.lichen_list]
+
+        dependencies = []
+        for j in range(len(self.lichen_list)):
+            after = set()
+            for i in range(j):
+                if required[i] is None or required[j] is None:
+                    after.add(i)
+                elif (produced[i] & (required[j] | produced[j]) or
+                      required[i] & produced[j]):
+                    after.add(i)
+            dependencies.append(after)
+        return dependencies
+
+    def get_order(self):
+        """Lichens in the order of their rank, respecting their dependencies
+
+        :return: List of lichens
+        """
+        dependencies = self.get_dependencies()
+        ranks = [self.get_rank(lichen.name()) for lichen in self.lichen_list]
+
+        order = []
+        remaining = list(range(len(self.lichen_list)))
+        while remaining:
+            ready = [i for i in remaining if dependencies[i].issubset(order)]
+            best = min(ready, key=lambda i: (ranks[i], i))
+            order.append(best)
+            remaining.remove(best)
+        return [self.lichen_list[i] for i in order]
+
+    def calibrate(self, df, n_rows=10000, seed=0):
+        """Measure the statistics of all cuts on a random sample of df
+
+        :param df: DataFrame to sample from
+        :param n_rows: Number of rows to sample
+        :param seed: Seed of the random sample
+        :return: self
+        """
+        rows = np.arange(len(df))
+        if len(df) > n_rows:
+            rows = np.sort(np.random.RandomState(seed).choice(rows, n_rows, replace=False))
+
+        short_circuited = self.short_circuited
+        self.short_circuited = False
+        try:
+            self.process(self.select_columns(df).iloc[rows].copy())
+        finally:
+            self.short_circuited = short_circuited
+        return self
+
+    def save_order(self, filename):
+        """Store the statistics and resulting order of the cuts as JSON"""
+        with open(filename, 'w') as outfile:
+            json.dump({'name': self.name(),
+                       'order': [lichen.name() for lichen in self.get_order()],
+                       'statistics': self.get_statistics()},
+                      outfile, indent=4, sort_keys=True)
+
+    def load_order(self, filename):
+        """Use statistics stored with save_order, e.g. from an earlier job
+
+        :return: self
+        :raises ValueError: if the statistics are of another cut set
+        """
+        with open(filename) as infile:
+            stored = json.load(infile)
+        if stored['name'] != self.name():
+            raise ValueError('%s has the order of %s, not of %s' % (filename, stored['name'], self.name()))
+        self._statistics = stored['statistics']
+        return self
+
+    def _evaluate_parallel(self, frame, planned, made, store, finish, run_number=None,
+                           result_cache=None):
+        """Evaluate independent lichens concurrently on a thread pool
+
+        Every lichen works on its own DataFrame with only the columns it reads,
+        taken from frame or from the lichens it depends on.  The results are
+        stored in the order of lichen_list, so they are the same as when
+        evaluating one by one.
+        """
+        dependencies = self.get_dependencies()
+        n = len(self.lichen_list)
+        outputs = [None] * n
+        results = dict(made)  # Latest values of each new column
+
+        done = set()
+        for i, lichen in enumerate(self.lichen_list):
+            if lichen.name() in planned:
+                outputs[i] = (OrderedDict([(lichen.name(), planned[lichen.name()])]), 0., None)
+                results[lichen.name()] = planned[lichen.name()]
+                done.add(i)
+
+        profiler = self.profiler
+        stack = None if profiler is None else profiler.get_stack()
+        entries = derived.get_entries()
+
+        def run(i):
+            start = time.time()
+            lichen = self.lichen_list[i]
+            measurement = None
+            if profiler is not None:
+                profiler.set_stack(stack)
+                measurement = profiler.start(lichen.name())
+            # Derived variables are shared with the thread evaluating the set
+            with derived.scope(entries):
+                columns = self.evaluate_lichen(lichen, get_input(lichen, frame, results),
+                                               run_number, result_cache)
+            if measurement is not None:
+                profiler.stop(measurement)
+            return columns, time.time() - start, measurement
+
+        submitted = set(done)
+        futures = {}
+        with ThreadPoolExecutor(self.n_threads) as executor:
+            while len(done) < n:
+                for i in range(n):
+                    if i not in submitted and dependencies[i].issubset(done):
+                        futures[executor.submit(run, i)] = i
+                        submitted.add(i)
+
+                finished, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = futures.pop(future)
+                    outputs[i] = future.result()
+                    results.update(outputs[i][0])
+                    done.add(i)
+
+        for lichen, (columns, seconds, measurement) in zip(self.lichen_list, outputs):
+            store(columns)
+            finish(lichen, seconds, measurement=measurement)
+
+    def evaluate_lichen(self, lichen, df, run_number=None, result_cache=None):
+        """Columns a lichen adds, from the result cache if one is used
+
+        Cut sets are not cached as a whole, their lichens are.
+
+        :param result_cache: ResultCache or SharedResults, or None to not cache
+        """
+        if result_cache is None or isinstance(lichen, ManyLichen):
+            return lichen.evaluate(df)
+        return result_cache.evaluate(lichen, df, run_number)
+
+    @staticmethod
+    def evaluate_rows(lichen, df, rows):
+        """Evaluate a lichen on only some rows of df
+
+        Cut columns of the lichen are False for all other rows, new helper
+        columns are NaN there.
+
+        :param lichen: Lichen to evaluate
+        :param df: DataFrame
+        :param rows: Array of row numbers to evaluate
+        :return: OrderedDict of the columns produced by the lichen
+        """
+        if isinstance(lichen, ManyLichen):
+            cuts = [lichen.name()] + lichen.get_all_cut_names()
+        else:
+            cuts = [lichen.name()]
+
+        selected = {}
+        if len(rows):
+            selected = lichen.evaluate(lichen.select_columns(df).iloc[rows])
+
+        outputs = OrderedDict()
+        for column in lichen.produced_columns():
+            if column in cuts:
+                full = np.zeros(len(df), dtype=bool)
+            elif column in df.columns:
+                full = np.array(df[column])
+            else:
+                full = np.full(len(df), np.nan)
+            if column in selected:
+                full[rows] = selected[column]
+            outputs[column] = full
+        return outputs
+
+    def is_full_column(self, cut_name):
+        """Whether a cut is evaluated on all rows when short-circuited"""
+        if isinstance(self.full_columns, bool):
+            return self.full_columns
+        return cut_name in self.full_columns
 
     def debug(self,
               plots=True,
@@ -125,3 +923,228 @@ class ManyLichen(Lichen):
             pass
         else:
             self.variables = OrderedDict(check_variable_list(variables))
+
+    def compile(self, compiled=True):
+        """Evaluate the string cuts through one compiled plan
+
+        All StringLichens of this set (and of nested sets) are parsed once, the
+        subexpressions they share are computed only once and the results are
+        produced in a single pass.  The cut columns are the same as without.
+
+        :param compiled: True or False on whether to use the compiled plan
+        :return: self
+        """
+        if not isinstance(compiled, bool):
+            raise TypeError()
+        self.compiled = compiled
+
+        for lichen in self.lichen_list:
+            if isinstance(lichen, ManyLichen):
+                lichen.compile(compiled)
+        return self
+
+    def short_circuit(self, short_circuited=True, full_columns=False):
+        """Only evaluate each lichen on events that passed the earlier ones
+
+        The set column is the same as without, but the column of a lichen is
+        False for events that an earlier lichen already removed.  N-1 plots
+        need the full columns, which can be requested for some or all cuts.
+
+        :param short_circuited: True or False on whether to skip removed events
+        :param full_columns: True, False or list of cut names to evaluate on all events
+        :return: self
+        """
+        if not isinstance(short_circuited, bool):
+            raise TypeError()
+        if not isinstance(full_columns, (bool, list, tuple, set)):
+            raise TypeError()
+        self.short_circuited = short_circuited
+        self.full_columns = full_columns
+
+        for lichen in self.lichen_list:
+            if isinstance(lichen, ManyLichen):
+                lichen.short_circuit(short_circuited, full_columns)
+        return self
+
+    def order(self, ordered=True):
+        """Evaluate cheap cuts that remove many events first
+
+        Only has an effect when short-circuited.  The statistics come from earlier
+        calls, from calibrate or from load_order.  The cut columns stay in the
+        order of lichen_list.  They are True only for events that pass the whole
+        set (except full columns, see short_circuit), so all columns are the
+        same for any order.  Each of them is then the same as the set column:
+        efficiencies of single cuts need full columns, otherwise a warning is
+        given when processing.
+
+        :param ordered: True or False on whether to order by rank
+        :return: self
+        """
+        if not isinstance(ordered, bool):
+            raise TypeError()
+        self.ordered = ordered
+
+        for lichen in self.lichen_list:
+            if isinstance(lichen, ManyLichen):
+                lichen.order(ordered)
+        return self
+
+    def pack(self, packed=True):
+        """Store all cut columns of this set as bits of a few integer columns
+
+        Use lax.bitmask.CutMask to read single cuts or the set column back.
+
+        :param packed: True or False on whether to pack the cut columns
+        :return: self
+        """
+        if not isinstance(packed, bool):
+            raise TypeError()
+        self.packed = packed
+        return self
+
+    def parallel(self, n_threads=None):
+        """Process independent lichens concurrently on a thread pool
+
+        Dependencies between lichens follow from the columns they read and add
+        (see get_dependencies).  The result is the same as processing one by
+        one.  Not used when short-circuited or when the columns of a lichen
+        are unknown.  Nested sets get their own pools of n_threads.
+
+        :param n_threads: Number of threads, by default the number of CPUs
+        :return: self
+        """
+        if n_threads is None:
+            n_threads = multiprocessing.cpu_count()
+        if not isinstance(n_threads, int):
+            raise TypeError()
+        self.n_threads = n_threads
+
+        for lichen in self.lichen_list:
+            if isinstance(lichen, ManyLichen):
+                lichen.parallel(n_threads)
+        return self
+
+    def project(self, projected=True):
+        """Never change existing columns of the DataFrame
+
+        Only new helper and cut columns are added, except for the cut columns
+        of this set, which are always written.
+
+        :param projected: True or False on whether to leave existing columns alone
+        :return: self
+        """
+        if not isinstance(projected, bool):
+            raise TypeError()
+        self.projected = projected
+        return self
+
+    def cache(self, result_cache=None):
+        """Store the results of each lichen on disk and reuse them when possible
+
+        Results are reused when the run number, the lichen class, its version
+        and parameters and the columns it reads are the same, see lax.cache.
+        Short-circuited lichens are not cached.
+
+        :param result_cache: ResultCache, directory to cache in, SharedResults
+                             or None to not cache
+        :return: self
+        """
+        if isinstance(result_cache, str):
+            result_cache = ResultCache(result_cache)
+        elif (result_cache is not None and
+              not isinstance(result_cache, (ResultCache, SharedResults))):
+            raise TypeError()
+        self.result_cache = result_cache
+
+        for lichen in self.lichen_list:
+            if isinstance(lichen, ManyLichen):
+                lichen.cache(result_cache)
+        return self
+
+    def profile(self, profiler=True, memory=False):
+        """Record time and memory used by each lichen, see lax.profiling
+
+        The records are in self.profiler, e.g. self.profiler.to_dataframe().
+
+        :param profiler: True, False or Profiler to record in (e.g. to share
+                         one between cut sets)
+        :param memory: True or False on whether to trace memory (slow)
+        :return: self
+        """
+        Lichen.profile(self, profiler, memory)
+
+        for lichen in self.lichen_list:
+            if isinstance(lichen, ManyLichen):
+                lichen.profile(self.profiler)
+        return self
+
+
+class CutSets(object):
+    """Several cut sets processed on the same events
+
+    Cut sets share most of their lichens (e.g. S2Width is in all of them).
+    Lichens of the same class, version and parameters that read the same
+    columns are evaluated only once, for the first set that has them, and
+    their results are reused by the other sets (see lax.cache.SharedResults).
+    The results are the same as when processing the sets one by one.
+
+    Example:
+        cut_sets = CutSets([sciencerun1.AllEnergy(), sciencerun1.LowEnergyBackground()])
+        df = cut_sets.process(df)
+
+    :param cut_sets: List of ManyLichen
+    """
+
+    def __init__(self, cut_sets):
+        self.cut_sets = list(cut_sets)
+        self.evaluated = 0  # lichens evaluated by the last call
+        self.reused = 0  # lichen results reused by the last call
+
+    def process(self, df):
+        """The same as df = cuts.process(df) for every cut set
+
+        All sets are evaluated on the columns of df, so the lichens they share
+        read the same arrays, unless a set reads columns an earlier set adds.
+        """
+        if self.reads_earlier_columns():
+            with self.sharing():
+                for cuts in self.cut_sets:
+                    df = cuts.process(df)
+            return df
+
+        for cuts, results in zip(self.cut_sets, self.results(df)):
+            df = cuts.add_results(df, results)
+        return df
+
+    def reads_earlier_columns(self):
+        """Whether a set reads columns added by an earlier set, or unknown columns"""
+        produced = set()
+        for cuts in self.cut_sets:
+            columns = cuts.required_columns()
+            if columns is None or columns & produced:
+                return True
+            produced |= set(cuts.produced_columns())
+        return False
+
+    def results(self, df):
+        """List of cuts.results(df) of every cut set, see ManyLichen.results"""
+        with self.sharing():
+            return [cuts.results(df) for cuts in self.cut_sets]
+
+    @contextmanager
+    def sharing(self):
+        """Let the cut sets share results, each keeping its own result cache"""
+        result_caches = [cuts.result_cache for cuts in self.cut_sets]
+        results = {}
+        digests = Digests()
+        shared = [SharedResults(result_cache, results, digests) for result_cache in result_caches]
+        try:
+            for cuts, shared_results in zip(self.cut_sets, shared):
+                cuts.cache(shared_results)
+            with derived.scope():
+                yield
+        finally:
+            for cuts, result_cache in zip(self.cut_sets, result_caches):
+                cuts.cache(result_cache)
+            self.evaluated = sum(shared_results.misses for shared_results in shared)
+            self.reused = sum(shared_results.hits for shared_results in shared)
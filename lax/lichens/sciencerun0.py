@@ -5,17 +5,20 @@ This includes all current definitions of the cuts for the first science run
 
 # -*- coding: utf-8 -*-
 import inspect
+import json
 import os
-import pytz
-import pickle  # noqa
+from collections import OrderedDict
 
 import numpy as np
 from pax import units
 
-from scipy.stats import chi2
+from scipy.interpolate import RectBivariateSpline
+from scipy.special import betainc, digamma, gammaln, xlogy
 
 from lax.lichen import Lichen, RangeLichen, ManyLichen, StringLichen
 from lax import __version__ as lax_version
+from lax import models, runs
+from lax.derived import distance_to_source
 
 # Store the directory of our data files
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))),
@@ -140,30 +143,24 @@ class DAQVeto(ManyLichen):
 
     class EndOfRunCheck(Lichen):
         """Check that the event does not come in the last 21 seconds of the run
+
+        Run end times are taken from lax.runs, which can use a local file
+        instead of the runs DB.
         """
+        input_columns = ('run_number', 'event_time')
 
         def _process(self, df):
-            import hax          # noqa
-            if not len(hax.config):
-                # User didn't init hax yet... let's do it now
-                hax.init()
-
-            # Get the end times for each run
-            # The datetime -> timestamp logic here is the same as in the pax event builder
-            run_numbers = np.unique(df.run_number.values)
-            run_end_times = [int(q.replace(tzinfo=pytz.utc).timestamp() * int(1e9))
-                             for q in hax.runs.get_run_info(run_numbers.tolist(), 'end')]
-            run_end_times = {run_numbers[i]: run_end_times[i]
-                             for i in range(len(run_numbers))}
+            # End times come from the runs DB only once, see lax.runs
+            end_times = runs.get_end_times(df['run_number'].values)
 
             # Pass events that occur before (end time - 21 sec) of the run they are in
-            df.loc[:, self.name()] = df.apply(lambda row: row['event_time'] <
-                                              run_end_times[row['run_number']] - 21e9, axis=1)
+            df.loc[:, self.name()] = df['event_time'].values < end_times - int(21e9)
             return df
 
     class BusyTypeCheck(Lichen):
         """Ensure that the last busy type (if any) is OFF
         """
+        input_columns = ('previous_busy_on', 'previous_busy_off')
 
         def _process(self, df):
             df.loc[:, self.name()] = ((~(df['previous_busy_on'] < 60e9)) |
@@ -174,6 +171,7 @@ class DAQVeto(ManyLichen):
     class BusyCheck(Lichen):
         """Check if the event contains a BUSY veto trigger
         """
+        input_columns = ('nearest_busy', 'event_duration')
 
         def _process(self, df):
             df.loc[:, self.name()] = (abs(df['nearest_busy']) >
@@ -183,6 +181,7 @@ class DAQVeto(ManyLichen):
     class HEVCheck(Lichen):
         """Check if the event contains a HE veto trigger
         """
+        input_columns = ('nearest_hev', 'event_duration')
 
         def _process(self, df):
             df.loc[:, self.name()] = (abs(df['nearest_hev']) >
@@ -200,6 +199,7 @@ class S2Tails(Lichen):
     Contact: Daniel Coderre <daniel.coderre@lhep.unibe.ch>
     """
     version = 0
+    input_columns = ('s2_over_tdiff',)
 
     def _process(self, df):
         df.loc[:, self.name()] = ((~(df['s2_over_tdiff'] >= 0)) |
@@ -223,11 +223,8 @@ class FiducialCylinder1T_TPF2dFDC(StringLichen):
 
     """
     version = 4
-    string = "(-92.9 < z) & (z < -9) & (sqrt(x*x + y*y) < 36.94)"
-
-    def pre(self, df):
-        df.loc[:, 'r'] = np.sqrt(df['x'] * df['x'] + df['y'] * df['y'])
-        return df
+    string = "(-92.9 < z) & (z < -9) & (r < 36.94)"
+    derived_columns = ('r',)
 
 
 class FiducialCylinder1T(StringLichen):
@@ -290,7 +287,8 @@ class FiducialInnerEgg(ManyLichen):
     class FiducialInnerEggLower(StringLichen):
         """Bottom part of egg
         """
-        string = "(z_3d_nn > -55.28) | ( (-(z_3d_nn+55.28)/26.24)**2.00197758 + (r_3d_nn*r_3d_nn/1365)**2.00197758 < 1.)"
+        string = ("(z_3d_nn > -55.28) | "
+                  "( (-(z_3d_nn+55.28)/26.24)**2.00197758 + (r_3d_nn*r_3d_nn/1365)**2.00197758 < 1.)")
 
     class FiducialInnerEggEdge(StringLichen):
         """Hard radial cut on currently defined bin edge
@@ -345,16 +343,10 @@ class FiducialTestEllips(StringLichen):
     parameter_symbols = tuple('z0 vz p vr2'.split())
     parameter_values = None   # Will be tuple of parameter values
     string = "((( (((z_3d_nn-@z0)**2)**0.5) /@vz)**@p)+ (r_3d_nn**2/@vr2)**@p) < 1"
+    derived_columns = ('r_3d_nn',)
 
-    def _process(self, df):
-        bla = dict(zip(self.parameter_symbols, self.parameter_values))
-        df.loc[:, self.name()] = df.eval(self.string,
-                                         global_dict=bla)
-        return df
-
-    def pre(self, df):
-        df.loc[:, 'r_3d_nn'] = np.sqrt(df['x_3d_nn']**2 + df['y_3d_nn']**2)
-        return df
+    def parameters(self):
+        return dict(zip(self.parameter_symbols, self.parameter_values))
 
 
 for mass, params in FV_CONFIGS:
@@ -364,6 +356,79 @@ for mass, params in FV_CONFIGS:
     locals()[name] = c
 
 
+class FiducialTestEllipsScan(Lichen):
+    """All FiducialTestEllips<mass> cuts in one pass.
+
+    Gives the same CutFiducialTestEllips<mass> columns as the separate cuts,
+    computing the superellipse of every configuration at once for chunks of
+    events.  FiducialTestEllipsIndex is the index in fv_configs of the first
+    (smallest) volume containing the event, or -1 if none does.  These columns
+    are always added to the DataFrame, also by cut sets.  The cut itself passes
+    events inside any of the volumes.
+    """
+    version = 1
+    fv_configs = FV_CONFIGS
+    chunk_size = 10000  # events evaluated at once
+    input_columns = ('z_3d_nn', 'r_3d_nn')
+    derived_columns = ('r_3d_nn',)
+    kept_columns = True  # The volumes and the index are what a scan is for
+
+    @property
+    def output_columns(self):
+        return ['CutFiducialTestEllips%d' % mass
+                for mass, _ in self.fv_configs] + ['FiducialTestEllipsIndex']
+
+    def get_inside(self, z, r):
+        """Boolean array, one row per configuration and one column per event"""
+        z0, vz, p, vr2 = [values[:, np.newaxis]
+                          for values in np.array([params for _, params in self.fv_configs]).T]
+        inside = np.empty((len(self.fv_configs), len(z)), dtype=bool)
+        for start in range(0, len(z), self.chunk_size):
+            stop = start + self.chunk_size
+            # Same operations as the cut string of FiducialTestEllips
+            metric = np.power(np.sqrt(np.square(z[np.newaxis, start:stop] - z0)) / vz, p)
+            metric += np.power(np.square(r[np.newaxis, start:stop]) / vr2, p)
+            np.less(metric, 1, out=inside[:, start:stop])
+        return inside
+
+    def evaluate(self, df):
+        inside = self.get_inside(np.asarray(df['z_3d_nn'], dtype=np.float64),
+                                 np.asarray(df['r_3d_nn'], dtype=np.float64))
+        contained = inside.any(axis=0)
+        index = np.where(contained, inside.argmax(axis=0), -1).astype(np.int8)
+        columns = self.output_columns
+        result = OrderedDict(zip(columns[:-1], inside))
+        result[columns[-1]] = index
+        result[self.name()] = contained
+        return result
+
+
+_R_PHI_CURVE = {}
+
+
+def get_r_phi_curve():
+    """(phi values [rad], radius values [cm]) of the 210Po edge, read once"""
+    if 'curve' not in _R_PHI_CURVE:
+        curve = np.loadtxt(os.path.join(DATA_DIR, 'R_phi_curve_360points.txt'))
+        _R_PHI_CURVE['curve'] = (curve[:, 0].copy(), curve[:, 1].copy())
+    return _R_PHI_CURVE['curve']
+
+
+def find_nearest(array, values):
+    """Index of the nearest element of a sorted array, for each value
+
+    The same as np.abs(np.subtract.outer(array, values)).argmin(0) (lowest
+    index on ties, 0 for NaN and infinity), without making a
+    len(array) x len(values) matrix.
+    """
+    values = np.asarray(values)
+    upper = np.clip(np.searchsorted(array, values), 1, len(array) - 1)
+    lower = upper - 1
+    indices = np.where(np.abs(array[upper] - values) < np.abs(array[lower] - values), upper, lower)
+    indices[~np.isfinite(values)] = 0
+    return indices
+
+
 class FiducialFourLeafClover1250kg(StringLichen):
     """Fiducial volume cut: Four leaf Clover
 
@@ -389,25 +454,14 @@ class FiducialFourLeafClover1250kg(StringLichen):
     version = 1
 
     string = "(-92.9 < z) & (z < -9) & (r_phi < r_max)"
+    input_columns = ('x', 'y')
+    output_columns = ('r_phi', 'r_max')
+    derived_columns = ('r', 'phi')
 
     def pre(self, df):
 
         # first get the points from 210Po
-        # open file and get text
-        rho_phi_filename = os.path.join(DATA_DIR,
-                                        'R_phi_curve_360points.txt')
-        with open(rho_phi_filename) as file:
-            text = file.readlines()
-        # get value per line
-        phi_values = []
-        r_values = []
-        for line in text:
-            phi_values.append(float(line.split()[0]))
-            r_values.append(float(line.split()[1]))
-
-        # Set values needed for phi dependent radius
-        phi_values = np.array(phi_values)
-        r_values = np.array(r_values)
+        phi_values, r_values = get_r_phi_curve()
         # this is the average radius for the shape, this we scale
         average_radius_egg = np.average(r_values)
 
@@ -420,21 +474,6 @@ class FiducialFourLeafClover1250kg(StringLichen):
         depth_lower_bound = -96.9 + 4  # cm - stay away from the cathode
         max_height = depth_upper_bound - depth_lower_bound
 
-        # Go to polar coordinates
-        def cart2pol(x_value, y_value):
-            """This is a simple function to change coordinate system.
-            """
-            rho = np.sqrt(x_value ** 2 + y_value ** 2)
-            phi = np.arctan2(y_value, x_value)
-            return (rho, phi)
-
-        # Find argument of nearest value in array
-        def find_nearest(array, values):
-            """This is a simple function to find the argument of a value in an array.
-            """
-            indices = np.abs(np.subtract.outer(array, values)).argmin(0)
-            return indices
-
         # Get the dep max radius for a FV in R with an angle set by r_offset
         # takes depth array [cm], Max radius [cm], radius offset [cm],
         # total height of cylinder [cm], center of cylinder in depth [cm]
@@ -443,15 +482,16 @@ class FiducialFourLeafClover1250kg(StringLichen):
             the top radius by r_offset and decreases the bottom radius by r_offset while
             keeping a straight line in the R2-Z space to keep the volume the same.
             """
-            return np.sqrt((((R + r_offset) ** 2 - (R - r_offset) ** 2) / height) * (z_value - z_center + (height / 2)) + (
-                R - r_offset) ** 2)  # returns radius array [cm]
+            return np.sqrt((((R + r_offset) ** 2 - (R - r_offset) ** 2) / height) *
+                           (z_value - z_center + (height / 2)) +
+                           (R - r_offset) ** 2)  # returns radius array [cm]
 
-        # Rho from data
-        df.loc[:, 'r_phi'] = cart2pol(df['x'], df['y'])[0]
+        # Rho from data, polar coordinates are derived variables
+        df.loc[:, 'r_phi'] = df['r']
         # Max Rho
         df.loc[:, 'r_max'] = ((radius_scaling_value / average_radius_egg) *
                               coffee_r(df['z'],
-                                       r_values[find_nearest(phi_values, cart2pol(df['x'], df['y'])[1])],
+                                       r_values[find_nearest(phi_values, df['phi'].values)],
                                        radius_offset_value,
                                        max_height,
                                        -max_height / 2 + depth_upper_bound))
@@ -460,7 +500,8 @@ class FiducialFourLeafClover1250kg(StringLichen):
 
 class AmBeFiducial(StringLichen):
     """AmBe Fiducial volume cut.
-    This uses the same Z cuts as the 1T fiducial cylinder, but a wider allowed range in R to maximize the number of nuclear recoils.
+    This uses the same Z cuts as the 1T fiducial cylinder, but a wider allowed range in R to maximize the number of
+    nuclear recoils.
     There is a third cut on the distance to the source, so that we cut away background ER.
     Link to note:
     https://xecluster.lngs.infn.it/dokuwiki/lib/exe/fetch.php?media=xenon:xenon1t:hogenbirk:nr_band_sr0.html
@@ -470,14 +511,8 @@ class AmBeFiducial(StringLichen):
     Position updated to reflect correct I-Belt 1 position. Link to Note:xenon:xenon1t:analysis:dominick:sr1_ambe_check.
     """
     version = 2
-    string = "(distance_to_source < 103.5) & (-92.9 < z) & (z < -9) & (sqrt(x*x + y*y) < 42.00)"
-
-    def pre(self, df):
-        source_position = (97, 43.5, -50)
-        df.loc[:, 'distance_to_source'] = ((source_position[0] - df['x']) ** 2 +
-                                           (source_position[1] - df['y']) ** 2 +
-                                           (source_position[2] - df['z']) ** 2) ** 0.5
-        return df
+    string = "(distance_to_source < 103.5) & (-92.9 < z) & (z < -9) & (r < 42.00)"
+    derived_columns = (distance_to_source((97, 43.5, -50)), 'r')
 
 
 class InteractionExists(StringLichen):
@@ -545,9 +580,11 @@ class S1PatternLikelihood(ManyLichen):
     class S1TopPatternLikelihood(Lichen):
         """S1PatternLikelihood cut based on the top PMT array
         """
+        input_columns = ('s1_pattern_fit_hax', 's1_pattern_fit_bottom_hax')
+        derived_columns = ('s1t',)
 
         def _process(self, df):
-            s1t = df['s1'] * df['s1_area_fraction_top']
+            s1t = df['s1t']
             df.loc[:, self.name()] = (df['s1_pattern_fit_hax'] - df['s1_pattern_fit_bottom_hax'] <
                                       13.0 + 2.3 * s1t**0.5 + 8.0 * s1t - 1.0 * s1t**1.5 + 0.04 * s1t**2.0)
             return df
@@ -555,9 +592,11 @@ class S1PatternLikelihood(ManyLichen):
     class S1BottomPatternLikelihood(Lichen):
         """S1PatternLikelihood cut based on the bottom PMT array
         """
+        input_columns = ('s1_pattern_fit_bottom_hax',)
+        derived_columns = ('s1b',)
 
         def _process(self, df):
-            s1b = df['s1'] * (1. - df['s1_area_fraction_top'])
+            s1b = df['s1b']
             df.loc[:, self.name()] = (df['s1_pattern_fit_bottom_hax'] < - 10.5 + 21.9 * s1b**0.5 +
                                       1.44 * s1b - 0.21 * s1b**1.5 + 0.0064 * s1b**2.0)
             return df
@@ -617,6 +656,7 @@ class S2AreaFractionTop(Lichen):
 
     Contact: Adam Brown <abrown@physik.uzh.ch>
     """
+    input_columns = ('s2_area_fraction_top', 's2')
 
     def _process_v2(self, df):
         """This is a simple range cut which was chosen by eye.
@@ -672,6 +712,7 @@ class CS2AreaFractionTop(ManyLichen):
     See the note at xenon:xenon1t:adam:s2aft:sr1_cs2_cut
     """
     version = 0
+    derived_columns = ('cs2_aft',)
 
     class CS2AreaFractionTopUpper(StringLichen):
         """cS2 AFT upper bound
@@ -688,10 +729,6 @@ class CS2AreaFractionTop(ManyLichen):
         CS2AreaFractionTopLower()
     ]
 
-    def pre(self, df):
-        df.loc[:, 'cs2_aft'] = df['cs2_top'] / df['cs2']
-        return df
-
 
 class CS2AreaFractionTop96p(StringLichen):
     """cS2 area fraction top cut with 96% acceptance
@@ -702,6 +739,7 @@ class CS2AreaFractionTop96p(StringLichen):
     See the note at xenon:xenon1t:adam:s2aft:sr1_cs2_cut
     """
     string = 'cs2_aft < 0.63594139 + 0.912103 / sqrt(s2) | z < -9'
+    derived_columns = ('cs2_aft',)
 
 
 class S2SingleScatter(Lichen):
@@ -719,6 +757,7 @@ class S2SingleScatter(Lichen):
     version = 4
     allowed_range = (0, np.inf)
     variable = 'temp'
+    input_columns = ('largest_other_s2', 's2')
 
     @classmethod
     def other_s2_bound(cls, s2_area):
@@ -777,6 +816,21 @@ class S2Threshold(StringLichen):
     string = "200 < s2"
 
 
+def chi2_logpdf(x, df):
+    """Log of the chi2 density, the same values as scipy.stats.chi2.logpdf
+
+    Computed directly instead of through the scipy.stats machinery.  For NaN
+    and df <= 0 the result is -inf instead of NaN, so comparisons with a
+    threshold give the same result.
+    """
+    result = np.full(np.shape(x), -np.inf)
+    valid = (df > 0) & (x >= 0)
+    x, df = x[valid], df[valid]
+    with np.errstate(all='ignore'):
+        result[valid] = xlogy(df / 2. - 1, x) - x / 2. - gammaln(df / 2.) - (np.log(2) * df) / 2.
+    return result
+
+
 class S2Width(Lichen):
     """S2 Width cut based on diffusion model
     The S2 width cut compares the S2 width to what we could expect based on its depth in the detector. The inputs to
@@ -790,6 +844,8 @@ class S2Width(Lichen):
     Contact: Tianyu <tz2263@columbia.edu>, Yuehuan <weiyh@physik.uzh.ch>, Jelle <jaalbers@nikhef.nl>
     """
     version = 6
+    input_columns = ('drift_time', 's2', 's2_range_50p_area')
+    output_columns = ('nElectron', 'normWidth')
 
     diffusion_constant = 25.26 * ((units.cm)**2) / units.s
     v_drift = 1.440 * (units.um) / units.ns
@@ -798,25 +854,38 @@ class S2Width(Lichen):
     SigmaToR50 = 1.349
     DriftTimeFromGate = 1.6 * units.us
 
-    def s2_width_model(self, drift_time):
+    @classmethod
+    def s2_width_model(cls, drift_time):
         """Diffusion model
         """
-        return np.sqrt(2 * self.diffusion_constant * (drift_time - self.DriftTimeFromGate) / self.v_drift ** 2)
+        return np.sqrt(2 * cls.diffusion_constant * (drift_time - cls.DriftTimeFromGate) / cls.v_drift ** 2)
 
-    def _process(self, df):
-        df.loc[:, self.name()] = True  # Default is True
-        mask = df.drift_time > self.DriftTimeFromGate
-        df.loc[mask, 'nElectron'] = np.clip(df.loc[mask, 's2'], 0, 5000) / self.scg
-        df.loc[mask, 'normWidth'] = (np.square(df.loc[mask, 's2_range_50p_area'] / self.SigmaToR50) -
-                                     np.square(self.scw)) / np.square(self.s2_width_model(df.loc[mask, 'drift_time']))
-        df.loc[mask, self.name()] = chi2.logpdf(df.loc[mask, 'normWidth'] * (df.loc[mask, 'nElectron'] - 1),
-                                                df.loc[mask, 'nElectron']) > - 14
-        return df
+    @classmethod
+    def width_logpdf(cls, drift_time, s2, s2_range_50p_area):
+        """Log density of the S2 width for an interaction at drift_time
+
+        Only events drifting from below the gate are computed, on compact arrays.
+        Also used by S1SingleScatter with the drift time of the other S1.
+
+        :return: (mask of computed events, number of electrons, normalized
+                  width, log density), the last three for the masked events
+        """
+        mask = drift_time > cls.DriftTimeFromGate
+        n_electron = np.clip(s2[mask], 0, 5000) / cls.scg
+        norm_width = (np.square(s2_range_50p_area[mask] / cls.SigmaToR50) -
+                      np.square(cls.scw)) / np.square(cls.s2_width_model(drift_time[mask]))
+        return mask, n_electron, norm_width, chi2_logpdf(norm_width * (n_electron - 1), n_electron)
 
-    def post(self, df):
-        for temp_column in ['nElectron', 'normWidth']:
-            if temp_column in df.columns:
-                df.drop(temp_column, 1, inplace=True)
+    def _process(self, df):
+        mask, n_electron, norm_width, logpdf = self.width_logpdf(
+            df['drift_time'].values, df['s2'].values, df['s2_range_50p_area'].values)
+        for column, values in (('nElectron', n_electron), ('normWidth', norm_width)):
+            full = np.full(len(df), np.nan)
+            full[mask] = values
+            df.loc[:, column] = full
+        passed = np.ones(len(df), dtype=bool)  # Default is True
+        passed[mask] = logpdf > - 14
+        df.loc[:, self.name()] = passed
         return df
 
 
@@ -839,27 +908,153 @@ class S1SingleScatter(Lichen):
     """
 
     version = 4
+    input_columns = ('alt_s1_interaction_drift_time', 's2', 's2_range_50p_area')
     s2width = S2Width
 
     def _process(self, df):
-        df.loc[:, self.name()] = True  # Default is True
-        mask = df.alt_s1_interaction_drift_time > self.s2width.DriftTimeFromGate
-        alt_n_electron = np.clip(df.loc[mask, 's2'], 0, 5000) / self.s2width.scg
+        # Width of the main S2 if it came with the alternate S1
+        mask, _, _, logpdf = self.s2width.width_logpdf(df['alt_s1_interaction_drift_time'].values,
+                                                       df['s2'].values, df['s2_range_50p_area'].values)
+        alt_interaction_passes = logpdf > - 20
+
+        passed = np.ones(len(df), dtype=bool)  # Default is True
+        passed[mask] = True ^ alt_interaction_passes
+        df.loc[:, self.name()] = passed
 
-        # Alternate S1 relative width
-        alt_rel_width = np.square(df.loc[mask,
-                                         's2_range_50p_area'] / self.s2width.SigmaToR50) - np.square(self.s2width.scw)
-        alt_rel_width /= np.square(self.s2width.s2_width_model(self.s2width,
-                                                               df.loc[mask, 'alt_s1_interaction_drift_time']))
+        return df
 
-        alt_interaction_passes = chi2.logpdf(alt_rel_width * (alt_n_electron - 1), alt_n_electron) > - 20
 
-        df.loc[mask, (self.name())] = True ^ alt_interaction_passes
+_S1_AFT_MAP = {}
 
-        return df
 
+def get_s1_aft_map():
+    """Linear interpolation of the expected S1 area fraction top in (r, z), built once
 
-class S1AreaFractionTop(StringLichen):
+    Linear like in the hax PositionReconstruction treemaker: a cubic spline
+    differs by up to 0.004 inside the map, about the binomial error at 1e4 PE.
+    """
+    if 'map' not in _S1_AFT_MAP:
+        with open(os.path.join(DATA_DIR, 's1_aft_rz_02Mar2017.json')) as infile:
+            aft_map = json.load(infile)
+        r_pts, z_pts = np.array(aft_map['r_pts']), np.array(aft_map['z_pts'])
+        values = np.array(aft_map['map']).reshape(len(r_pts), len(z_pts))
+        _S1_AFT_MAP['map'] = RectBivariateSpline(r_pts, z_pts, values, kx=1, ky=1)
+    return _S1_AFT_MAP['map']
+
+
+MODE_ITERATIONS = 4  # Newton steps for the mode in binom_test
+
+
+def newton(function, x, low, high, args=(), tolerance=1e-9, max_iterations=100):
+    """Roots of many functions at once by Newton's method
+
+    Iterates only the elements that have not converged yet.
+
+    :param function: Called as function(x, *args) with the unconverged
+                     elements, returns (values, derivatives)
+    :param x: Array of starting points
+    :param low, high: Arrays of the ranges the roots are in
+    :param args: Arrays of parameters, one element per root
+    """
+    x = x.copy()
+    active = np.arange(len(x))
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        value, derivative = function(x[active], *[arg[active] for arg in args])
+        with np.errstate(all='ignore'):
+            new = np.clip(x[active] - value / derivative, low[active], high[active])
+        change = np.abs(new - x[active])
+        x[active] = new
+        active = active[change > tolerance * (1 + np.abs(new))]
+    return x
+
+
+def trigamma_asymptotic(x):
+    """Approximation of the trigamma function at x + 1, within 0.5% from x = 1"""
+    z = x + 0.5
+    return 1 / z - 1 / (12 * z ** 3)
+
+
+def skew_correction(distance, n, mode):
+    """Shift of the mirror image of mode + distance to the point of equal probability
+
+    From the log probability expanded to third order around the mode.
+    """
+    a, b = 1 / (n - mode + 0.5), 1 / (mode + 0.5)
+    second, third = -(a + b) / 2, (b * b - a * a) / 6
+    with np.errstate(all='ignore'):
+        shift = 2 * third * distance ** 2 / (3 * third * distance - 2 * second)
+    return np.where(np.isfinite(shift), shift, 0)
+
+
+def binom_test(k, n, p):
+    """Two-sided binomial test of k successes out of n, for many events at once
+
+    The continuous version of scipy.stats.binom_test used by the hax
+    PositionReconstruction treemaker: find the j on the other side of the
+    mode with the same probability as k, and add the tails outward from k
+    and j.  k and n need not be integers, e.g. areas in PE.
+
+    :return: Array of p-values, NaN where n <= 0, k is outside [0, n] or p
+             is outside (0, 1)
+    """
+    k, n, p = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in (k, n, p)])
+    result = np.full(k.shape, np.nan)
+    with np.errstate(invalid='ignore'):
+        valid = (n > 0) & (k >= 0) & (k <= n) & (p > 0) & (p < 1)
+    k, n, p = k[valid], n[valid], p[valid]
+    log_odds = np.log(p) - np.log1p(-p)
+    zeros = np.zeros(len(k))
+
+    def slope(x, n, log_odds):
+        # Derivative of the log probability in k, which decreases with k
+        return digamma(n - x + 1) - digamma(x + 1) + log_odds
+
+    def mode_step(x, n, log_odds):
+        # Second derivative from the asymptotic form of the trigamma function
+        return slope(x, n, log_odds), -trigamma_asymptotic(n - x) - trigamma_asymptotic(x)
+
+    # The mode is within 1 of the integer mode, and only needed roughly: it
+    # decides the side of k and brackets j
+    mode = newton(mode_step, np.minimum(np.floor((n + 1) * p), n), zeros, n, (n, log_odds),
+                  tolerance=1e-6, max_iterations=MODE_ITERATIONS)
+
+    # Find j where the probability drops to that of k, starting from the
+    # mirror image of k corrected for the skew.  As the log probability is
+    # concave, at most the first step overshoots.
+    right = k < mode
+    low, high = np.where(right, mode, 0), np.where(right, n, mode)
+    end = np.where(right, n, 0)
+
+    def log_probability(x, n, log_odds):
+        # Log probability without the terms that do not depend on x
+        return x * log_odds - gammaln(n - x + 1) - gammaln(x + 1)
+
+    def difference(x, n, log_odds, offset):
+        return log_probability(x, n, log_odds) - offset, slope(x, n, log_odds)
+
+    # Where the probability at the end is above that of k, j is the end
+    offset = log_probability(k, n, log_odds)
+    crossing = log_probability(end, n, log_odds) < offset
+    j = end.copy()
+    start = np.clip(2 * mode - k + skew_correction(k - mode, n, mode), low, high)
+    j[crossing] = newton(difference, start[crossing], low[crossing], high[crossing],
+                         (n[crossing], log_odds[crossing], offset[crossing]))
+
+    # Only evaluate the tails that are not empty
+    lower, upper = np.where(right, k, j), np.where(right, j, k)
+    p_value = np.zeros(len(k))
+    tail = lower > 0
+    p_value[tail] = betainc(n[tail] - lower[tail], lower[tail] + 1, 1 - p[tail])
+    tail = upper < n
+    p_value[tail] += betainc(upper[tail] + 1, n[tail] - upper[tail], p[tail])
+    p_value[k == mode] = 1
+    result[valid] = np.minimum(p_value, 1)
+    return result
+
+
+class S1AreaFractionTop(Lichen):
     '''S1 area fraction top cut
 
     Uses a modified version of scipy.stats.binom_test to compute a p-value based on the
@@ -869,7 +1064,8 @@ class S1AreaFractionTop(StringLichen):
     Algorithm imported in PositionReconstruction treemaker using corrected positions to calculate
     p-value.
 
-    Requires PositionReconstruction minitrees.
+    The p-value is computed here for all events at once (see binom_test), with the expected
+    fraction from the (r, z) map in lax/data, so PositionReconstruction minitrees are not needed.
 
     note: https://xe1t-wiki.lngs.infn.it/doku.php?id=xenon:xenon1t:darryl:xe1t_s1_aft_map
     also https://xe1t-wiki.lngs.infn.it/doku.php?id=xenon:xenon1t:darryl:s1_aft_update
@@ -877,8 +1073,22 @@ class S1AreaFractionTop(StringLichen):
     Contact: Darryl Masson, dmasson@purdue.edu
              Shingo Kazama, kazama@physik.uzh.ch
     '''
-    version = 4
-    string = "s1_area_fraction_top_probability_hax > 0.001"
+    version = 6
+    input_columns = ('s1', 's1_area_fraction_top', 'r', 'z')
+    output_columns = ('s1_area_fraction_top_probability',)
+    derived_columns = ('r',)
+
+    def _process(self, df):
+        r, z = df['r'].values, df['z'].values
+        aft = np.full(len(df), np.nan)
+        inside = np.isfinite(r) & np.isfinite(z)
+        aft[inside] = get_s1_aft_map().ev(r[inside], z[inside])
+
+        s1 = df['s1'].values
+        probability = binom_test(s1 * df['s1_area_fraction_top'].values, s1, aft)
+        df.loc[:, 's1_area_fraction_top_probability'] = probability
+        df.loc[:, self.name()] = probability > 0.001
+        return df
 
 
 class PreS2Junk(StringLichen):
@@ -946,6 +1156,7 @@ class Flash(Lichen):
     """
 
     version = 0
+    input_columns = ('inside_flash', 'nearest_flash', 'flashing_width')
 
     def _process(self, df):
         df.loc[:, self.name()] = ((df['inside_flash'] == False) &
@@ -965,6 +1176,7 @@ class PosDiff(Lichen):
     Contact: Yuehuan Wei <ywei@physics.ucsd.edu>, Tianyu Zhu <tz2263@columbia.edu>
     """
     version = 4
+    input_columns = ('x_observed_nn', 'x_observed_tpf', 'y_observed_nn', 'y_observed_tpf', 's2')
 
     def _process(self, df):
         df.loc[:, self.name()] = (np.sqrt((df['x_observed_nn'] - df['x_observed_tpf'])**2 +
@@ -982,26 +1194,33 @@ class SingleElectronS2s(Lichen):  # noqa
     """
 
     version = 5
+    input_columns = ('s1', 's1_area_fraction_top', 's1_rise_time', 's1_range_90p_area')
+    output_columns = ('ses2prob',)
 
-    def _process(self, df):
-
-        # Random forest classifier
-        forest_filename = os.path.join(DATA_DIR, 'XENON1T_random_forest_peak_classifier_02052018.pkl')
-        forest_load = pickle.load(open(forest_filename, 'rb'))  # noqa
+    # Random forest and Gradient Boosted Decesion Tree classifiers, with their weights
+    model_files = (('XENON1T_random_forest_peak_classifier_02052018.pkl', 0.5),
+                   ('XENON1T_gradient_bdt_peak_classifier_02052018.pkl', 0.5))
+    chunk_size = 100000  # events classified at once
+    n_threads = 1  # chunks classified concurrently
 
-        # Gradient Boosted Decesion Tree classifier
-        gbdt_filename = os.path.join(DATA_DIR, 'XENON1T_gradient_bdt_peak_classifier_02052018.pkl')
-        gbdt_load = pickle.load(open(gbdt_filename, 'rb'))  # noqa
+    def get_models(self):
+        """List of (classifier, weight), loaded once per process"""
+        return [(models.get_model(os.path.join(DATA_DIR, filename)), weight)
+                for filename, weight in self.model_files]
 
-        def _classifier_soft(features):
-            return 0.5 * forest_load.predict_proba(features) + 0.5 * gbdt_load.predict_proba(features)
+    def preload(self):
+        self.get_models()
+        return self
 
-        df.loc[:, 'ses2prob'] = _classifier_soft(df[['s1', 's1_area_fraction_top', 's1_rise_time',
-                                                     's1_range_90p_area']])[:, 1]
+    def _process(self, df):
+        features = df[['s1', 's1_area_fraction_top', 's1_rise_time', 's1_range_90p_area']].values
+        df.loc[:, 'ses2prob'] = models.predict_proba(self.get_models(), features,
+                                                     self.chunk_size, self.n_threads)[:, 1]
 
         cut_threshold = 0.9
 
         # current model is trained by data with S1 < 70PE and S1 width < 450PE
+        # Events with a NaN feature have a NaN ses2prob: they only pass if S1 > 70PE
         df.loc[:, self.name()] = (((df['ses2prob'] <= cut_threshold) & (df['s1_range_90p_area'] < 450)) |
                                   (df['s1'] > 70))
 
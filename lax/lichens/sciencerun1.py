@@ -6,9 +6,9 @@ This includes all current definitions of the cuts for the second science run
 # -*- coding: utf-8 -*-
 import inspect
 import os
-import numpy as np
 from pax import units
 
+from lax.derived import distance_to_source
 from lax.lichen import ManyLichen, StringLichen
 from lax.lichens import sciencerun0
 from lax import __version__ as lax_version
@@ -184,16 +184,10 @@ class FiducialTestEllips(StringLichen):
     parameter_symbols = tuple('z0 vz p vr2'.split())
     parameter_values = None   # Will be tuple of parameter values
     string = "((((((z_3d_nn-@z0)**2)**0.5)/@vz)**@p)+(r_3d_nn**2/@vr2)**@p)<1"
+    derived_columns = ('r_3d_nn',)
 
-    def _process(self, df):
-        bla = dict(zip(self.parameter_symbols, self.parameter_values))
-        df.loc[:, self.name()] = df.eval(self.string,
-                                         global_dict=bla)
-        return df
-
-    def pre(self, df):
-        df.loc[:, 'r_3d_nn'] = np.sqrt(df['x_3d_nn']**2 + df['y_3d_nn']**2)
-        return df
+    def parameters(self):
+        return dict(zip(self.parameter_symbols, self.parameter_values))
 
 
 for mass, params in FV_CONFIGS:
@@ -202,6 +196,13 @@ for mass, params in FV_CONFIGS:
     c.parameter_values = params
     locals()[name] = c
 
+
+class FiducialTestEllipsScan(sciencerun0.FiducialTestEllipsScan):
+    """All FiducialTestEllips<mass> cuts of science run 1 in one pass, see sciencerun0
+    """
+    fv_configs = FV_CONFIGS
+
+
 AmBeFiducial = sciencerun0.AmBeFiducial
 
 
@@ -212,14 +213,8 @@ class NGFiducial(StringLichen):
     Link to Note:xenon:xenon1t:analysis:dominick:sr1_ambe_check (By Dominic)
     """
     version = 0
-    string = "(distance_to_source < 111.5) & (-92.9 < z) & (z < -9) & (sqrt(x*x + y*y) < 42.00)"
-
-    def pre(self, df):
-        source_position = (31.6, 86.8, -50)
-        df.loc[:, 'distance_to_source'] = ((source_position[0] - df['x']) ** 2 +
-                                           (source_position[1] - df['y']) ** 2 +
-                                           (source_position[2] - df['z']) ** 2) ** 0.5
-        return df
+    string = "(distance_to_source < 111.5) & (-92.9 < z) & (z < -9) & (r < 42.00)"
+    derived_columns = (distance_to_source((31.6, 86.8, -50)), 'r')
 
 
 InteractionExists = sciencerun0.InteractionExists
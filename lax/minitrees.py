@@ -0,0 +1,71 @@
+"""Which hax minitree provides which column
+
+Used to only load the minitrees that a set of lichens actually reads.  This has
+to be kept in sync with the hax treemakers when cuts on new variables are added.
+"""
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+MINITREE_COLUMNS = OrderedDict([
+    ('Fundamentals', ('run_number', 'event_number', 'event_time', 'event_duration')),
+    ('Corrections', ('cs1', 'cs2', 'cs2_top', 'cs2_bottom',
+                     'x_3d_nn', 'y_3d_nn', 'z_3d_nn', 'r_3d_nn')),
+    ('Basics', ('s1', 's2', 'x', 'y', 'z', 'drift_time',
+                's1_area_fraction_top', 's2_area_fraction_top',
+                's1_range_50p_area', 's2_range_50p_area', 's1_largest_hit_area',
+                'largest_other_s1', 'largest_other_s2', 'largest_other_s2_delay_main_s1',
+                'alt_s1_interaction_drift_time')),
+    ('TotalProperties', ('area_before_main_s2',)),
+    ('Extended', ('s1_rise_time', 's1_range_90p_area', 's2_pattern_fit')),
+    ('TailCut', ('s2_over_tdiff',)),
+    ('Proximity', ('previous_busy_on', 'previous_busy_off', 'nearest_busy', 'nearest_hev',
+                   'nearest_muon_veto_trigger')),
+    ('PositionReconstruction', ('x_observed_nn', 'y_observed_nn', 'x_observed_tpf', 'y_observed_tpf',
+                                's1_pattern_fit_hax', 's1_pattern_fit_bottom_hax',
+                                's1_area_fraction_top_probability_hax',
+                                's1_area_upper_injection_fraction',
+                                's1_area_lower_injection_fraction')),
+    # Properties of the largest S1, which older minitrees only have here
+    ('LargestPeakProperties', ('s1_largest_hit_area', 's1_rise_time', 's1_range_90p_area')),
+    ('FlashIdentification', ('inside_flash', 'nearest_flash', 'flashing_width')),
+])
+
+# Always loaded, these identify the events
+KEY_MINITREES = ['Fundamentals']
+
+
+def get_minitrees(columns):
+    """Minitrees needed to get all columns
+
+    A column provided by several minitrees loads all of them, as laxer did
+    before it knew which minitree provides what.
+
+    :param columns: Iterable of column names
+    :return: List of minitree names, in the order of MINITREE_COLUMNS
+    :raises KeyError: if a column is not provided by any known minitree
+    """
+    columns = set(columns)
+    known = set(column for provided in MINITREE_COLUMNS.values() for column in provided)
+    unknown = columns - known
+    if unknown:
+        raise KeyError('No minitree known for %s' % sorted(unknown))
+
+    return [minitree for minitree, provided in MINITREE_COLUMNS.items()
+            if minitree in KEY_MINITREES or columns & set(provided)]
+
+
+def required_minitrees(lichens):
+    """Minitrees needed to process all lichens
+
+    :param lichens: List of Lichen (e.g. cut sets)
+    :return: List of minitree names
+    :raises KeyError: if columns of a lichen are unknown or have no minitree
+    """
+    columns = set()
+    for lichen in lichens:
+        required = lichen.required_columns()
+        if required is None:
+            raise KeyError('Columns read by %s are not declared' % lichen.name())
+        columns |= required
+    return get_minitrees(columns)
@@ -0,0 +1,93 @@
+"""Classifiers used by cuts, loaded once per process
+
+Unpickling a classifier takes longer than applying it to a run, so every file
+is loaded the first time it is needed and then kept.  Tree ensembles converted
+by lax.trees are used instead of their pickle.  Jobs can load them up
+front with ManyLichen.preload (or preload here), e.g. before forking workers.
+
+predict_proba applies classifiers to chunks of rows, optionally on a thread
+pool, so the features of a whole large frame are never copied at once.
+"""
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class ModelCache(object):
+    """Loaded classifiers by filename"""
+
+    def __init__(self):
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def get(self, filename):
+        """Classifier in a pickle file, loaded on first use
+
+        If there is an .npz file of the same name made by lax.trees.convert,
+        that is loaded instead.
+        """
+        with self.lock:
+            if filename not in self.models:
+                self.models[filename] = load(filename)
+            return self.models[filename]
+
+    def preload(self, filenames):
+        """Load classifiers now, instead of when first used"""
+        for filename in filenames:
+            self.get(filename)
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+
+
+def load(filename):
+    """Classifier in a pickle file, or in the .npz file of the same name"""
+    npz_filename = os.path.splitext(filename)[0] + '.npz'
+    if os.path.exists(npz_filename):
+        from lax import trees
+        return trees.load(npz_filename)
+    with open(filename, 'rb') as infile:
+        return pickle.load(infile)  # noqa
+
+
+MODELS = ModelCache()
+
+
+def get_model(filename):
+    return MODELS.get(filename)
+
+
+def preload(filenames):
+    MODELS.preload(filenames)
+
+
+def predict_proba(weighted_models, features, chunk_size=100000, n_threads=1):
+    """Weighted average of the class probabilities of classifiers
+
+    :param weighted_models: List of (classifier, weight)
+    :param features: 2d array, one row per event
+    :param chunk_size: Number of rows given to the classifiers at once
+    :param n_threads: Number of chunks evaluated concurrently
+    :return: 2d array of probabilities, one row per event
+    """
+    result = np.empty((len(features), len(weighted_models[0][0].classes_)))
+
+    def run(start):
+        chunk = np.asarray(features[start:start + chunk_size])
+        result[start:start + len(chunk)] = sum(weight * model.predict_proba(chunk)
+                                               for model, weight in weighted_models)
+
+    starts = range(0, len(features), chunk_size)
+    if n_threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(n_threads) as executor:
+            list(executor.map(run, starts))
+    else:
+        for start in starts:
+            run(start)
+    return result
@@ -0,0 +1,298 @@
+"""Compiled evaluation plans for cut strings
+
+A StringLichen is normally evaluated with its own call to DataFrame.eval, which
+parses the string again on every call and makes a full pass over the frame for
+every intermediate.  A CutPlan parses the strings of a whole cut set once,
+removes the subexpressions they share (e.g. sqrt(x*x + y*y) or s2**0.5) and
+compiles everything into a single code object operating on numpy arrays.
+
+The strings follow the DataFrame.eval dialect: '&' and '|' bind like 'and' and
+'or' (so "a < 1 & b > 2" needs no brackets) and '@name' refers to a parameter
+of the lichen instead of a column.
+"""
+# -*- coding: utf-8 -*-
+
+import ast
+import io
+import tokenize
+
+import numpy as np
+
+# Functions that DataFrame.eval (numexpr) knows about
+FUNCTIONS = {
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'expm1': np.expm1,
+    'log': np.log,
+    'log1p': np.log1p,
+    'log10': np.log10,
+    'abs': np.abs,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'arcsin': np.arcsin,
+    'arccos': np.arccos,
+    'arctan': np.arctan,
+    'arctan2': np.arctan2,
+    'sinh': np.sinh,
+    'cosh': np.cosh,
+    'tanh': np.tanh,
+    'arcsinh': np.arcsinh,
+    'arccosh': np.arccosh,
+    'arctanh': np.arctanh,
+}
+
+PARAMETER_PREFIX = '_at_'
+FUNCTION_PREFIX = '_fn_'
+TEMPORARY_PREFIX = '_cse_'
+
+
+def _is_constant(node):
+    return type(node).__name__ in ('Constant', 'Num')
+
+
+def _constant_value(node):
+    return node.value if hasattr(node, 'value') else node.n
+
+
+def _constant(value):
+    if hasattr(ast, 'Constant'):
+        return ast.Constant(value=value)
+    return ast.Num(n=value)
+
+
+def parse(string):
+    """Parse a cut string into a python expression tree
+
+    :param string: Expression in the DataFrame.eval dialect
+    :return: ast.Expression
+    """
+    string = ' '.join(string.split())
+    tokens = []
+    readline = io.StringIO(u'%s' % string).readline
+    parameter = False
+    for token in tokenize.generate_tokens(readline):
+        kind, value = token[0], token[1]
+        if kind == tokenize.OP and value == '@':
+            parameter = True
+            continue
+        if parameter:
+            tokens.append((tokenize.NAME, PARAMETER_PREFIX + value))
+            parameter = False
+        elif kind == tokenize.OP and value == '&':
+            tokens.append((tokenize.NAME, 'and'))
+        elif kind == tokenize.OP and value == '|':
+            tokens.append((tokenize.NAME, 'or'))
+        else:
+            tokens.append((kind, value))
+    return ast.parse(tokenize.untokenize(tokens).strip(), mode='eval')
+
+
+def names(tree):
+    """Names of all columns read by a parsed expression
+
+    Parameters (@name) and function names are not included.
+    """
+    functions = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            functions.add(id(node.func))
+    return set(node.id for node in ast.walk(tree)
+               if isinstance(node, ast.Name) and id(node) not in functions and
+               not node.id.startswith(PARAMETER_PREFIX))
+
+
+class _Lower(ast.NodeTransformer):
+    """Rewrite a parsed cut string into plain numpy array operations
+
+    * 'and', 'or' and 'not' become '&', '|' and '~'
+    * chained comparisons become '&' of the single comparisons
+    * parameters are replaced by their values
+    * x**0.5 becomes sqrt(x), which is what numpy and numexpr do internally
+    """
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            node.op = ast.Invert()
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        result = None
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            compare = ast.Compare(left=left, ops=[op], comparators=[right])
+            result = compare if result is None else ast.BinOp(left=result,
+                                                              op=ast.BitAnd(),
+                                                              right=compare)
+            left = right
+        return result
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if (isinstance(node.op, ast.Pow) and _is_constant(node.right) and
+                _constant_value(node.right) == 0.5):
+            return ast.Call(func=ast.Name(id='sqrt', ctx=ast.Load()),
+                            args=[node.left], keywords=[])
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise ValueError('Unsupported function in cut string: %s' % ast.dump(node.func))
+        if node.keywords:
+            raise ValueError('Keyword arguments are not supported in cut strings')
+        return node
+
+    def visit_Name(self, node):
+        if node.id.startswith(PARAMETER_PREFIX):
+            key = node.id[len(PARAMETER_PREFIX):]
+            if key not in self.parameters:
+                raise ValueError('Parameter @%s is not defined' % key)
+            return _constant(self.parameters[key])
+        return node
+
+    def generic_visit(self, node):
+        allowed = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+                   ast.Call, ast.Name, ast.Load, ast.operator, ast.unaryop,
+                   ast.boolop, ast.cmpop)
+        if not (isinstance(node, allowed) or _is_constant(node)):
+            raise ValueError('Unsupported syntax in cut string: %s' % type(node).__name__)
+        return ast.NodeTransformer.generic_visit(self, node)
+
+
+class _Eliminate(ast.NodeTransformer):
+    """Replace every repeated subexpression with a temporary variable"""
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.temporaries = {}
+        self.assignments = []
+
+    def generic_visit(self, node):
+        key = None
+        if isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Call, ast.Compare)):
+            key = _key(node)
+        node = ast.NodeTransformer.generic_visit(self, node)
+        if key is None or self.counts.get(key, 0) < 2:
+            return node
+        if key not in self.temporaries:
+            name = '%s%d' % (TEMPORARY_PREFIX, len(self.temporaries))
+            self.temporaries[key] = name
+            self.assignments.append(ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())],
+                                               value=node))
+        return ast.Name(id=self.temporaries[key], ctx=ast.Load())
+
+
+def _key(node):
+    """Key identifying an expression, or None if it has no column inputs"""
+    if not any(isinstance(child, ast.Name) and child.id not in FUNCTIONS
+               for child in ast.walk(node)):
+        return None
+    return ast.dump(node)
+
+
+def _count(trees):
+    counts = {}
+    for tree in trees:
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Call, ast.Compare)):
+                key = _key(node)
+                if key is not None:
+                    counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+class _Functions(ast.NodeTransformer):
+    """Move function names out of the way of column names"""
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        node.func = ast.Name(id=FUNCTION_PREFIX + node.func.id, ctx=ast.Load())
+        return node
+
+
+class CutPlan(object):
+    """Shared evaluation of many cut strings
+
+    Only lichens that are fully described by their string (see plannable) are
+    compiled; the names of those are in self.names.  Evaluation returns the same
+    boolean values as DataFrame.eval would.
+    """
+
+    def __init__(self, lichens):
+        self.names = []
+        self.columns = set()
+
+        trees = []
+        for lichen in lichens:
+            if not plannable(lichen):
+                continue
+            try:
+                tree = parse(lichen.string)
+                columns = names(tree)
+                tree = _Lower(lichen.parameters()).visit(tree)
+            except (SyntaxError, ValueError):
+                continue
+            self.names.append(lichen.name())
+            self.columns |= columns
+            trees.append(tree.body)
+
+        eliminate = _Eliminate(_count(trees))
+        outputs = [eliminate.visit(tree) for tree in trees]
+        self.n_temporaries = len(eliminate.assignments)
+
+        body = eliminate.assignments + [
+            ast.Assign(targets=[ast.Name(id='_result', ctx=ast.Store())],
+                       value=ast.Tuple(elts=outputs, ctx=ast.Load()))]
+        module = ast.Module(body=body, type_ignores=[]) if hasattr(ast, 'TypeIgnore') else ast.Module(body=body)
+        module = ast.fix_missing_locations(_Functions().visit(module))
+        self.code = compile(module, '<lax plan>', 'exec')
+        self.functions = dict((FUNCTION_PREFIX + key, value) for key, value in FUNCTIONS.items())
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def evaluate(self, df, values=None):
+        """Evaluate all compiled cuts in one go
+
+        :param df: DataFrame containing all columns in self.columns
+        :param values: Dictionary of column name to array, used instead of
+                       (or besides) the columns of df
+        :return: OrderedDict-like list of (cut name, boolean array) pairs
+        """
+        values = values or {}
+        namespace = dict((column, np.asarray(values[column] if column in values else df[column]))
+                         for column in self.columns)
+        with np.errstate(all='ignore'):
+            exec(self.code, self.functions, namespace)
+        return [(name, np.broadcast_to(result, (len(df),)))
+                for name, result in zip(self.names, namespace['_result'])]
+
+
+def plannable(lichen):
+    """Whether a lichen is completely described by its cut string
+
+    This means it is a StringLichen that does not override pre, _process or post.
+    """
+    from lax.lichen import Lichen, StringLichen
+    cls = type(lichen)
+    return (isinstance(lichen, StringLichen) and
+            cls.pre is Lichen.pre and
+            cls._process is StringLichen._process and
+            cls.post is Lichen.post)
@@ -0,0 +1,165 @@
+"""Time and memory used by each lichen
+
+Turned on for a cut set with ManyLichen.profile, or for a single lichen with
+Lichen.profile.  For every lichen, including those in nested cut sets, the
+wall and CPU time, the number of rows evaluated and passing and, optionally,
+the allocated and peak memory are recorded.  Example:
+
+    cuts = sciencerun1.LowEnergyBackground().profile(memory=True)
+    cuts.process(df)
+    print(cuts.profiler.to_dataframe())
+
+Memory is traced with tracemalloc, which slows down processing noticeably, so
+it is off by default.  CPU time and memory are those of the whole process, so
+they are only meaningful for lichens that are not processed in parallel.
+Before Python 3.9 the peak cannot be reset, see reset_peak.
+"""
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import pandas as pd
+
+COLUMNS = ('calls', 'wall_time', 'cpu_time', 'rows', 'passed',
+           'allocated_memory', 'peak_memory')
+
+# Memory traced before tracemalloc.clear_traces was last called by reset_peak
+CLEARED = {'memory': 0}
+
+
+def get_traced_memory():
+    """Current and peak traced memory, like tracemalloc.get_traced_memory
+
+    Includes the memory traced before reset_peak cleared the traces.
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    return current + CLEARED['memory'], peak + CLEARED['memory']
+
+
+def reset_peak():
+    """Let the traced peak start again from the current memory
+
+    tracemalloc.reset_peak is new in Python 3.9.  Before, the traces are
+    cleared instead: memory allocated until then is still counted when it is
+    freed later, so the allocated and peak memory are upper limits.
+    """
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        CLEARED['memory'] += tracemalloc.get_traced_memory()[0]
+        tracemalloc.clear_traces()
+
+
+class Profiler(object):
+    """Records of the resources used by lichens
+
+    Lichens are named by the path of cut names from the outermost cut set,
+    e.g. CutAllEnergy.CutDAQVeto.CutEndOfRunCheck.
+
+    :param memory: True or False on whether to trace memory
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get_stack(self):
+        """Names of the cut sets being evaluated in this thread"""
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def set_stack(self, stack):
+        """Continue the stack of another thread (e.g. in a thread pool)"""
+        self.local.stack = list(stack)
+
+    def start(self, name):
+        """Start measuring a lichen
+
+        :param name: Cut name of the lichen
+        :return: Measurement to pass to stop
+        """
+        stack = self.get_stack()
+        measurement = dict(name='.'.join(stack + [name]),
+                           wall_time=time.time(),
+                           cpu_time=time.process_time())
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = get_traced_memory()
+            # The peak is reset below: remember it for the enclosing measurements
+            for enclosing in self.get_open():
+                enclosing['max_peak'] = max(enclosing['max_peak'], peak)
+            reset_peak()
+            measurement.update(allocated_memory=current, max_peak=current)
+            self.get_open().append(measurement)
+        return measurement
+
+    def stop(self, measurement):
+        """Stop measuring a lichen"""
+        measurement['wall_time'] = time.time() - measurement['wall_time']
+        measurement['cpu_time'] = time.process_time() - measurement['cpu_time']
+        if self.memory:
+            current, peak = get_traced_memory()
+            start = measurement['allocated_memory']
+            measurement['allocated_memory'] = current - start
+            measurement['peak_memory'] = max(peak, measurement.pop('max_peak')) - start
+            self.local.open = [other for other in self.get_open() if other is not measurement]
+        return measurement
+
+    def get_open(self):
+        """Measurements of memory started but not stopped in this thread"""
+        if not hasattr(self.local, 'open'):
+            self.local.open = []
+        return self.local.open
+
+    def add(self, measurement, rows, passed):
+        """Add a stopped measurement with the number of rows evaluated and passing"""
+        record = OrderedDict(name=measurement['name'])
+        record['calls'] = 1
+        for column in COLUMNS[1:]:
+            if column == 'rows':
+                record[column] = int(rows)
+            elif column == 'passed':
+                record[column] = int(passed)
+            else:
+                record[column] = measurement.get(column, 0)
+        with self.lock:
+            self.records.append(record)
+
+    def reset(self):
+        with self.lock:
+            self.records = []
+
+    def to_dataframe(self):
+        """Summary per lichen, summed over all calls (peak memory is the maximum)
+
+        :return: DataFrame indexed by lichen name, in order of first evaluation
+        """
+        with self.lock:
+            records = list(self.records)
+        if not records:
+            return pd.DataFrame(columns=COLUMNS)
+        df = pd.DataFrame(records)
+        aggregations = dict((column, 'sum') for column in COLUMNS)
+        aggregations['peak_memory'] = 'max'
+        return df.groupby('name', sort=False).agg(aggregations)[list(COLUMNS)]
+
+    def to_json(self, filename=None):
+        """Summary per lichen as JSON
+
+        :param filename: File to write to, if given
+        :return: JSON string
+        """
+        report = json.loads(self.to_dataframe().reset_index().to_json(orient='records'))
+        text = json.dumps(report, indent=2)
+        if filename is not None:
+            with open(filename, 'w') as file:
+                file.write(text)
+        return text
@@ -0,0 +1,132 @@
+"""End times of runs, cached locally
+
+Cuts like DAQVeto.EndOfRunCheck need the end time of every run.  These come
+from a source, by default the runs DB through hax, and are kept in memory and,
+if a path is given, in a JSON file of run number to end time (ns since epoch).
+Repeated jobs and offline workers then never query the runs DB:
+
+    runs.configure(path='/scratch/lax_run_end_times.json')
+
+Without access to the runs DB, a JSON file in the same format can stand in for
+it:
+
+    runs.configure(source=runs.FileSource('run_end_times.json'))
+"""
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+
+class HaxSource(object):
+    """End times from the runs DB, through hax"""
+
+    def __call__(self, run_numbers):
+        import hax  # noqa
+        import pytz
+        if not len(hax.config):
+            # User didn't init hax yet... let's do it now
+            hax.init()
+
+        # The datetime -> timestamp logic here is the same as in the pax event builder
+        ends = hax.runs.get_run_info(list(run_numbers), 'end')
+        return dict((run_number, int(end.replace(tzinfo=pytz.utc).timestamp() * int(1e9)))
+                    for run_number, end in zip(run_numbers, ends))
+
+
+class FileSource(object):
+    """End times from a JSON file of run number to end time in ns
+
+    :param path: Filename
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, run_numbers):
+        end_times = read(self.path)
+        missing = set(run_numbers) - set(end_times)
+        if missing:
+            raise KeyError('No end time in %s for runs %s' % (self.path, sorted(missing)))
+        return dict((run_number, end_times[run_number]) for run_number in run_numbers)
+
+
+def read(path):
+    """Dictionary of run number to end time from a JSON file, empty if there is none"""
+    try:
+        with open(path) as infile:
+            return dict((int(run_number), int(end_time))
+                        for run_number, end_time in json.load(infile).items())
+    except (IOError, OSError):
+        return {}
+
+
+class RunEndTimes(object):
+    """End times of runs, asked once from a source and kept
+
+    :param path: JSON file to keep the end times in, or None to keep them only
+                 in memory
+    :param source: Callable taking a list of run numbers and returning a
+                   dictionary of run number to end time in ns
+    """
+
+    def __init__(self, path=None, source=None):
+        self.path = path
+        self.source = HaxSource() if source is None else source
+        self.end_times = {} if path is None else read(path)
+        self.lock = threading.Lock()
+
+    def get(self, run_numbers):
+        """End time of each run in run_numbers, one per element
+
+        :param run_numbers: Array of run numbers, e.g. the run_number column
+        :return: int64 array of end times in ns
+        """
+        run_numbers = np.asarray(run_numbers)
+        unique = np.unique(run_numbers)
+        ends = np.array(self.lookup(unique.tolist()), dtype=np.int64)
+        if len(unique) == 1:
+            return np.full(len(run_numbers), ends[0], dtype=np.int64)
+        return ends[np.searchsorted(unique, run_numbers)]
+
+    def lookup(self, run_numbers):
+        """List of end times of a list of run numbers"""
+        with self.lock:
+            missing = [run_number for run_number in run_numbers
+                       if run_number not in self.end_times]
+            if missing:
+                self.end_times.update(self.source(missing))
+                if self.path is not None:
+                    self.save()
+            return [self.end_times[run_number] for run_number in run_numbers]
+
+    def save(self):
+        """Write the end times, keeping those another job wrote meanwhile"""
+        end_times = read(self.path)
+        end_times.update(self.end_times)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        with os.fdopen(handle, 'w') as outfile:
+            json.dump(dict((str(run_number), end_time)
+                           for run_number, end_time in sorted(end_times.items())),
+                      outfile, indent=1)
+        os.replace(temporary, self.path)
+
+
+RUN_END_TIMES = RunEndTimes()
+
+
+def configure(path=None, source=None):
+    """Set where end times are kept and where they come from, see RunEndTimes"""
+    global RUN_END_TIMES
+    RUN_END_TIMES = RunEndTimes(path, source)
+    return RUN_END_TIMES
+
+
+def get_end_times(run_numbers):
+    """End time of each run in run_numbers, see RunEndTimes.get"""
+    return RUN_END_TIMES.get(run_numbers)
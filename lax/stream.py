@@ -0,0 +1,144 @@
+"""Process DataFrames that do not fit in memory chunk by chunk
+
+All cuts only look at one event at a time, so processing chunks of events gives
+the same result as processing everything at once.  Example:
+
+    chunks = stream.read_hdf('background.h5', 'table', chunk_size=10**6)
+    processed = cuts.process_chunks(chunks, memory=8 * 1024**3)
+    stream.to_hdf(processed, 'background_lax.h5', 'table')
+"""
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# Peak memory of processing relative to the size of input and output chunk
+MEMORY_OVERHEAD = 3
+# Number of rows used to estimate the memory per row
+SAMPLE_ROWS = 1000
+
+
+def rechunk(chunks, chunk_size):
+    """Regroup a stream of DataFrames into chunks of chunk_size rows
+
+    The last chunk can be smaller.
+
+    :param chunks: Iterable of DataFrames with the same columns
+    :param chunk_size: Number of rows per chunk
+    :return: Generator of DataFrames
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be positive')
+
+    pending = []
+    n_pending = 0
+    for chunk in chunks:
+        while len(chunk):
+            take = min(chunk_size - n_pending, len(chunk))
+            if take == len(chunk):
+                pending.append(chunk)
+                chunk = chunk.iloc[:0]
+            else:
+                pending.append(chunk.iloc[:take].copy())
+                chunk = chunk.iloc[take:]
+            n_pending += take
+
+            if n_pending == chunk_size:
+                yield pending[0] if len(pending) == 1 else pd.concat(pending)
+                pending = []
+                n_pending = 0
+
+    if n_pending:
+        yield pending[0] if len(pending) == 1 else pd.concat(pending)
+
+
+def get_chunk_size(lichen, df, memory):
+    """Number of rows that can be processed within a memory budget
+
+    Estimated by evaluating the first rows of df with a copy of the lichen
+    that does not cache results or record statistics and profiles (see
+    Lichen.unrecorded), so the lichen itself is left as it was.
+
+    :param lichen: Lichen to process with
+    :param df: DataFrame like the ones to process
+    :param memory: Memory budget in bytes
+    :return: Number of rows
+    """
+    sample = df.iloc[:SAMPLE_ROWS].copy()
+    if not len(sample):
+        raise ValueError('Cannot estimate memory use from an empty DataFrame')
+    input_bytes = sample.memory_usage(index=True, deep=True).sum()
+    # Processing returns the input with the new columns
+    output_bytes = input_bytes + sum(np.asarray(values).nbytes for values in
+                                     lichen.unrecorded().evaluate_arrays(sample).values())
+
+    bytes_per_row = MEMORY_OVERHEAD * float(input_bytes + output_bytes) / len(sample)
+    return max(1, int(memory / bytes_per_row))
+
+
+def process_chunks(lichen, chunks, chunk_size=None, memory=None):
+    """Process a stream of DataFrames
+
+    :param lichen: Lichen to process with
+    :param chunks: Iterable of DataFrames, e.g. from read_hdf
+    :param chunk_size: Number of rows to process at once.  By default the
+                       chunks are processed as they come.
+    :param memory: Memory budget in bytes, used to choose chunk_size
+    :return: Generator of processed DataFrames
+    """
+    chunks = iter(chunks)
+    if memory is not None:
+        first = next(chunks, None)
+        if first is None:
+            return
+        chunk_size = get_chunk_size(lichen, first, memory)
+        chunks = itertools.chain([first], chunks)
+
+    if chunk_size is not None:
+        chunks = rechunk(chunks, chunk_size)
+
+    for chunk in chunks:
+        yield lichen.process(chunk)
+
+
+def read_hdf(path, key, chunk_size, columns=None):
+    """Read a table-format HDF5 file chunk by chunk
+
+    :param path: Filename
+    :param key: Group in the file
+    :param chunk_size: Number of rows per chunk
+    :param columns: List of columns to read, by default all
+    :return: Generator of DataFrames
+    """
+    with pd.HDFStore(path, mode='r') as store:
+        for chunk in store.select(key, columns=columns, chunksize=chunk_size):
+            yield chunk
+
+
+def write_chunks(chunks, write):
+    """Pass each DataFrame of a stream to a writer
+
+    :param chunks: Iterable of DataFrames
+    :param write: Function writing one DataFrame
+    :return: Total number of rows written
+    """
+    n_rows = 0
+    for chunk in chunks:
+        write(chunk)
+        n_rows += len(chunk)
+    return n_rows
+
+
+def to_hdf(chunks, path, key, **kwargs):
+    """Write a stream of DataFrames to one table-format HDF5 file
+
+    :param chunks: Iterable of DataFrames
+    :param path: Filename
+    :param key: Group in the file
+    :param kwargs: Passed to pandas.HDFStore.append (e.g. complevel, complib)
+    :return: Total number of rows written
+    """
+    with pd.HDFStore(path, mode='w') as store:
+        return write_chunks(chunks, lambda chunk: store.append(key, chunk, **kwargs))
@@ -0,0 +1,148 @@
+"""Synthetic minitrees for tests and benchmarks
+
+make_minitree returns a DataFrame with every column in
+lax.minitrees.MINITREE_COLUMNS, so all cuts of the SR0 and SR1 cut sets can run
+on it without hax or real data.  The distributions are rough imitations of background data: positions uniform in
+the TPC, log-uniform S1s and S2s, and NaNs where the minitrees have them (no
+other S1/S2, no previous S2, no nearby flash).  They are good enough for
+timing cuts, not for physics.
+"""
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+TPC_RADIUS = 47.9  # cm
+TPC_LENGTH = 96.9  # cm
+DRIFT_VELOCITY = 1.44e-4  # cm / ns
+ELECTRON_LIFETIME = 450e3  # ns
+EVENT_RATE = 5.  # Hz
+RUN_START = 1.5e18  # ns since epoch
+
+# Fraction of events without the secondary peak (NaN in the minitree)
+NO_OTHER_S1 = 0.3
+NO_OTHER_S2 = 0.2
+NO_PREVIOUS_S2 = 0.5
+NO_FLASH = 0.9
+
+
+def log_uniform(rng, low, high, n):
+    return np.exp(rng.uniform(np.log(low), np.log(high), n))
+
+
+def with_nans(rng, values, fraction):
+    values[rng.uniform(size=len(values)) < fraction] = np.nan
+    return values
+
+
+def nearest_time(rng, n, rate):
+    """Signed time (ns) to the nearest of triggers occurring at rate (Hz)"""
+    return rng.choice([-1., 1.], n) * rng.exponential(1e9 / rate, n)
+
+
+def make_minitree(n_events=10000, seed=0, run_number=6731, first_event=0):
+    """DataFrame imitating the minitrees of one run
+
+    :param n_events: Number of events (rows)
+    :param seed: Random seed, the same seed gives the same DataFrame
+    :param run_number: Value of the run_number column
+    :param first_event: Event number of the first event, for making chunks
+    :return: DataFrame with all columns in lax.minitrees.MINITREE_COLUMNS
+    """
+    rng = np.random.RandomState(seed)
+    n = n_events
+    c = OrderedDict()
+
+    # Fundamentals
+    c['run_number'] = np.full(n, run_number, dtype=np.int64)
+    c['event_number'] = np.arange(first_event, first_event + n, dtype=np.int64)
+    c['event_time'] = (RUN_START + (first_event / EVENT_RATE) * 1e9 +
+                       np.cumsum(rng.exponential(1e9 / EVENT_RATE, n))).astype(np.int64)
+    c['event_duration'] = np.full(n, 1e6)
+
+    # Positions, uniform in the TPC
+    r = TPC_RADIUS * np.sqrt(rng.uniform(size=n))
+    phi = rng.uniform(-np.pi, np.pi, n)
+    x, y = r * np.cos(phi), r * np.sin(phi)
+    z = -TPC_LENGTH * rng.uniform(size=n)
+    drift_time = -z / DRIFT_VELOCITY
+
+    # Basics
+    s1 = log_uniform(rng, 2, 1e4, n)
+    s2 = log_uniform(rng, 100, 1e6, n)
+    c['s1'] = s1
+    c['s2'] = s2
+    c['x'] = x + rng.normal(0, 0.5, n)
+    c['y'] = y + rng.normal(0, 0.5, n)
+    c['z'] = z
+    c['drift_time'] = drift_time
+    s1_aft = 0.34 + 0.0026 * z  # roughly the S1 area fraction top map
+    c['s1_area_fraction_top'] = np.clip(rng.normal(s1_aft, np.sqrt(s1_aft * (1 - s1_aft) / s1)), 0, 1)
+    c['s2_area_fraction_top'] = np.clip(rng.normal(0.63, 0.02 + 2 / np.sqrt(s2)), 0, 1)
+    c['s1_range_50p_area'] = rng.gamma(4, 15, n)
+    c['s2_range_50p_area'] = 600 + 0.1 * np.sqrt(drift_time * 400) * rng.normal(1, 0.1, n)
+    c['s1_largest_hit_area'] = s1 * rng.uniform(0.01, 0.06, n)
+    c['largest_other_s1'] = with_nans(rng, s1 * rng.uniform(0, 0.3, n), NO_OTHER_S1)
+    c['largest_other_s2'] = with_nans(rng, log_uniform(rng, 10, 1e4, n), NO_OTHER_S2)
+    c['largest_other_s2_delay_main_s1'] = np.where(np.isnan(c['largest_other_s2']), np.nan,
+                                                   rng.uniform(-5e5, 5e5, n))
+    c['alt_s1_interaction_drift_time'] = with_nans(rng, drift_time + rng.uniform(-1e5, 1e5, n),
+                                                   NO_OTHER_S1)
+
+    # Corrections
+    c['cs1'] = s1 * rng.normal(1, 0.05, n)
+    cs2 = s2 * np.exp(drift_time / ELECTRON_LIFETIME)
+    c['cs2'] = cs2
+    c['cs2_top'] = cs2 * c['s2_area_fraction_top']
+    c['cs2_bottom'] = cs2 - c['cs2_top']
+    c['x_3d_nn'] = x + rng.normal(0, 0.3, n)
+    c['y_3d_nn'] = y + rng.normal(0, 0.3, n)
+    c['z_3d_nn'] = z + rng.normal(0, 0.1, n)
+    c['r_3d_nn'] = np.sqrt(c['x_3d_nn']**2 + c['y_3d_nn']**2)
+
+    # TotalProperties and Extended
+    c['area_before_main_s2'] = s1 + rng.exponential(50, n)
+    c['s1_rise_time'] = rng.gamma(5, 15, n)
+    c['s1_range_90p_area'] = c['s1_range_50p_area'] * rng.uniform(2, 4, n)
+    c['s2_pattern_fit'] = rng.chisquare(120, n) * (1 + s2 / 1e5)
+
+    # TailCut
+    c['s2_over_tdiff'] = with_nans(rng, rng.exponential(0.01, n), NO_PREVIOUS_S2)
+
+    # Proximity, times to the nearest triggers in ns
+    c['previous_busy_on'] = rng.exponential(600e9, n)
+    c['previous_busy_off'] = c['previous_busy_on'] - rng.exponential(1e9, n)
+    c['nearest_busy'] = nearest_time(rng, n, 0.01)
+    c['nearest_hev'] = nearest_time(rng, n, 0.01)
+    c['nearest_muon_veto_trigger'] = nearest_time(rng, n, 0.03)
+
+    # PositionReconstruction
+    c['x_observed_nn'] = x + rng.normal(0, 0.5, n)
+    c['y_observed_nn'] = y + rng.normal(0, 0.5, n)
+    c['x_observed_tpf'] = c['x_observed_nn'] + rng.normal(0, 0.5, n)
+    c['y_observed_tpf'] = c['y_observed_nn'] + rng.normal(0, 0.5, n)
+    c['s1_pattern_fit_hax'] = rng.chisquare(50, n) + 2 * np.sqrt(s1)
+    c['s1_pattern_fit_bottom_hax'] = rng.chisquare(30, n) + np.sqrt(s1)
+    c['s1_area_fraction_top_probability_hax'] = rng.uniform(size=n)
+    c['s1_area_upper_injection_fraction'] = rng.beta(2, 40, n)
+    c['s1_area_lower_injection_fraction'] = rng.beta(2, 40, n)
+
+    # FlashIdentification
+    c['inside_flash'] = rng.uniform(size=n) < 0.001
+    c['nearest_flash'] = with_nans(rng, nearest_time(rng, n, 0.001), NO_FLASH)
+    c['flashing_width'] = rng.exponential(5, n)
+
+    return pd.DataFrame(c, columns=list(c.keys()),
+                        index=pd.RangeIndex(first_event, first_event + n))
+
+
+def iter_minitree(n_events, chunk_size, seed=0, run_number=6731):
+    """Synthetic minitree in chunks, for sizes that do not fit in memory
+
+    :return: Generator of DataFrames of at most chunk_size rows
+    """
+    for i, start in enumerate(range(0, n_events, chunk_size)):
+        yield make_minitree(min(chunk_size, n_events - start), seed=seed + i,
+                            run_number=run_number, first_event=start)
@@ -0,0 +1,220 @@
+"""Tree ensembles as numpy arrays
+
+The classifiers of SingleElectronS2s are pickled scikit-learn random forests
+and gradient boosted trees.  Unpickling them is slow and only works with the
+scikit-learn version they were made with.  convert reads such a pickle
+without scikit-learn and stores its trees as flat arrays in an .npz file,
+which TreeEnsemble evaluates for all events and trees at once:
+
+    python -m lax.trees lax/data/XENON1T_gradient_bdt_peak_classifier_02052018.pkl
+
+lax.models uses the .npz file next to a pickle when there is one.
+
+All trees are stored in one set of node arrays.  Leaves point to themselves
+and have an infinite threshold, so every event can take the same number of
+steps (the maximum depth) down every tree.
+"""
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import pickle
+import sys
+
+import numpy as np
+
+
+class _Stub(object):
+    """Stand-in for a scikit-learn object, keeping its pickled state"""
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+
+    def __setstate__(self, state):
+        self.state = state
+
+
+class _Unpickler(pickle.Unpickler):
+    """Unpickler replacing every scikit-learn class by a _Stub"""
+
+    def find_class(self, module, name):
+        if module.split('.')[0] == 'sklearn':
+            return type(name, (_Stub,), {})
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+def read_pickle(filename):
+    """Pickled scikit-learn object as nested _Stubs"""
+    with open(filename, 'rb') as infile:
+        if sys.version_info[0] < 3:
+            return _Unpickler(infile).load()
+        return _Unpickler(infile, encoding='latin1').load()
+
+
+def get_tree(estimator):
+    """(nodes, values) of a pickled decision tree"""
+    state = estimator.state['tree_'].state
+    n_nodes = state['node_count']
+    return state['nodes'][:n_nodes], state['values'][:n_nodes]
+
+
+def flatten(model):
+    """Arrays describing a pickled forest or binary gradient boosting classifier
+
+    :param model: Result of read_pickle
+    :return: Dictionary of array name to array, see TreeEnsemble
+    """
+    name = type(model).__name__
+    state = model.state
+    if name in ('RandomForestClassifier', 'ExtraTreesClassifier'):
+        kind = 'forest'
+        estimators = list(state['estimators_'])
+        offset = 0.
+        scale = 1. / len(estimators)
+    elif name == 'GradientBoostingClassifier':
+        if state['estimators_'].shape[1] != 1:
+            raise ValueError('Only binary gradient boosting classifiers are supported')
+        kind = 'boosting'
+        estimators = list(state['estimators_'][:, 0])
+        offset = get_initial_score(state['init_'])
+        scale = state['learning_rate']
+    else:
+        raise ValueError('Cannot convert a %s' % name)
+
+    trees = [get_tree(estimator) for estimator in estimators]
+    roots = np.cumsum([0] + [len(nodes) for nodes, _ in trees[:-1]])
+
+    left, right, feature, threshold, value = [], [], [], [], []
+    for root, (nodes, values) in zip(roots, trees):
+        leaves = nodes['left_child'] < 0
+        indices = root + np.arange(len(nodes))
+        left.append(np.where(leaves, indices, root + nodes['left_child']))
+        right.append(np.where(leaves, indices, root + nodes['right_child']))
+        feature.append(np.where(leaves, 0, nodes['feature']))
+        threshold.append(np.where(leaves, np.inf, nodes['threshold']))
+
+        values = values[:, 0, :]
+        if kind == 'forest':
+            # Class counts (or fractions) to probabilities
+            normalizer = values.sum(axis=1, keepdims=True)
+            values = values / np.where(normalizer > 0, normalizer, 1)
+        value.append(values * scale)
+
+    return dict(kind=np.array(kind),
+                classes=np.asarray(state['classes_']),
+                offset=np.array(offset),
+                max_depth=np.array(max(get_depth(nodes) for nodes, _ in trees)),
+                roots=roots.astype(np.int32),
+                left=np.concatenate(left).astype(np.int32),
+                right=np.concatenate(right).astype(np.int32),
+                feature=np.concatenate(feature).astype(np.int32),
+                threshold=np.concatenate(threshold).astype(np.float64),
+                value=np.concatenate(value).astype(np.float64))
+
+
+def get_initial_score(init):
+    """Log odds a gradient boosting classifier starts from"""
+    state = init.state
+    if 'prior' in state:
+        # LogOddsEstimator of old scikit-learn versions
+        return float(state['prior'])
+    if 'class_prior_' in state:
+        # DummyClassifier of newer versions
+        prior = state['class_prior_']
+        return float(np.log(prior[1] / prior[0]))
+    raise ValueError('Cannot convert initial estimator %s' % type(init).__name__)
+
+
+def get_depth(nodes):
+    """Maximum number of steps from the root of a tree to a leaf"""
+    depth = np.zeros(len(nodes), dtype=int)
+    for i in range(len(nodes)):
+        for child in (nodes['left_child'][i], nodes['right_child'][i]):
+            if child >= 0:
+                depth[child] = depth[i] + 1
+    return int(depth.max())
+
+
+def convert(pickle_filename, npz_filename=None):
+    """Store a pickled tree ensemble as an .npz file
+
+    :param npz_filename: Output file, by default the pickle with .npz extension
+    :return: Name of the written file
+    """
+    if npz_filename is None:
+        npz_filename = os.path.splitext(pickle_filename)[0] + '.npz'
+    np.savez(npz_filename, **flatten(read_pickle(pickle_filename)))
+    return npz_filename
+
+
+class TreeEnsemble(object):
+    """Classifier evaluating flattened trees, like predict_proba of scikit-learn
+
+    scikit-learn refuses features that are NaN.  Here the probabilities of
+    events with a NaN feature are NaN, so they are not classified either.
+
+    :param arrays: Dictionary of array name to array, see flatten
+    """
+    chunk_size = 1000  # events evaluated at once, small enough to stay in cache
+
+    def __init__(self, arrays):
+        self.kind = str(arrays['kind'])
+        self.classes_ = np.asarray(arrays['classes'])
+        self.offset = float(arrays['offset'])
+        self.max_depth = int(arrays['max_depth'])
+        for key in ('roots', 'feature', 'threshold', 'value'):
+            setattr(self, key, np.asarray(arrays[key]))
+        # Left and right child of node i at 2 * i and 2 * i + 1
+        self.children = np.column_stack([arrays['left'], arrays['right']]).ravel()
+
+    def apply(self, features):
+        """Leaf reached in every tree by every event
+
+        :param features: 2d array, one row per event
+        :return: 2d array of node indices, one column per tree
+        """
+        # scikit-learn compares single precision features with the thresholds
+        n_events, n_trees = len(features), len(self.roots)
+        columns = np.asarray(features, dtype=np.float32).T.ravel()
+        rows = np.repeat(np.arange(n_events), n_trees)
+        offsets = self.feature.astype(np.intp) * n_events  # of each node's feature in columns
+        nodes = np.tile(self.roots.astype(np.intp), n_events)
+        for _ in range(self.max_depth):
+            go_right = columns.take(offsets.take(nodes) + rows) > self.threshold.take(nodes)
+            nodes = self.children.take(2 * nodes + go_right)
+        return nodes.reshape(n_events, n_trees)
+
+    def predict_proba(self, features):
+        """Class probabilities, one row per event, NaN for events with a NaN feature"""
+        n_events = len(features)
+        result = np.empty((n_events, len(self.classes_)))
+        for start in range(0, n_events, self.chunk_size):
+            chunk = np.asarray(features[start:start + self.chunk_size])
+            values = self.value[self.apply(chunk)].sum(axis=1)
+            if self.kind == 'forest':
+                result[start:start + len(chunk)] = values
+            else:
+                p = 1. / (1. + np.exp(-(self.offset + values[:, 0])))
+                result[start:start + len(chunk), 0] = 1 - p
+                result[start:start + len(chunk), 1] = p
+            # NaN is never above a threshold, so these events went left everywhere
+            result[start:start + len(chunk)][np.isnan(chunk).any(axis=1)] = np.nan
+        return result
+
+
+def load(filename):
+    """TreeEnsemble stored by convert"""
+    with np.load(filename, allow_pickle=False) as data:
+        return TreeEnsemble(dict((key, data[key]) for key in data.files))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert pickled tree ensembles to .npz")
+    parser.add_argument('pickles', nargs='+', help='Pickled classifiers')
+    args = parser.parse_args(sys.argv[1:])
+    for filename in args.pickles:
+        print("Written", convert(filename))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Test of lax/arrays.py"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lax.arrays import ArrayFrame, get_columns
+from lax.lichen import Lichen, ManyLichen
+from lax.synthetic import make_minitree
+
+from tests.test_derived import Inner, Outer
+from tests.test_lichen import Aft, Cuts, Nested
+
+
+class Written(Lichen):
+    """Lichen that writes into the DataFrame, so it needs one"""
+    input_columns = ('s2',)
+
+    def _process(self, df):
+        df.loc[:, self.name()] = df['s2'] > 500
+        return df
+
+
+class AllCuts(ManyLichen):
+    def __init__(self):
+        self.lichen_list = Cuts().lichen_list + [Nested(), Inner(), Outer(), Written()]
+
+
+class ArraysTestCase(unittest.TestCase):
+    """Test case for evaluating lichens on numpy arrays
+    """
+
+    def assert_same(self, cuts, data, df):
+        expected = cuts.results(df)
+        result = cuts.evaluate_arrays(data)
+        self.assertEqual(list(result.keys()), list(expected.columns))
+        for column, values in result.items():
+            self.assertIsInstance(values, np.ndarray)
+            np.testing.assert_array_equal(values, expected[column].values)
+
+    def test_dict(self):
+        """A dictionary of arrays gives the same results as a DataFrame"""
+        df = make_minitree(1000)
+        data = dict((column, df[column].values) for column in df.columns)
+        self.assert_same(AllCuts(), data, df)
+        self.assert_same(AllCuts().compile().keep(), data, df)
+        self.assert_same(AllCuts().short_circuit().pack(), data, df)
+        self.assert_same(AllCuts().parallel(2), data, df)
+
+    def test_structured(self):
+        """Structured arrays are read without copying"""
+        df = make_minitree(1000)
+        data = df.to_records(index=False)
+        self.assertTrue(np.shares_memory(get_columns(data)['x'], data))
+        self.assert_same(AllCuts(), data, df)
+
+    def test_single(self):
+        """Single lichens return the columns they add"""
+        df = make_minitree(1000)
+        data = dict((column, df[column].values) for column in df.columns)
+        np.testing.assert_array_equal(Aft().evaluate_arrays(data)['CutAft'],
+                                      Aft().process(make_minitree(1000))['CutAft'])
+        np.testing.assert_array_equal(Outer().evaluate_arrays(data)['CutOuter'],
+                                      Outer().process(make_minitree(1000))['CutOuter'])
+
+    def test_frame(self):
+        """Selecting columns and rows does not make DataFrames"""
+        frame = ArrayFrame({'a': np.arange(5), 'b': np.arange(5.)})
+        self.assertIsInstance(frame[['a']], ArrayFrame)
+        np.testing.assert_array_equal(frame.iloc[[1, 3]]['b'], [1., 3.])
+        self.assertIsInstance(frame.to_frame(), pd.DataFrame)
+        with self.assertRaises(ValueError):
+            ArrayFrame({'a': np.arange(5), 'b': np.arange(4)})
+
+
+if __name__ == '__main__':
+    unittest.main()
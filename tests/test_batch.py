@@ -0,0 +1,111 @@
+"""Test of lax/batch.py"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lax import batch, bitmask, columnar
+from lax.synthetic import make_minitree
+
+from tests.test_lichen import Cuts
+
+
+def get_cut_sets(science_run, mc=False, verbose=False):
+    return [Cuts()]
+
+
+class BatchTestCase(unittest.TestCase):
+    """Test case for processing many runs on a pool of workers
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.get_cut_sets = batch.get_cut_sets
+        batch.get_cut_sets = get_cut_sets
+        batch.WORKER.clear()
+        for run_number in (6731, 6732):
+            self.write_input(run_number)
+        self.settings = batch.get_settings(1, input_path=os.path.join(self.path, '{run}.parquet'),
+                                           output_format='parquet')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        batch.get_cut_sets = self.get_cut_sets
+        batch.WORKER.clear()
+
+    def write_input(self, run_number):
+        columnar.write([make_minitree(1000, run_number=run_number)],
+                       os.path.join(self.path, '%d.parquet' % run_number))
+
+    def test_job_list(self):
+        self.assertEqual(batch.parse_run_numbers(['6731-6733', '7000', '-1']),
+                         [6731, 6732, 6733, 7000, -1])
+        filename = os.path.join(self.path, 'jobs.txt')
+        with open(filename, 'w') as outfile:
+            outfile.write('# Runs\n6731\n\nXenon1T_TPC_Rn222_00000_g4mc  # MC\n')
+        self.assertEqual(batch.read_job_list(filename), [6731, 'Xenon1T_TPC_Rn222_00000_g4mc'])
+
+    def test_resume(self):
+        """Finished jobs are skipped, failed ones tried again"""
+        jobs = [6731, 6732, 6733]
+        manifest = batch.run_batch(jobs, self.settings, self.path, n_processes=2)
+        self.assertEqual([manifest.is_done(job) for job in jobs], [True, True, False])
+        self.assertIn('FileNotFoundError', manifest.jobs['6733']['error'])
+
+        output_file = manifest.jobs['6731']['output']
+        self.assertEqual(output_file, os.path.join(self.path, '6731_lax_SR1.parquet'))
+        df = next(columnar.read(output_file))
+        self.assertEqual(len(df), 1000)
+        self.assertIn('CutCuts', df.columns)
+
+        # A new process continues from the manifest
+        os.remove(output_file)
+        self.write_input(6733)
+        manifest = batch.run_batch(jobs, self.settings, self.path)
+        self.assertTrue(all(manifest.is_done(job) for job in jobs))
+        self.assertFalse(os.path.exists(output_file))
+        self.assertTrue(os.path.exists(manifest.jobs['6733']['output']))
+
+    def test_chunks(self):
+        """Input files are read and processed chunk by chunk, with the same result"""
+        settings = dict(self.settings, chunk_size=300)
+        chunks = list(batch.read_events(settings, [Cuts()], 6731))
+        self.assertEqual([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+        self.assertEqual(chunks[1].index[0], 300)
+
+        filename = os.path.join(self.path, 'chunks.parquet')
+        self.assertEqual(batch.process_run(settings, [Cuts()], 6731, filename), 1000)
+        expected = Cuts().process(make_minitree(1000, run_number=6731))
+        result = pd.concat(list(columnar.read(filename)), ignore_index=True)
+        pd.testing.assert_frame_equal(result, expected[list(result.columns)])
+
+    def test_slim(self):
+        """Only keys and cuts are written, and can be joined back"""
+        df = make_minitree(1000, run_number=6731)
+        full = Cuts().process(df.copy())
+        settings = dict(self.settings, slim=True, chunk_size=300)
+        filename = os.path.join(self.path, 'slim.parquet')
+        self.assertEqual(batch.process_run(settings, [Cuts()], 6731, filename), 1000)
+
+        chunks = list(columnar.read(filename))
+        self.assertEqual([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+        self.assertEqual(list(chunks[0].columns),
+                         batch.KEY_COLUMNS + Cuts().get_result_names())
+
+        shuffled = df.sample(frac=1, random_state=0)
+        joined = batch.join_cuts(shuffled, filename, ['CutRadius'])
+        self.assertEqual(list(joined.columns), list(df.columns) + ['CutRadius'])
+        np.testing.assert_array_equal(joined['CutRadius'], full.loc[shuffled.index, 'CutRadius'])
+
+        settings = dict(settings, packed=True)
+        batch.process_run(settings, [Cuts()], 6731, filename)
+        packed = batch.join_cuts(df, filename)
+        self.assertEqual(list(packed.columns), list(df.columns) + ['CutCuts_bits0'])
+        np.testing.assert_array_equal(bitmask.CutMask(packed, Cuts())['CutVeto'], full['CutVeto'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+"""Test of lax/cache.py"""
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from lax import cache
+from lax.lichen import CutSets, ManyLichen, StringLichen
+from lax.synthetic import make_minitree
+
+
+class Threshold(StringLichen):
+    version = 1
+    string = "200 < s2"
+
+
+class Aft(StringLichen):
+    version = 0
+    string = "aft < 0.7"
+    input_columns = ('x', 's2')
+    output_columns = ('aft',)
+
+    def pre(self, df):
+        df.loc[:, 'aft'] = df['x'] / df['s2']
+        return df
+
+
+class Cuts(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Threshold(), Aft()]
+
+
+class Width(StringLichen):
+    version = 0
+    string = "s2_range_50p_area < @limit"
+    limit = 1000.
+
+    def parameters(self):
+        return dict(limit=self.limit)
+
+
+class SingleScatter(StringLichen):
+    """Uses Width, like S1SingleScatter uses S2Width"""
+    version = 0
+    string = "largest_other_s2 < 100"
+    width = Width
+
+
+class Widths(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Threshold(), Width()]
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    """Test case for the on-disk cache of cut results
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def test_same_result(self):
+        """Results from the cache are the same as computed ones"""
+        expected = Cuts().keep().process(make_minitree(1000))
+        result_cache = cache.ResultCache(self.path)
+        for _ in range(2):
+            result = Cuts().keep().cache(result_cache).process(make_minitree(1000))
+            pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(result_cache.hits, 2)
+        self.assertEqual(len(result_cache.list_files()), 2)
+        self.assertTrue(all('6731_Cut' in os.path.basename(filename)
+                            for filename, _ in result_cache.list_files()))
+
+    def test_key(self):
+        """The key changes with the version, parameters and input columns"""
+        result_cache = cache.ResultCache(self.path)
+        df = make_minitree(1000)
+        key = result_cache.get_key(Threshold(), df)
+        self.assertEqual(result_cache.get_key(Threshold(), make_minitree(1000)), key)
+
+        bumped = Threshold()
+        bumped.version = 2
+        self.assertNotEqual(result_cache.get_key(bumped, df), key)
+
+        changed = Threshold()
+        changed.string = "300 < s2"
+        self.assertNotEqual(result_cache.get_key(changed, df), key)
+
+        self.assertNotEqual(result_cache.get_key(Threshold(), make_minitree(1000, seed=1)), key)
+        # Other columns do not matter
+        self.assertEqual(result_cache.get_key(Threshold(), df.drop('x', axis=1)), key)
+
+    def test_nested_lichen(self):
+        """The key changes with the parameters of lichens a lichen uses"""
+        df = make_minitree(1000)
+        key = cache.get_key(SingleScatter(), df)
+        self.assertEqual(cache.get_key(SingleScatter(), df), key)
+        try:
+            Width.limit = 2000.
+            self.assertNotEqual(cache.get_key(SingleScatter(), df), key)
+        finally:
+            Width.limit = 1000.
+
+        unknown = SingleScatter()
+        unknown.classifier = object()
+        with self.assertRaises(TypeError):
+            cache.get_key(unknown, df)
+
+    def test_changed_in_place(self):
+        """Changing an input column in place is a cache miss"""
+        result_cache = cache.ResultCache(self.path)
+        df = make_minitree(1000)
+        result_cache.evaluate(Threshold(), df)
+        df.loc[df['s2'] < 200, 's2'] = 1000
+        results = result_cache.evaluate(Threshold(), df)
+        self.assertEqual((result_cache.hits, result_cache.misses), (0, 2))
+        self.assertTrue(results['CutThreshold'].all())
+
+    def test_evict(self):
+        """The least recently used results are removed first"""
+        result_cache = cache.ResultCache(self.path)
+        result_cache.evaluate(Threshold(), make_minitree(1000))
+        (first, _), = result_cache.list_files()
+        os.utime(first, (0, 0))
+
+        result_cache.max_bytes = 1.5 * result_cache.get_size()
+        result_cache.evaluate(Threshold(), make_minitree(1000, seed=1))
+        files = [filename for filename, _ in result_cache.list_files()]
+        self.assertEqual(len(files), 1)
+        self.assertNotEqual(files[0], first)
+        self.assertEqual(result_cache.size, result_cache.get_size())
+
+    def test_counted_size(self):
+        """The directory is only listed when results have to be removed"""
+        result_cache = cache.ResultCache(self.path)
+        result_cache.evaluate(Threshold(), make_minitree(1000))
+        listed = []
+        list_files = result_cache.list_files
+        result_cache.list_files = lambda: listed.append(1) or list_files()
+        for seed in range(1, 5):
+            result_cache.evaluate(Threshold(), make_minitree(1000, seed=seed))
+        self.assertEqual(listed, [])
+        self.assertEqual(result_cache.size, result_cache.get_size())
+
+        del listed[:]
+        result_cache.max_bytes = result_cache.size - 1
+        result_cache.evaluate(Threshold(), make_minitree(1000, seed=5))
+        self.assertEqual(listed, [1])
+        self.assertLessEqual(result_cache.size, 0.8 * result_cache.max_bytes)
+
+    def test_hashed_once(self):
+        """Each column is hashed once per call, also for several cut sets"""
+        result_cache = cache.ResultCache(self.path)
+        hashed = []
+        hash_column = cache.hash_column
+        cache.hash_column = lambda values: hashed.append(1) or hash_column(values)
+        try:
+            Cuts().cache(result_cache).process(make_minitree(1000))
+            self.assertEqual(len(hashed), 2)  # s2 and x
+
+            del hashed[:]
+            cut_sets = CutSets([Cuts().cache(result_cache), Widths().cache(result_cache)])
+            cut_sets.process(make_minitree(1000))
+            self.assertEqual(len(hashed), 3)  # s2, x and s2_range_50p_area
+        finally:
+            cache.hash_column = hash_column
+
+
+if __name__ == '__main__':
+    unittest.main()
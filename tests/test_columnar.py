@@ -0,0 +1,65 @@
+"""Test of lax/columnar.py"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lax import columnar
+from lax.synthetic import iter_minitree, make_minitree
+
+from tests.test_lichen import Cuts
+
+
+class ColumnarTestCase(unittest.TestCase):
+    """Test case for Parquet and Arrow input and output
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_parquet(self):
+        """Chunks are streamed in, projected and streamed out"""
+        filename = os.path.join(self.path, 'minitree.parquet')
+        self.assertEqual(columnar.write(iter_minitree(2500, 1000), filename), 2500)
+
+        chunks = list(columnar.read(filename, columns=['s1', 's2']))
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 500])
+        self.assertEqual(list(chunks[0].columns), ['s1', 's2'])
+
+        chunks = list(columnar.read_parquet(filename, columns=['s2'], chunk_size=2000))
+        self.assertEqual([len(chunk) for chunk in chunks], [2000, 500])
+        expected = pd.concat(list(iter_minitree(2500, 1000)), ignore_index=True)
+        np.testing.assert_array_equal(pd.concat(chunks)['s2'], expected['s2'])
+
+    def test_arrow(self):
+        """Uncompressed Arrow files are read without copying"""
+        df = make_minitree(1000)
+        filename = os.path.join(self.path, 'minitree.arrow')
+        columnar.write([df], filename)
+
+        columns = columnar.read_arrow_columns(filename, columns=['x', 'y', 'z', 's2',
+                                                                 'largest_other_s2'])
+        self.assertFalse(columns['x'].flags.owndata)
+        np.testing.assert_array_equal(columns['x'], df['x'])
+
+        expected = Cuts().process(df)
+        result = Cuts().evaluate_arrays(columns)
+        for column, values in result.items():
+            np.testing.assert_array_equal(values, expected[column].values)
+
+    def test_format(self):
+        """Formats are told apart by file name"""
+        self.assertEqual(columnar.get_format('a.pq'), 'parquet')
+        self.assertEqual(columnar.get_format('a.feather'), 'arrow')
+        with self.assertRaises(ValueError):
+            columnar.get_format('a.root')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Test of lax/derived.py"""
+import threading
+import unittest
+
+import numpy as np
+
+from lax import derived
+from lax.lichen import CutSets, ManyLichen, StringLichen
+from lax.synthetic import make_minitree
+
+
+class Inner(StringLichen):
+    string = "r < 30"
+    derived_columns = ('r',)
+
+
+class Outer(StringLichen):
+    string = "(r > 10) & (distance_to_source < 100)"
+    derived_columns = ('r', derived.distance_to_source((97, 43.5, -50)))
+
+
+class Cuts(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Inner(), Outer()]
+
+
+class Wide(StringLichen):
+    string = "r < 40"
+    derived_columns = ('r',)
+
+
+class WideCuts(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Wide()]
+
+
+class DerivedTestCase(unittest.TestCase):
+    """Test case for derived variables shared between lichens
+    """
+
+    def setUp(self):
+        derived.CACHE.clear()
+
+    def test_columns(self):
+        """Lichens require the inputs of derived variables, not the variables"""
+        self.assertEqual(Inner().required_columns(), {'x', 'y'})
+        self.assertEqual(Cuts().required_columns(), {'x', 'y', 'z'})
+
+    def test_computed_once(self):
+        """A derived variable is computed once for all lichens and cut sets of a call"""
+        df = make_minitree(1000)
+        misses = derived.CACHE.misses
+        result = Cuts().compile().process(df)
+        self.assertEqual(derived.CACHE.misses - misses, 2)
+        self.assertNotIn('r', result.columns)
+
+        r = np.sqrt(df['x']**2 + df['y']**2)
+        np.testing.assert_array_equal(result['CutInner'], r < 30)
+
+        _, result = CutSets([Cuts(), WideCuts()]).results(make_minitree(1000))
+        self.assertEqual(derived.CACHE.misses - misses, 4)
+        np.testing.assert_array_equal(result['CutWide'], r < 40)
+        self.assertIsNone(derived.get_entries())
+
+    def test_invalidated(self):
+        """Changing an input column, also in place, recomputes the variable"""
+        df = make_minitree(1000)
+        first = derived.compute('r', df)
+        df['x'] = df['x'] * 2
+        second = derived.compute('r', df)
+        np.testing.assert_array_equal(second, np.sqrt(df['x']**2 + df['y']**2))
+        self.assertFalse(np.array_equal(first, second))
+
+        expected = Cuts().process(df.copy())
+        df.loc[df['x'] > 0, 'x'] = 0
+        result = Cuts().process(df)
+        self.assertFalse(np.array_equal(result['CutInner'], expected['CutInner']))
+        np.testing.assert_array_equal(result['CutInner'], np.sqrt(df['x']**2 + df['y']**2) < 30)
+
+    def test_threads(self):
+        """Every thread has its own scope, unless it shares the one of another"""
+        df = make_minitree(1000)
+        with derived.scope():
+            first = derived.compute('r', df)
+            entries = derived.get_entries()
+            results = []
+
+            def compute(*scope):
+                with derived.scope(*scope):
+                    results.append(derived.compute('r', df))
+
+            for scope in [(), (entries,)]:
+                thread = threading.Thread(target=compute, args=scope)
+                thread.start()
+                thread.join()
+            self.assertIsNot(results[0], first)
+            self.assertIs(results[1], first)
+            self.assertIs(derived.compute('r', df), first)
+        self.assertIsNone(derived.get_entries())
+
+    def test_standalone(self):
+        """Processing a single lichen adds its derived variables only if kept"""
+        df = make_minitree(1000)
+        result = Outer().process(df.copy())
+        self.assertEqual(list(result.columns), list(df.columns) + ['CutOuter'])
+        result = Outer().keep(['distance_to_source']).process(df.copy())
+        self.assertEqual(list(result.columns), list(df.columns) + ['distance_to_source', 'CutOuter'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,435 @@
+"""Test of lax/lichen.py"""
+import os
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from lax.lichen import CutSets, ManyLichen, StringLichen
+from lax import bitmask, plan, stream
+from lax.synthetic import make_minitree
+
+
+class Radius(StringLichen):
+    string = "(-92.9 < z) & (z < -9) & (sqrt(x*x + y*y) < 36.94)"
+
+
+class Ellipse(StringLichen):
+    string = "(((z+@z0)**2)**0.5/@vz)**@p + (x*x + y*y)/@vr2 < 1"
+
+    def parameters(self):
+        return dict(z0=50., vz=40., p=3., vr2=2000.)
+
+
+class Threshold(StringLichen):
+    string = "200 < s2"
+
+
+class SingleScatter(StringLichen):
+    string = '(~ (largest_other_s2 > 0)) | (largest_other_s2 < s2**0.5 * 10 + 72.3)'
+
+
+class Veto(StringLichen):
+    string = "largest_other_s2 < -2e6 | largest_other_s2 > 300"
+
+
+class Chained(StringLichen):
+    string = "-40 < x < 40"
+
+
+class Cuts(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Radius(), Ellipse(), Threshold(),
+                            SingleScatter(), Veto(), Chained()]
+
+
+class CutPlanTestCase(unittest.TestCase):
+    """Test case for the compiled cut plan
+    """
+
+    def test_same_as_eval(self):
+        """Compiled cuts give the same result as DataFrame.eval"""
+        df = make_minitree(1000)
+        lichens = Cuts().lichen_list
+        result = dict(plan.CutPlan(lichens).evaluate(df))
+        for lichen in lichens:
+            expected = df.eval(lichen.string, global_dict=lichen.parameters())
+            np.testing.assert_array_equal(result[lichen.name()], expected.values)
+
+    def test_shared_subexpressions(self):
+        """sqrt(x*x + y*y) and x*x + y*y are computed only once"""
+        cut_plan = plan.CutPlan(Cuts().lichen_list)
+        self.assertEqual(len(cut_plan), 6)
+        self.assertEqual(cut_plan.columns, {'x', 'y', 'z', 's2', 'largest_other_s2'})
+        self.assertTrue(cut_plan.n_temporaries >= 2)
+
+    def test_columns(self):
+        """Parameters and functions are not columns"""
+        self.assertEqual(plan.names(plan.parse(Ellipse.string)), {'x', 'y', 'z'})
+
+    def test_compiled_many_lichen(self):
+        """Compiling a cut set does not change its output"""
+        expected = Cuts().process(make_minitree(1000))
+        result = Cuts().compile().process(make_minitree(1000))
+        pd.testing.assert_frame_equal(result, expected)
+
+
+class Aft(StringLichen):
+    string = "aft < 0.7"
+    input_columns = ('x', 's2')
+    output_columns = ('aft',)
+
+    def pre(self, df):
+        df.loc[:, 'aft'] = df['x'] / df['s2']
+        return df
+
+
+class RequiredColumnsTestCase(unittest.TestCase):
+    """Test case for column introspection and projection
+    """
+
+    def test_string_lichen(self):
+        """Columns made in pre are not required"""
+        self.assertEqual(Aft().required_columns(), {'x', 's2'})
+        self.assertEqual(Ellipse().required_columns(), {'x', 'y', 'z'})
+
+    def test_many_lichen(self):
+        """A cut set requires what its lichens read"""
+        self.assertEqual(Cuts().required_columns(),
+                         {'x', 'y', 'z', 's2', 'largest_other_s2'})
+
+    def test_projected(self):
+        """Projection adds the same new columns and leaves others alone"""
+        cuts = Cuts()
+        cuts.lichen_list.append(Aft())
+        expected = cuts.process(make_minitree(1000))
+
+        df = make_minitree(1000)
+        df.loc[:, 'unused'] = 1
+        result = cuts.project().process(df)
+        pd.testing.assert_frame_equal(result.drop('unused', axis=1), expected)
+
+
+class Small(StringLichen):
+    string = "s2 < 3000"
+
+
+class Nested(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Small(), Aft()]
+
+
+class ShortCircuitTestCase(unittest.TestCase):
+    """Test case for evaluating lichens only on surviving events
+    """
+
+    def make_cuts(self):
+        cuts = Cuts()
+        cuts.lichen_list.append(Nested())
+        return cuts
+
+    def test_same_result(self):
+        """The set column is unchanged, cut columns are False once removed"""
+        expected = self.make_cuts().process(make_minitree(1000))
+        result = self.make_cuts().short_circuit().process(make_minitree(1000))
+        np.testing.assert_array_equal(result['CutCuts'], expected['CutCuts'])
+        self.assertEqual(list(result.columns), list(expected.columns))
+
+        passed = np.ones(len(result), dtype=bool)
+        for name in self.make_cuts().get_cut_names():
+            np.testing.assert_array_equal(result[name], expected[name] & passed)
+            passed &= expected[name].values
+
+    def test_full_columns(self):
+        """Cut columns can still be requested for all events"""
+        expected = self.make_cuts().process(make_minitree(1000))
+        result = self.make_cuts().short_circuit(full_columns=['CutVeto']).process(make_minitree(1000))
+        np.testing.assert_array_equal(result['CutVeto'], expected['CutVeto'])
+
+        result = self.make_cuts().short_circuit(full_columns=True).process(make_minitree(1000))
+        pd.testing.assert_frame_equal(result, expected)
+
+
+class AftCheck(StringLichen):
+    string = "aft > 0"
+
+
+class OrderTestCase(unittest.TestCase):
+    """Test case for ordering cuts by cost and selectivity
+    """
+
+    def test_order(self):
+        """The order follows the rank and respects dependencies"""
+        cuts = Cuts()
+        cuts.lichen_list.append(Aft())
+        for i, cut_name in enumerate(cuts.get_cut_names()):
+            cuts.record(cut_name, 1., 100, 100 - 10 * i)
+        order = [lichen.name() for lichen in cuts.get_order()]
+        self.assertEqual(order, cuts.get_cut_names()[::-1])
+
+        cuts.lichen_list = [Aft(), AftCheck()]
+        cuts.record('CutAft', 1., 100, 90)
+        cuts.record('CutAftCheck', 1e-3, 100, 10)
+        self.assertEqual(cuts.get_order(), cuts.lichen_list)
+
+    def test_same_result(self):
+        """Ordering does not change any column or the column order"""
+        expected = Cuts().process(make_minitree(1000))
+        cuts = Cuts().calibrate(make_minitree(1000), n_rows=100).short_circuit().order()
+        self.assertEqual(len(cuts.get_statistics()), len(cuts.lichen_list))
+
+        with self.assertWarns(UserWarning):
+            result = cuts.process(make_minitree(1000))
+        np.testing.assert_array_equal(result['CutCuts'], expected['CutCuts'])
+        self.assertEqual(list(result.columns), list(expected.columns))
+        for cut_name in cuts.get_cut_names():
+            np.testing.assert_array_equal(result[cut_name], expected[cut_name] & expected['CutCuts'])
+
+        # The reverse order gives the same columns
+        reverse = Cuts().short_circuit().order()
+        for i, cut_name in enumerate(reverse.get_cut_names()):
+            reverse.record(cut_name, 1., 100, 100 - 10 * i)
+        self.assertNotEqual([lichen.name() for lichen in reverse.get_order()],
+                            [lichen.name() for lichen in cuts.get_order()])
+        with self.assertWarns(UserWarning):
+            pd.testing.assert_frame_equal(reverse.process(make_minitree(1000)), result)
+
+    def test_full_columns(self):
+        """Full columns keep single cuts, and need no warning"""
+        expected = Cuts().process(make_minitree(1000))
+        cuts = Cuts().calibrate(make_minitree(1000), n_rows=100).short_circuit(full_columns=True).order()
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            result = cuts.process(make_minitree(1000))
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_save_load(self):
+        """Statistics survive a round trip to disk"""
+        cuts = Cuts().calibrate(make_minitree(1000))
+        filename = os.path.join(tempfile.mkdtemp(), 'order.json')
+        cuts.save_order(filename)
+        loaded = Cuts().load_order(filename)
+        self.assertEqual(loaded.get_statistics(), cuts.get_statistics())
+        self.assertEqual([lichen.name() for lichen in loaded.get_order()],
+                         [lichen.name() for lichen in cuts.get_order()])
+        with self.assertRaises(ValueError):
+            Nested().load_order(filename)
+
+
+class PackedTestCase(unittest.TestCase):
+    """Test case for bit-packed cut columns
+    """
+
+    def make_cuts(self):
+        cuts = Cuts()
+        cuts.lichen_list.append(Nested())
+        return cuts
+
+    def test_round_trip(self):
+        """All cut columns can be read back from the bits"""
+        expected = self.make_cuts().process(make_minitree(1000))
+        cuts = self.make_cuts().pack()
+        result = cuts.process(make_minitree(1000))
+        self.assertEqual(list(result.columns), list(make_minitree(1000).columns) + ['CutCuts_bits0'])
+        self.assertEqual(result['CutCuts_bits0'].dtype, np.uint64)
+
+        mask = bitmask.CutMask(result, cuts)
+        for cut_name, values in mask.to_dict().items():
+            np.testing.assert_array_equal(values, expected[cut_name])
+        np.testing.assert_array_equal(mask.passed(['CutVeto', 'CutSmall']),
+                                      expected['CutVeto'] & expected['CutSmall'])
+
+    def test_many_words(self):
+        """More than 64 cuts need more than one word"""
+        rng = np.random.RandomState(0)
+        columns = [rng.uniform(size=100) < 0.5 for _ in range(130)]
+        words = bitmask.pack(columns)
+        self.assertEqual(len(words), 3)
+        for bit, values in enumerate(columns):
+            word = words[bit // 64]
+            np.testing.assert_array_equal((word >> np.uint64(bit % 64)) & np.uint64(1), values)
+
+
+class ParallelTestCase(unittest.TestCase):
+    """Test case for processing lichens on a thread pool
+    """
+
+    def make_cuts(self):
+        cuts = Cuts()
+        cuts.lichen_list += [Aft(), Nested(), AftCheck()]
+        return cuts
+
+    def test_same_result(self):
+        """Concurrent processing gives the same result as serial"""
+        expected = self.make_cuts().process(make_minitree(1000))
+        result = self.make_cuts().parallel(4).process(make_minitree(1000))
+        pd.testing.assert_frame_equal(result, expected)
+
+        result = self.make_cuts().parallel(4).compile().process(make_minitree(1000))
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_nested(self):
+        """Nested sets process their lichens concurrently too"""
+        cuts = Cuts()
+        cuts.lichen_list.append(ManyLichen())
+        cuts.lichen_list[-1].lichen_list = [Nested(), Small()]
+        expected = cuts.process(make_minitree(1000))
+
+        result = cuts.parallel(4).process(make_minitree(1000))
+        self.assertEqual(cuts.lichen_list[-1].n_threads, 4)
+        self.assertEqual(cuts.lichen_list[-1].lichen_list[0].n_threads, 4)
+        pd.testing.assert_frame_equal(result, expected)
+
+
+class ResultsTestCase(unittest.TestCase):
+    """Test case for assembling the results of a cut set
+    """
+
+    def test_unchanged_input(self):
+        """Results are made without touching the input DataFrame"""
+        df = make_minitree(1000)
+        results = Cuts().results(df)
+        pd.testing.assert_frame_equal(df, make_minitree(1000))
+        self.assertEqual(list(results.columns), Cuts().get_result_names())
+        pd.testing.assert_frame_equal(Cuts().process(make_minitree(1000)),
+                                      pd.concat([df, results], axis=1))
+
+    def test_helper_columns(self):
+        """Kept helper columns are returned in the order they are produced"""
+        cuts = Cuts()
+        cuts.lichen_list.append(Nested())
+        results = cuts.keep().results(make_minitree(1000))
+        self.assertEqual(list(results.columns), cuts.produced_columns())
+        self.assertEqual(results['aft'].dtype, np.float64)
+
+    def test_scratch_columns(self):
+        """Helper columns are readable by later lichens, but not kept by default"""
+        cuts = Cuts()
+        cuts.lichen_list += [Aft(), AftCheck()]
+        df = make_minitree(1000)
+        result = cuts.process(df)
+        self.assertNotIn('aft', result.columns)
+        np.testing.assert_array_equal(result['CutAftCheck'], df['x'] / df['s2'] > 0)
+
+        result = cuts.keep(['aft']).process(make_minitree(1000))
+        self.assertIn('aft', result.columns)
+
+    def test_single_lichen(self):
+        """Processing a single lichen adds its cut column, and helper columns only if kept"""
+        df = make_minitree(1000)
+        result = Aft().process(df.copy())
+        self.assertEqual(list(result.columns), list(df.columns) + ['CutAft'])
+        np.testing.assert_array_equal(result['CutAft'], df['x'] / df['s2'] < 0.7)
+
+        result = Aft().keep().process(df.copy())
+        self.assertEqual(list(result.columns), list(df.columns) + ['aft', 'CutAft'])
+
+    def test_views(self):
+        """Lichens get views on the columns they read, which are not changed"""
+        df = make_minitree(1000)
+        expected = df.copy()
+        frame = Threshold().get_frame(df)
+        self.assertEqual(list(frame.columns), ['s2'])
+        self.assertTrue(np.shares_memory(frame['s2'].values, df['s2'].values))
+
+        result = Cuts().keep().process(df)
+        pd.testing.assert_frame_equal(result[list(expected.columns)], expected)
+
+
+class StreamTestCase(unittest.TestCase):
+    """Test case for processing in chunks
+    """
+
+    def test_same_result(self):
+        """Processing in chunks gives the same result"""
+        expected = Cuts().process(make_minitree(1000))
+        df = make_minitree(1000)
+        chunks = [df.iloc[:100], df.iloc[100:150], df.iloc[150:]]
+        for kwargs in [{}, {'chunk_size': 64}, {'memory': 50000}]:
+            result = pd.concat(Cuts().process_chunks([chunk.copy() for chunk in chunks], **kwargs))
+            pd.testing.assert_frame_equal(result, expected)
+
+    def test_chunk_size(self):
+        """Estimating the chunk size caches, records and profiles nothing"""
+        path = tempfile.mkdtemp()
+        cuts = Cuts().cache(path).profile()
+        self.assertGreater(stream.get_chunk_size(cuts, make_minitree(1000), 10**6), 0)
+        self.assertEqual(cuts.get_statistics(), {})
+        self.assertEqual(cuts.profiler.records, [])
+        self.assertEqual(cuts.result_cache.misses, 0)
+        self.assertEqual(os.listdir(path), [])
+
+    def test_rechunk(self):
+        """Chunks are regrouped into the requested size"""
+        df = make_minitree(1000)
+        chunks = list(stream.rechunk([df.iloc[:100], df.iloc[100:]], 300))
+        self.assertEqual([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+
+
+class WideEllipse(Ellipse):
+    def parameters(self):
+        return dict(z0=50., vz=45., p=3., vr2=2000.)
+
+
+class Subset(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Threshold(), Radius(), WideEllipse(), Nested(), AftCheck()]
+
+
+class CutSetsTestCase(unittest.TestCase):
+    """Test case for processing several cut sets, evaluating shared lichens once
+    """
+
+    def make_sets(self):
+        cuts = Cuts()
+        cuts.lichen_list.append(Nested())
+        return [cuts, Subset()]
+
+    def test_same_result(self):
+        """Same columns as processing the sets one by one"""
+        expected = make_minitree(1000)
+        for cuts in self.make_sets():
+            expected = cuts.keep().process(expected)
+
+        cut_sets = CutSets([cuts.keep() for cuts in self.make_sets()])
+        pd.testing.assert_frame_equal(cut_sets.process(make_minitree(1000)), expected)
+        # Threshold, Radius, Small and Aft (in Nested) are evaluated once
+        self.assertEqual((cut_sets.evaluated, cut_sets.reused), (10, 4))
+
+        results = cut_sets.results(make_minitree(1000))
+        self.assertEqual([list(result.columns) for result in results],
+                         [cuts.keep().results(make_minitree(1000)).columns.tolist()
+                          for cuts in self.make_sets()])
+
+    def test_reads_earlier_columns(self):
+        """A set reading the columns of an earlier set is processed after it"""
+        class Passed(StringLichen):
+            string = "CutCuts & (s2 < 3000)"
+
+        class Later(ManyLichen):
+            def __init__(self):
+                self.lichen_list = [Threshold(), Passed()]
+
+        expected = make_minitree(1000)
+        for cuts in (Cuts(), Later()):
+            expected = cuts.process(expected)
+        cut_sets = CutSets([Cuts(), Later()])
+        self.assertTrue(cut_sets.reads_earlier_columns())
+        pd.testing.assert_frame_equal(cut_sets.process(make_minitree(1000)), expected)
+        self.assertFalse(CutSets(self.make_sets()).reads_earlier_columns())
+
+    def test_result_cache(self):
+        """The result caches of the sets are used and kept"""
+        path = tempfile.mkdtemp()
+        cut_sets = CutSets([cuts.cache(path) for cuts in self.make_sets()])
+        for _ in range(2):
+            cut_sets.process(make_minitree(1000))
+        result_cache = cut_sets.cut_sets[0].result_cache
+        self.assertEqual(result_cache.hits, 8)
+        self.assertIs(cut_sets.cut_sets[0].lichen_list[-1].result_cache, result_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""Test of lax/minitrees.py"""
+import inspect
+import unittest
+
+from lax import batch, minitrees
+from lax.lichen import Lichen
+from lax.lichens import sciencerun0, sciencerun1
+
+
+class MinitreesTestCase(unittest.TestCase):
+    """Test case for finding the minitrees that cuts read
+    """
+
+    def test_cut_sets(self):
+        """The SR0 and SR1 cut sets load every minitree laxer always loaded"""
+        for science_run in (0, 1):
+            names = minitrees.required_minitrees(batch.get_cut_sets(science_run))
+            self.assertEqual(names, batch.MINITREE_NAMES)
+
+    def test_lichens(self):
+        """Every lichen of SR0 and SR1 reads columns of known minitrees"""
+        for module in (sciencerun0, sciencerun1):
+            for name, value in sorted(vars(module).items()):
+                if inspect.isclass(value) and issubclass(value, Lichen) and value.__module__ == module.__name__:
+                    # Raises KeyError on undeclared or unknown columns
+                    minitrees.required_minitrees([value()])
+
+    def test_unknown(self):
+        with self.assertRaises(KeyError):
+            minitrees.get_minitrees(['s1', 'not_a_column'])
+        self.assertEqual(minitrees.get_minitrees(['s1']), ['Fundamentals', 'Basics'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Test of lax/models.py"""
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lax import models
+
+
+class Logistic(object):
+    """Stand-in for a fitted classifier"""
+    classes_ = np.array([0, 1])
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def predict_proba(self, features):
+        p = 1 / (1 + np.exp(-self.scale * (features[:, 0] - 50)))
+        return np.column_stack([1 - p, p])
+
+
+class ModelsTestCase(unittest.TestCase):
+    """Test case for loading classifiers once and applying them in chunks
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filenames = []
+        for scale in (0.1, 1.):
+            filename = os.path.join(self.path, 'model_%s.pkl' % scale)
+            with open(filename, 'wb') as outfile:
+                pickle.dump(Logistic(scale), outfile)
+            self.filenames.append(filename)
+        models.MODELS.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        models.MODELS.clear()
+
+    def test_loaded_once(self):
+        """A file is unpickled on first use only"""
+        models.preload(self.filenames)
+        model = models.get_model(self.filenames[0])
+        os.remove(self.filenames[0])
+        self.assertIs(models.get_model(self.filenames[0]), model)
+
+    def test_chunks(self):
+        """Chunked and threaded inference gives the same probabilities"""
+        weighted = [(models.get_model(filename), 0.5) for filename in self.filenames]
+        features = np.random.RandomState(0).uniform(0, 100, (1001, 4))
+        expected = 0.5 * weighted[0][0].predict_proba(features) + \
+            0.5 * weighted[1][0].predict_proba(features)
+        np.testing.assert_array_equal(models.predict_proba(weighted, features), expected)
+        np.testing.assert_array_equal(models.predict_proba(weighted, features, 100, 4), expected)
+        self.assertEqual(models.predict_proba(weighted, features[:0]).shape, (0, 2))
+
+    def test_single_electron_s2s(self):
+        """The cut uses the cached classifiers"""
+        from lax.lichens.sciencerun0 import SingleElectronS2s
+
+        class Cut(SingleElectronS2s):
+            model_files = [(filename, 0.5) for filename in self.filenames]
+            chunk_size = 10
+
+        rng = np.random.RandomState(0)
+        df = pd.DataFrame({'s1': rng.uniform(0, 100, 100),
+                           's1_area_fraction_top': rng.uniform(0, 1, 100),
+                           's1_rise_time': rng.uniform(0, 100, 100),
+                           's1_range_90p_area': rng.uniform(0, 600, 100)})
+        result = Cut().preload().keep().process(df)
+        self.assertTrue(((result['ses2prob'] > 0.5) == (df['s1'] > 50)).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
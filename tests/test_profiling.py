@@ -0,0 +1,93 @@
+"""Test of lax/profiling.py"""
+import json
+import tracemalloc
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from lax import profiling
+from lax.lichen import ManyLichen, StringLichen
+from lax.profiling import Profiler
+from lax.synthetic import make_minitree
+
+
+class Threshold(StringLichen):
+    string = "200 < s2"
+
+
+class Inner(StringLichen):
+    string = "x < 20"
+
+
+class Nested(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Inner()]
+
+
+class Cuts(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [Threshold(), Nested()]
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """Test case for recording the resources used by each lichen
+    """
+
+    def test_records(self):
+        """Nested lichens are recorded with their path and row counts"""
+        df = make_minitree(1000)
+        cuts = Cuts().profile(memory=True)
+        for _ in range(2):
+            cuts.process(df)
+        summary = cuts.profiler.to_dataframe()
+        # In the order in which the measurements end
+        self.assertEqual(list(summary.index),
+                         ['CutCuts.CutThreshold', 'CutCuts.CutNested.CutInner',
+                          'CutCuts.CutNested', 'CutCuts'])
+        self.assertTrue((summary['calls'] == 2).all())
+        self.assertEqual(summary.loc['CutCuts.CutThreshold', 'passed'],
+                         2 * (df['s2'] > 200).sum())
+        self.assertTrue((summary['peak_memory'] >= 0).all())
+        self.assertTrue(summary.loc['CutCuts', 'peak_memory'] >=
+                        summary.loc['CutCuts.CutNested', 'peak_memory'])
+
+        report = json.loads(cuts.profiler.to_json())
+        self.assertEqual(report[0]['name'], 'CutCuts.CutThreshold')
+
+    def test_disabled(self):
+        """Without profiling nothing is recorded, a profiler can be shared"""
+        cuts = Cuts()
+        cuts.process(make_minitree(1000))
+        self.assertIsNone(cuts.profiler)
+
+        profiler = Profiler()
+        Cuts().profile(profiler).process(make_minitree(1000))
+        Nested().profile(profiler).process(make_minitree(1000))
+        self.assertIn('CutNested.CutInner', profiler.to_dataframe().index)
+
+    def test_single_lichen(self):
+        """Processing a lichen on its own is recorded too"""
+        df = make_minitree(1000)
+        threshold = Threshold().profile(memory=True)
+        threshold.process(df.copy())
+        summary = threshold.profiler.to_dataframe()
+        self.assertEqual(list(summary.index), ['CutThreshold'])
+        self.assertEqual(summary.loc['CutThreshold', 'rows'], 1000)
+        self.assertEqual(summary.loc['CutThreshold', 'passed'], (df['s2'] > 200).sum())
+
+    def test_without_reset_peak(self):
+        """Before Python 3.9 the traces are cleared instead of resetting the peak"""
+        functions = ('start', 'stop', 'is_tracing', 'get_traced_memory', 'clear_traces')
+        old_tracemalloc = SimpleNamespace(**dict((name, getattr(tracemalloc, name))
+                                                 for name in functions))
+        with mock.patch.object(profiling, 'tracemalloc', old_tracemalloc):
+            cuts = Cuts().profile(memory=True)
+            cuts.process(make_minitree(1000))
+        summary = cuts.profiler.to_dataframe()
+        self.assertTrue((summary['peak_memory'] >= summary['allocated_memory']).all())
+        self.assertTrue(summary.loc['CutCuts', 'peak_memory'] >=
+                        summary.loc['CutCuts.CutNested', 'peak_memory'])
+
+
+if __name__ == '__main__':
+    unittest.main()
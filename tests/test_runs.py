@@ -0,0 +1,73 @@
+"""Test of lax/runs.py"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lax import runs
+
+END_TIMES = {6731: 1500000000 * 10**9, 6732: 1500003600 * 10**9, 6740: 1500010000 * 10**9}
+
+
+class CountingSource(object):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, run_numbers):
+        self.calls.append(list(run_numbers))
+        return dict((run_number, END_TIMES[run_number]) for run_number in run_numbers)
+
+
+class RunsTestCase(unittest.TestCase):
+    """Test case for the run end time cache
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        runs.configure()
+
+    def test_gather(self):
+        """Every event gets the end time of its run"""
+        run_numbers = np.array([6740, 6731, 6732, 6731, 6740])
+        end_times = runs.RunEndTimes(source=CountingSource()).get(run_numbers)
+        np.testing.assert_array_equal(end_times, [END_TIMES[run] for run in run_numbers])
+
+    def test_persistent(self):
+        """End times are asked once, also by later jobs"""
+        filename = os.path.join(self.path, 'end_times.json')
+        source = CountingSource()
+        runs.RunEndTimes(filename, source).get([6731, 6732])
+        runs.RunEndTimes(filename, source).get([6731, 6732, 6740])
+        self.assertEqual(source.calls, [[6731, 6732], [6740]])
+
+        # The cache file can stand in for the runs DB
+        end_times = runs.RunEndTimes(source=runs.FileSource(filename)).get([6740])
+        self.assertEqual(end_times[0], END_TIMES[6740])
+        with self.assertRaises(KeyError):
+            runs.RunEndTimes(source=runs.FileSource(filename)).get([1])
+
+    def test_end_of_run_check(self):
+        """Events in the last 21 seconds of a run fail"""
+        from lax.lichens.sciencerun0 import DAQVeto
+
+        filename = os.path.join(self.path, 'runs.json')
+        with open(filename, 'w') as outfile:
+            json.dump(dict((str(run), end) for run, end in END_TIMES.items()), outfile)
+        runs.configure(source=runs.FileSource(filename))
+
+        df = pd.DataFrame({'run_number': [6731, 6731, 6732, 6732],
+                           'event_time': [END_TIMES[6731] - int(30e9), END_TIMES[6731] - int(10e9),
+                                          END_TIMES[6732] - int(30e9), END_TIMES[6732] - int(10e9)]})
+        result = DAQVeto.EndOfRunCheck().process(df)
+        self.assertEqual(list(result['CutEndOfRunCheck']), [True, False, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
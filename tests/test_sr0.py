@@ -9,10 +9,21 @@ Tests for `lax` module.
 """
 
 
-import pandas as pd
+import json
+import os
 
+import numpy as np
 
-from lax.lichens import sciencerun0
+
+from scipy.optimize import brentq
+from scipy.special import betainc, digamma
+from scipy.interpolate import RegularGridInterpolator
+from scipy.stats import beta, binom, chi2
+
+from lax import runs
+from lax.lichen import ManyLichen
+from lax.lichens import sciencerun0, sciencerun1
+from lax.synthetic import make_minitree
 
 
 
@@ -20,14 +31,279 @@ from lax.lichens import sciencerun0
 import unittest
 
 
+def without_classifier(cuts):
+    """Leave SingleElectronS2s out of a cut set if its classifier is missing"""
+    if not all(os.path.exists(os.path.join(sciencerun0.DATA_DIR, filename))
+               for filename, _ in sciencerun0.SingleElectronS2s.model_files):
+        # The classifier is not in every checkout
+        cuts.lichen_list = [lichen for lichen in cuts.lichen_list
+                            if not isinstance(lichen, sciencerun0.SingleElectronS2s)]
+    return cuts
+
+
 class SR0Testcase(unittest.TestCase):
+    def tearDown(self):
+        runs.configure()
+
     def test_low_energy(self):
-        df = pd.read_hdf('/Users/tunnell/Work/XENON/Analysis/Discrimination/discrimination.h5', 'table')
-        sciencerun0.LowEnergy().process(df)
+        """The low energy background cuts run on synthetic minitrees"""
+        # Synthetic runs never end
+        runs.configure(source=lambda run_numbers: dict.fromkeys(run_numbers, 2**62))
+        cuts = without_classifier(sciencerun0.LowEnergyBackground())
+        df = make_minitree(2000)
+        result = cuts.process(df.copy())
+        self.assertEqual(list(result.columns), list(df.columns) + cuts.get_result_names())
+        passed = np.ones(len(df), dtype=bool)
+        for cut_name in cuts.get_cut_names():
+            passed &= result[cut_name].values
+        np.testing.assert_array_equal(result['CutLowEnergyBackground'], passed)
+        self.assertTrue(passed.any())
+
+    def test_ambe_fiducial(self):
+        """The radius and distance to the source are only added if kept"""
+        df = make_minitree(1000)
+        result = sciencerun0.AmBeFiducial().process(df.copy())
+        self.assertEqual(list(result.columns), list(df.columns) + ['CutAmBeFiducial'])
+        result = sciencerun0.AmBeFiducial().keep(['r']).process(df.copy())
+        np.testing.assert_array_equal(result['r'], np.sqrt(df['x']**2 + df['y']**2))
+
+    def test_cs2_aft_96p(self):
+        """The cS2 area fraction top is computed for the cut on its own"""
+        df = make_minitree(1000)
+        result = sciencerun0.CS2AreaFractionTop96p().process(df.copy())
+        np.testing.assert_array_equal(result['CutCS2AreaFractionTop96p'],
+                                      (df['cs2_top'] / df['cs2'] < 0.63594139 + 0.912103 / np.sqrt(df['s2'])) |
+                                      (df['z'] < -9))
+
+    def test_cut_set_keep(self):
+        """Derived variables read by the lichens of a cut set can be kept"""
+        runs.configure(source=lambda run_numbers: dict.fromkeys(run_numbers, 2**62))
+
+        def make_cuts():
+            cuts = without_classifier(sciencerun1.LowEnergyAmBe())
+            cuts.lichen_list.append(sciencerun1.NGFiducial())
+            return cuts
+
+        df = make_minitree(1000)
+        kept = ['r', 'distance_to_source', 'cs2_aft']
+        result = make_cuts().process(df.copy())
+        self.assertFalse(set(kept) & set(result.columns))
+
+        result = make_cuts().keep(kept).process(df.copy())
+        np.testing.assert_array_equal(result['r'], np.sqrt(df['x']**2 + df['y']**2))
+        np.testing.assert_array_equal(result['cs2_aft'], df['cs2_top'] / df['cs2'])
+        np.testing.assert_allclose(result['distance_to_source'],
+                                   np.sqrt((31.6 - df['x'])**2 + (86.8 - df['y'])**2 + (-50 - df['z'])**2))
+
+        result = make_cuts().keep().process(df.copy())
+        self.assertTrue(set(kept) <= set(result.columns))
+
+
+class FourLeafCloverTestCase(unittest.TestCase):
+    """Test case for the phi dependent fiducial volume
+    """
+
+    def test_find_nearest(self):
+        """Same indices as the full difference matrix, also on ties and NaN"""
+        phi_values = sciencerun0.get_r_phi_curve()[0]
+        values = np.concatenate([np.random.RandomState(0).uniform(-4, 4, 10000), phi_values,
+                                 (phi_values[1:] + phi_values[:-1]) / 2, [np.nan, -np.inf, np.inf]])
+        expected = np.abs(np.subtract.outer(phi_values, values)).argmin(0)
+        np.testing.assert_array_equal(sciencerun0.find_nearest(phi_values, values), expected)
+
+    def test_same_result(self):
+        """Same radii as reading the curve and using the full matrix"""
+        df = make_minitree(5000)
+        df.loc[::50, 'x'] = np.nan
+        result = sciencerun0.FiducialFourLeafClover1250kg().keep().process(df.copy())
+
+        curve = np.array([[float(value) for value in line.split()] for line in
+                          open(sciencerun0.os.path.join(sciencerun0.DATA_DIR, 'R_phi_curve_360points.txt'))])
+        phi = np.arctan2(df['y'], df['x'])
+        nearest = np.abs(np.subtract.outer(curve[:, 0], phi.values)).argmin(0)
+        R = curve[nearest, 1]
+        r_max = (41 / np.average(curve[:, 1])) * np.sqrt(
+            (((R + 1) ** 2 - (R - 1) ** 2) / 83.9) * (df['z'] - (-83.9 / 2 - 9) + (83.9 / 2)) + (R - 1) ** 2)
+        np.testing.assert_array_equal(result['r_max'], r_max)
+        np.testing.assert_array_equal(result['r_phi'], np.sqrt(df['x'] ** 2 + df['y'] ** 2))
+
+
+class WidthTestCase(unittest.TestCase):
+    """Test case for the S2 width cuts computing the chi2 density directly
+    """
+
+    def make_df(self):
+        df = make_minitree(5000)
+        df.loc[::10, 's2'] = 0
+        df.loc[::13, 's2_range_50p_area'] = 0
+        df.loc[::17, 'drift_time'] = np.nan
+        return df
+
+    def test_chi2_logpdf(self):
+        x = np.array([-1, 0, 0, 0, 0.5, 3, 100, np.nan, 1, np.inf])
+        df = np.array([3, 1, 2, 3, 0.5, 4, 7, 2, 0, 3])
+        expected = chi2.logpdf(x, df)
+        result = sciencerun0.chi2_logpdf(x, df)
+        np.testing.assert_array_equal(result > -14, expected > -14)
+        valid = np.isfinite(expected)
+        np.testing.assert_array_equal(result[valid], expected[valid])
+
+    def test_same_result(self):
+        """Same results as with scipy.stats and DataFrame masks, for SR0 and SR1"""
+        for module in (sciencerun0, sciencerun1):
+            width = module.S2Width
+            df = self.make_df()
+            result = width().keep().process(df.copy())
+            mask = df.drift_time > width.DriftTimeFromGate
+            n_electron = np.clip(df.loc[mask, 's2'], 0, 5000) / width.scg
+            norm_width = (np.square(df.loc[mask, 's2_range_50p_area'] / width.SigmaToR50) -
+                          np.square(width.scw)) / np.square(width.s2_width_model(df.loc[mask, 'drift_time']))
+            expected = np.ones(len(df), dtype=bool)
+            expected[mask.values] = chi2.logpdf(norm_width * (n_electron - 1), n_electron) > -14
+            np.testing.assert_array_equal(result['CutS2Width'], expected)
+            self.assertEqual(list(width().process(df.copy()).columns), list(df.columns) + ['CutS2Width'])
+            np.testing.assert_array_equal(result.loc[mask, 'normWidth'], norm_width)
+            self.assertTrue(result.loc[~mask, 'nElectron'].isnull().all())
+
+            result = module.S1SingleScatter().process(df.copy())
+            mask = df.alt_s1_interaction_drift_time > width.DriftTimeFromGate
+            n_electron = np.clip(df.loc[mask, 's2'], 0, 5000) / width.scg
+            norm_width = (np.square(df.loc[mask, 's2_range_50p_area'] / width.SigmaToR50) -
+                          np.square(width.scw))
+            norm_width /= np.square(width.s2_width_model(df.loc[mask, 'alt_s1_interaction_drift_time']))
+            expected = np.ones(len(df), dtype=bool)
+            expected[mask.values] = ~(chi2.logpdf(norm_width * (n_electron - 1), n_electron) > -20)
+            np.testing.assert_array_equal(result['CutS1SingleScatter'], expected)
+
+
+class Scan(ManyLichen):
+    def __init__(self):
+        self.lichen_list = [sciencerun1.FiducialTestEllipsScan()]
+
+
+class FiducialTestEllipsScanTestCase(unittest.TestCase):
+    """Test case for evaluating all test fiducial volumes in one pass
+    """
+
+    def test_same_result(self):
+        """Same cut columns as the separate cuts, for SR0 and SR1"""
+        for module in (sciencerun0, sciencerun1):
+            df = make_minitree(5000)
+            df.loc[::50, 'z_3d_nn'] = np.nan
+            cut = module.FiducialTestEllipsScan()
+            cut.chunk_size = 1234
+            result = cut.process(df.copy())
+            self.assertEqual(list(result.columns), list(df.columns) + cut.produced_columns())
+            index = result['FiducialTestEllipsIndex'].values
+            self.assertEqual(index.dtype, np.int8)
+            expected_index = np.full(len(df), -1)
+            for i, (mass, _) in reversed(list(enumerate(module.FV_CONFIGS))):
+                name = 'FiducialTestEllips%d' % mass
+                expected = getattr(module, name)().process(df.copy())['Cut' + name]
+                np.testing.assert_array_equal(result['Cut' + name], expected)
+                expected_index[expected.values] = i
+            np.testing.assert_array_equal(index, expected_index)
+            np.testing.assert_array_equal(result['CutFiducialTestEllipsScan'], index >= 0)
+            self.assertTrue((index[::50] == -1).all())
+
+    def test_cut_set(self):
+        """Cut sets add the volumes and the index too"""
+        df = make_minitree(1000)
+        result = Scan().process(df.copy())
+        expected = sciencerun1.FiducialTestEllipsScan().process(df.copy())
+        for column in sciencerun1.FiducialTestEllipsScan().produced_columns():
+            np.testing.assert_array_equal(result[column], expected[column])
+
+
+def binom_logpmf(k, n, p):
+    """Binomial log probability continuous in k and n, from the beta density at p
+
+    scipy.stats.binom.logpmf is -inf off the integers.
+    """
+    return beta.logpdf(p, k + 1, n - k + 1) - np.log(n + 1)
+
+
+def binom_test(k, n, p):
+    """Reference binomial test for one event, solving with brentq"""
+    def slope(x):
+        return digamma(n - x + 1) - digamma(x + 1) + np.log(p) - np.log1p(-p)
+
+    offset = binom_logpmf(k, n, p)
+
+    def difference(x):
+        return binom_logpmf(x, n, p) - offset
+
+    if slope(0) < 0 or slope(n) > 0:
+        mode = 0 if slope(0) < 0 else n
+    else:
+        mode = brentq(slope, 0, n, xtol=1e-14)
+    if k == mode:
+        return 1
+    if k < mode:
+        lower, upper = k, n if difference(n) >= 0 else brentq(difference, mode, n, xtol=1e-14)
+    else:
+        lower, upper = 0 if difference(0) >= 0 else brentq(difference, 0, mode, xtol=1e-14), k
+    p_value = 0
+    if lower > 0:
+        p_value += betainc(n - lower, lower + 1, 1 - p)
+    if upper < n:
+        p_value += betainc(upper + 1, n - upper, p)
+    return min(p_value, 1)
+
+
+class S1AreaFractionTopTestCase(unittest.TestCase):
+    """Test case for computing the S1 area fraction top p-value in lax
+    """
+
+    def test_binom_logpmf(self):
+        """The reference is the binomial distribution on the integers"""
+        k, n = np.meshgrid(np.arange(50), np.arange(1, 50))
+        valid = k <= n
+        np.testing.assert_allclose(binom_logpmf(k[valid], n[valid], 0.3),
+                                   binom.logpmf(k[valid], n[valid], 0.3), rtol=1e-10)
+
+    def test_binom_test(self):
+        rng = np.random.RandomState(0)
+        n = 10 ** rng.uniform(-1, 5, 500)
+        p = rng.uniform(0.01, 0.99, 500)
+        k = n * np.clip(rng.normal(p, 0.1), 0, 1)
+        expected = [binom_test(*args) for args in zip(k, n, p)]
+        np.testing.assert_allclose(sciencerun0.binom_test(k, n, p), expected, rtol=0, atol=1e-9)
+
+        result = sciencerun0.binom_test([1, np.nan, 2, 1, 1], [0, 3, 1, 2, 2], [0.3, 0.3, 0.3, 0, np.nan])
+        self.assertTrue(np.isnan(result).all())
+
+    def test_cut(self):
+        """Only needs basic minitree columns"""
+        cut = sciencerun0.S1AreaFractionTop()
+        self.assertNotIn('s1_area_fraction_top_probability_hax', cut.required_columns())
+
+        df = make_minitree(2000)
+        df.loc[::100, 'z'] = np.nan
+        df.loc[1::100, 's1_area_fraction_top'] = 1
+        result = cut.keep().process(df.copy())
+        probability = result['s1_area_fraction_top_probability']
+        self.assertTrue(probability[::100].isnull().all())
+        self.assertTrue((probability[1::100] < 0.001).all())
+        np.testing.assert_array_equal(result['CutS1AreaFractionTop'], probability > 0.001)
+        self.assertGreater(result['CutS1AreaFractionTop'].mean(), 0.8)
+
+    def test_hax(self):
+        """Same p-values as the hax treemaker, which interpolates the map linearly"""
+        with open(os.path.join(sciencerun0.DATA_DIR, 's1_aft_rz_02Mar2017.json')) as infile:
+            aft_map = json.load(infile)
+        r_pts, z_pts = np.array(aft_map['r_pts']), np.array(aft_map['z_pts'])
+        interpolator = RegularGridInterpolator(
+            (r_pts, z_pts), np.array(aft_map['map']).reshape(len(r_pts), len(z_pts)))
 
-        #self.assertIsInstance(variables.get_variables(),
-        #                      OrderedDict)
+        df = make_minitree(100)
+        r = np.sqrt(df['x'] ** 2 + df['y'] ** 2)
+        aft = interpolator(np.column_stack([r, df['z']]))
+        s1 = df['s1'].values
+        hax = [binom_test(*args) for args in zip(s1 * df['s1_area_fraction_top'].values, s1, aft)]
 
+        result = sciencerun0.S1AreaFractionTop().keep().process(df)
+        np.testing.assert_allclose(result['s1_area_fraction_top_probability'], hax, rtol=0, atol=1e-9)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,37 @@
+"""Test of lax/synthetic.py"""
+import unittest
+
+import numpy as np
+
+from lax.minitrees import MINITREE_COLUMNS
+from lax.synthetic import iter_minitree, make_minitree
+
+
+class SyntheticTestCase(unittest.TestCase):
+    """Test case for the synthetic minitrees used by the benchmarks
+    """
+
+    def test_columns(self):
+        """Every minitree column is present"""
+        df = make_minitree(100)
+        self.assertEqual(len(df), 100)
+        for columns in MINITREE_COLUMNS.values():
+            for column in columns:
+                self.assertIn(column, df.columns)
+        self.assertTrue(np.isnan(df['largest_other_s2']).any())
+
+    def test_seed(self):
+        """The same seed gives the same minitree"""
+        self.assertTrue(make_minitree(100, seed=1).equals(make_minitree(100, seed=1)))
+        self.assertFalse(make_minitree(100, seed=1).equals(make_minitree(100, seed=2)))
+
+    def test_chunks(self):
+        """Chunks continue the event numbers"""
+        chunks = list(iter_minitree(250, 100))
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 100, 50])
+        event_numbers = np.concatenate([chunk['event_number'].values for chunk in chunks])
+        np.testing.assert_array_equal(event_numbers, np.arange(250))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Test of lax/trees.py"""
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from lax import models, trees
+
+try:
+    from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+except ImportError:
+    GradientBoostingClassifier = RandomForestClassifier = None
+
+
+def make_sample(n=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    features = rng.uniform(0, 1, (n, 4)) * [200, 1, 100, 1000]
+    labels = (features[:, 0] / 200 + features[:, 1] + rng.normal(0, 0.3, n)) > 1
+    return features, labels.astype(int)
+
+
+@unittest.skipIf(RandomForestClassifier is None, 'needs scikit-learn')
+class TreesTestCase(unittest.TestCase):
+    """Test case for converting and evaluating tree ensembles
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        models.MODELS.clear()
+
+    def assert_same(self, model):
+        features, labels = make_sample()
+        model.fit(features, labels)
+        filename = os.path.join(self.path, 'model.pkl')
+        with open(filename, 'wb') as outfile:
+            pickle.dump(model, outfile)
+
+        ensemble = trees.load(trees.convert(filename))
+        test_features, _ = make_sample(seed=1)
+        np.testing.assert_allclose(ensemble.predict_proba(test_features),
+                                   model.predict_proba(test_features), atol=1e-10)
+        self.assertIsInstance(models.get_model(filename), trees.TreeEnsemble)
+
+        # scikit-learn refuses NaN, the ensemble does not classify those events
+        test_features[::7, 2] = np.nan
+        result = ensemble.predict_proba(test_features)
+        self.assertTrue(np.isnan(result[::7]).all())
+        self.assertFalse(np.isnan(np.delete(result, np.s_[::7], axis=0)).any())
+
+    def test_forest(self):
+        self.assert_same(RandomForestClassifier(n_estimators=20, max_depth=8, random_state=0))
+
+    def test_boosting(self):
+        self.assert_same(GradientBoostingClassifier(n_estimators=30, max_depth=4, random_state=0))
+
+
+# One split on the first feature at 0.5, as written by flatten
+STUMP = dict(kind=np.array('forest'), classes=np.array([0, 1]), offset=np.array(0.),
+             max_depth=np.array(1), roots=np.array([0]),
+             left=np.array([1, 1, 2]), right=np.array([2, 1, 2]), feature=np.array([0, 0, 0]),
+             threshold=np.array([0.5, np.inf, np.inf]),
+             value=np.array([[0.5, 0.5], [1., 0.], [0., 1.]]))
+
+
+class TreeEnsembleTestCase(unittest.TestCase):
+    """Test case for evaluating flattened trees, without scikit-learn
+    """
+
+    def test_nan(self):
+        """Events with a NaN feature get NaN probabilities"""
+        ensemble = trees.TreeEnsemble(STUMP)
+        result = ensemble.predict_proba(np.array([[0., 1.], [1., 1.], [np.nan, 1.], [1., np.nan]]))
+        np.testing.assert_array_equal(result, [[1., 0.], [0., 1.], [np.nan, np.nan], [np.nan, np.nan]])
+
+
+if __name__ == '__main__':
+    unittest.main()